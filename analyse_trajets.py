@@ -0,0 +1,226 @@
+"""Colonnes numériques des résultats et statistiques vectorisées.
+
+En plus des textes localisés de Google ('1 heure 12 min', '35,2 km'), chaque
+résultat conserve les valeurs brutes en secondes et en mètres dans des
+colonnes typées, et un code de statut catégoriel. Les statistiques par mode et
+par jour de la semaine sont calculées sur ces colonnes, sans relire de texte,
+et cumulées bloc par bloc : un calcul en flux n'a pas à relire ses résultats.
+"""
+import numpy as np
+import pandas as pd
+
+from options_trajets import JOURS_SEMAINE
+
+COLONNE_DUREE = 'Durée (s)'
+COLONNE_DUREE_TRAFIC = 'Durée avec trafic (s)'
+COLONNE_DISTANCE = 'Distance (m)'
+COLONNE_CODE = 'Code statut'
+COLONNE_DEPART = 'Départ'
+
+COLONNES_NUMERIQUES = [COLONNE_DUREE, COLONNE_DUREE_TRAFIC, COLONNE_DISTANCE, COLONNE_CODE, COLONNE_DEPART]
+
+# Statuts des éléments Distance Matrix, plus les statuts propres à l'outil
+CODES_STATUT = [
+    'OK',
+    'ESTIME',
+    'SUR_PLACE',
+    'NOT_FOUND',
+    'ZERO_RESULTS',
+    'MAX_ROUTE_LENGTH_EXCEEDED',
+    'ERREUR_API',
+    'ERREUR_SAISIE',
+]
+
+# Trajets ayant une durée : calculés par l'API, estimés d'après des trajets connus ou sur place
+CODES_CALCULES = ['OK', 'ESTIME', 'SUR_PLACE']
+
+PERCENTILES = [0.5, 0.9, 0.95]
+
+# Histogramme des durées pour les percentiles : cases de 10 s, jusqu'à 48 h (au-delà, dernière case)
+PAS_HISTOGRAMME = 10
+CASES_HISTOGRAMME = 48 * 3600 // PAS_HISTOGRAMME
+
+
+def valeurs_numeriques(element, erreur):
+    """Retourne (duree_s, duree_trafic_s, distance_m, code) d'un élément de réponse"""
+    if erreur:
+        return None, None, None, 'ERREUR_API'
+    if element['status'] != 'OK':
+        return None, None, None, element['status']
+    trafic = element.get('duration_in_traffic')
+    return (
+        element['duration']['value'],
+        trafic['value'] if trafic else None,
+        element['distance']['value'],
+        'ESTIME' if element.get('estime') else 'SUR_PLACE' if element.get('sur_place') else 'OK'
+    )
+
+
+def categoriser_codes(codes):
+    """Codes de statut en catégorie ; un code inattendu de l'API reste visible plutôt que de devenir NaN"""
+    inattendus = sorted(set(pd.Series(codes).dropna()) - set(CODES_STATUT))
+    return pd.Categorical(codes, categories=CODES_STATUT + inattendus)
+
+
+class TamponResultats:
+    """Résultats rangés dans des colonnes pré-allouées, alignées sur l'index du fichier d'entrée.
+
+    Chaque réponse est écrite à sa position dès son arrivée, sans dict par
+    ligne ni copie des colonnes du fichier ; `table()` assemble ensuite les
+    colonnes typées en un DataFrame, sans repasser par les lignes. Une ligne
+    pas encore calculée n'a pas de code de statut.
+    """
+
+    def __init__(self, index, departs=None):
+        taille = len(index)
+        self.index = index
+        self.temps = np.full(taille, '-', dtype=object)
+        self.distance = np.full(taille, '-', dtype=object)
+        self.statut = np.full(taille, 'En attente', dtype=object)
+        self.duree = np.full(taille, np.nan)
+        self.duree_trafic = np.full(taille, np.nan)
+        self.distance_m = np.full(taille, np.nan)
+        self.code = np.full(taille, None, dtype=object)
+        self.depart = np.full(taille, np.datetime64('NaT'), dtype='datetime64[ns]')
+        if departs is not None:
+            self.depart[:] = pd.to_datetime(departs).to_numpy(dtype='datetime64[ns]')
+
+    def erreur_saisie(self, position, message):
+        """Ligne non envoyée à l'API (valeur invalide, adresse introuvable)"""
+        self.temps[position] = 'Erreur'
+        self.statut[position] = message
+        self.code[position] = 'ERREUR_SAISIE'
+        self.depart[position] = np.datetime64('NaT')
+
+    def ecrire(self, position, textes, element, erreur):
+        """Range la réponse d'un trajet : `textes` = (temps, distance, statut) affichés"""
+        self.temps[position], self.distance[position], self.statut[position] = textes
+        duree, duree_trafic, distance, code = valeurs_numeriques(element, erreur)
+        self.duree[position] = np.nan if duree is None else duree
+        self.duree_trafic[position] = np.nan if duree_trafic is None else duree_trafic
+        self.distance_m[position] = np.nan if distance is None else distance
+        self.code[position] = code
+
+    def ligne(self, position):
+        """Résultat d'une ligne en dict sérialisable (journal de reprise)"""
+        def entier(valeur):
+            return None if np.isnan(valeur) else int(valeur)
+        depart = self.depart[position]
+        return {
+            'Temps de trajet': self.temps[position],
+            'Distance': self.distance[position],
+            'Statut': self.statut[position],
+            COLONNE_DUREE: entier(self.duree[position]),
+            COLONNE_DUREE_TRAFIC: entier(self.duree_trafic[position]),
+            COLONNE_DISTANCE: entier(self.distance_m[position]),
+            COLONNE_CODE: self.code[position],
+            COLONNE_DEPART: None if np.isnat(depart) else str(pd.Timestamp(depart)),
+        }
+
+    def restaurer(self, position, resultat):
+        """Range un résultat relu du journal (dict produit par `ligne`)"""
+        self.temps[position] = resultat['Temps de trajet']
+        self.distance[position] = resultat['Distance']
+        self.statut[position] = resultat['Statut']
+        for colonne, valeurs in ((COLONNE_DUREE, self.duree), (COLONNE_DUREE_TRAFIC, self.duree_trafic),
+                                 (COLONNE_DISTANCE, self.distance_m)):
+            valeur = resultat.get(colonne)
+            valeurs[position] = np.nan if valeur is None else valeur
+        self.code[position] = resultat.get(COLONNE_CODE)
+        self.depart[position] = pd.Timestamp(resultat.get(COLONNE_DEPART)).to_datetime64()
+
+    def table(self):
+        """DataFrame des résultats : durées et distance en Int32, code de statut catégoriel"""
+        return pd.DataFrame({
+            'Temps de trajet': self.temps,
+            'Distance': self.distance,
+            'Statut': self.statut,
+            COLONNE_DUREE: pd.array(self.duree, dtype='Int32'),
+            COLONNE_DUREE_TRAFIC: pd.array(self.duree_trafic, dtype='Int32'),
+            COLONNE_DISTANCE: pd.array(self.distance_m, dtype='Int32'),
+            COLONNE_CODE: categoriser_codes(self.code),
+            COLONNE_DEPART: self.depart,
+        }, index=self.index, copy=False)
+
+
+def _percentile(histogramme, p):
+    """Percentile d'un histogramme des durées, interpolé dans sa case (secondes)"""
+    cumul = np.cumsum(histogramme)
+    rang = p * cumul[-1]
+    case = int(np.searchsorted(cumul, rang))
+    avant = cumul[case - 1] if case else 0
+    return (case + (rang - avant) / histogramme[case]) * PAS_HISTOGRAMME
+
+
+class StatistiquesTrajets:
+    """Statistiques par mode et par jour de la semaine, cumulées bloc par bloc.
+
+    Seuls les trajets calculés par l'API (code OK) sont comptés. Chaque groupe
+    garde des agrégats partiels : nombre de trajets, sommes des kilomètres,
+    des heures et des surcoûts de trafic, histogramme des durées. Les
+    percentiles sont lus dans l'histogramme, à une case (10 s) près.
+    """
+
+    def __init__(self):
+        # groupe ('par_mode' ou 'par_jour') -> {clé: agrégats}
+        self._groupes = {'par_mode': {}, 'par_jour': {}}
+
+    def ajouter(self, resultats, modes):
+        """Cumule un bloc de résultats ; `modes` est la colonne de modes du fichier, alignée"""
+        ok = (resultats[COLONNE_CODE] == 'OK').to_numpy(dtype=bool) \
+            & resultats[COLONNE_DUREE].notna().to_numpy(dtype=bool)
+        if not ok.any():
+            return
+        duree = resultats[COLONNE_DUREE].to_numpy(dtype='float64', na_value=np.nan)[ok]
+        donnees = pd.DataFrame({
+            'Mode': pd.Series(modes).astype(str).str.upper().to_numpy()[ok],
+            'Jour': pd.to_datetime(resultats[COLONNE_DEPART], errors='coerce').dt.dayofweek.to_numpy()[ok],
+            '_case': np.minimum(duree // PAS_HISTOGRAMME, CASES_HISTOGRAMME - 1).astype(np.int64),
+            '_km': resultats[COLONNE_DISTANCE].to_numpy(dtype='float64', na_value=np.nan)[ok] / 1000,
+            '_h': duree / 3600,
+            '_surcout': resultats[COLONNE_DUREE_TRAFIC].to_numpy(dtype='float64', na_value=np.nan)[ok] / duree - 1,
+        })
+        for groupe, colonne in (('par_mode', 'Mode'), ('par_jour', 'Jour')):
+            agregats = self._groupes[groupe]
+            for cle, lignes in donnees.dropna(subset=[colonne]).groupby(colonne):
+                cumul = agregats.setdefault(cle, {
+                    'histogramme': np.zeros(CASES_HISTOGRAMME, dtype=np.int64),
+                    'km': 0.0, 'h': 0.0, 'surcout': 0.0, 'avec_trafic': 0,
+                })
+                cumul['histogramme'] += np.bincount(lignes['_case'], minlength=CASES_HISTOGRAMME)
+                cumul['km'] += lignes['_km'].sum()
+                cumul['h'] += lignes['_h'].sum()
+                cumul['surcout'] += lignes['_surcout'].sum()
+                cumul['avec_trafic'] += int(lignes['_surcout'].count())
+
+    def _table(self, groupe):
+        agregats = self._groupes[groupe]
+        cles = sorted(agregats)
+        stats = pd.DataFrame({'Trajets': [int(agregats[cle]['histogramme'].sum()) for cle in cles]},
+                             index=cles, dtype='int64')
+        for p in PERCENTILES:
+            stats[f"Durée p{int(p * 100)} (min)"] = [_percentile(agregats[cle]['histogramme'], p) / 60
+                                                      for cle in cles]
+        stats['Vitesse moyenne (km/h)'] = [agregats[cle]['km'] / agregats[cle]['h'] if agregats[cle]['h']
+                                           else np.nan for cle in cles]
+        stats['Surcoût trafic moyen (%)'] = [agregats[cle]['surcout'] / agregats[cle]['avec_trafic'] * 100
+                                             if agregats[cle]['avec_trafic'] else np.nan for cle in cles]
+        return stats.round(1)
+
+    def resume(self):
+        """Retourne un dict {'par_mode': DataFrame, 'par_jour': DataFrame}"""
+        par_mode = self._table('par_mode')
+        par_mode.index.name = 'Mode'
+        par_jour = self._table('par_jour')
+        par_jour.index = [JOURS_SEMAINE[int(jour)] for jour in par_jour.index]
+        return {'par_mode': par_mode, 'par_jour': par_jour}
+
+
+def resumer_trajets(df, colonne_mode):
+    """Statistiques par mode et par jour de la semaine d'un tableau de résultats complet.
+
+    Retourne un dict {'par_mode': DataFrame, 'par_jour': DataFrame}.
+    """
+    statistiques = StatistiquesTrajets()
+    statistiques.ajouter(df, df[colonne_mode])
+    return statistiques.resume()
@@ -1,10 +1,32 @@
 import streamlit as st
-import googlemaps
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-import time
+from datetime import datetime
+import hashlib
 import io
 
+from analyse_trajets import CODES_CALCULES, COLONNE_CODE, resumer_trajets
+from balayage_trajets import balayer, grille_creneaux, profils_balayage, resumer_balayage
+from cache_trajets import CacheTrajets
+from limiteur_debit import LimiteurDebit
+from estimation_trajets import IndexTrajets
+from formats_fichiers import FORMATS, TYPES_MIME, lire_table, table_en_octets
+from geocodage import CacheAdresses, geocoder_adresses
+from matrice_trajets import calculer_matrice, enregistrer_matrice, k_plus_proches, plus_proches, table_matrice
+from metriques import MetriquesAppels, PRIX_ELEMENT, PRIX_GEOCODAGE
+from moteurs_itineraire import creer_moteur
+from noyau_trajets import (
+    adresses_matrice, calculer_trajets, paires_balayage, preparer_parametres, table_resultats
+)
+from normalisation_trajets import colonne_heure, normaliser_trajets
+from options_trajets import (
+    CRENEAU_MINUTES, ELEMENTS_PAR_SECONDE, EXTENSIONS, FICHIER_CACHE, HEURE_DEBUT, HEURE_FIN, JOURS_OUVRES,
+    JOURS_SEMAINE, K_PLUS_PROCHES, MODES_TRANSPORT, NB_WORKERS, PAS_MINUTES, RAYON_METRES, REQUETES_PAR_SECONDE,
+    TENTATIVES, lire_heure
+)
+from reprises import Disjoncteur, PolitiqueReprise
+from taches_trajets import ANNULEE, EN_ATTENTE, TACHES_SIMULTANEES, TERMINEE, GestionnaireTaches
+
 # Configuration de la page
 st.set_page_config(
     page_title="Calculateur de Temps de Trajet",
@@ -24,107 +46,424 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# Rafraîchissement de l'avancement d'une tâche de fond
+RAFRAICHIR_SECONDES = 2.0
+
+# Nombre de calculs conservés dans la session (fichiers ou paramètres différents)
+LIMITE_RESULTATS_SESSION = 5
+
+# Adresses raccourcies dans le tableau affiché pendant le calcul
+LARGEUR_ADRESSE = 50
+
+# Colonnes du tableau affiché pendant le calcul
+COLONNES_AFFICHAGE = ['#', 'Origine', 'Destination', 'Mode', 'Jour', 'Heure', 'Temps de trajet', 'Distance', 'Statut']
+
 # Titre
 st.title("🗺️ Calculateur de Temps de Trajet Google Maps")
 st.markdown("---")
 
-# Fonction pour convertir le mode de transport
-def obtenir_mode_transport(mode):
-    modes = {
-        'VOITURE': 'driving',
-        'TRANSPORTS': 'transit',
-        'VELO': 'bicycling',
-        'MARCHE': 'walking'
-    }
-    return modes.get(mode.upper(), 'driving')
-
-# Fonction pour générer l'URL Google Maps
-def generer_url_google_maps(origine, destination, mode):
-    base_url = "https://www.google.com/maps/dir/?api=1"
-    mode_map = {
-        'driving': 'driving',
-        'transit': 'transit',
-        'bicycling': 'bicycling',
-        'walking': 'walking'
+# Fonction pour raccourcir les adresses au moment de l'affichage
+def tronquer(textes, largeur=None):
+    if largeur is None:
+        return textes
+    textes = textes.astype(str)
+    return textes.where(textes.str.len() <= largeur, textes.str[:largeur] + '...')
+
+# Icônes des statuts, d'après le code (une ligne pas encore calculée n'a pas de code)
+ICONES_STATUT = {'OK': '✅', 'ESTIME': '🔮', 'SUR_PLACE': '📍'}
+
+# Fonction pour présenter les résultats du moteur : icône du statut, durées estimées signalées par ≈
+def presenter_resultats(resultats):
+    codes = resultats[COLONNE_CODE].astype(object)
+    icones = codes.map(ICONES_STATUT).fillna('❌').where(codes.notna(), '⏳')
+    estime = codes == 'ESTIME'
+    return resultats.assign(**{
+        'Temps de trajet': resultats['Temps de trajet'].mask(estime, '≈ ' + resultats['Temps de trajet']),
+        'Distance': resultats['Distance'].mask(estime, '≈ ' + resultats['Distance']),
+        'Statut': icones + ' ' + resultats['Statut'],
+    })
+
+# Moteur d'itinéraire partagé par les reruns et les sessions : le client HTTP n'est créé qu'une fois
+@st.cache_resource(show_spinner=False)
+def obtenir_moteur(nom_moteur, api_key):
+    return creer_moteur(nom_moteur, api_key)
+
+# Pool de tâches de fond commun à toutes les sessions : nombre de calculs simultanés plafonné
+@st.cache_resource(show_spinner=False)
+def obtenir_gestionnaire():
+    return GestionnaireTaches(TACHES_SIMULTANEES)
+
+# Quota de l'API partagé par tous les calculs vers Google, quel que soit l'utilisateur
+@st.cache_resource(show_spinner=False)
+def obtenir_limiteur_global():
+    return LimiteurDebit(REQUETES_PAR_SECONDE, ELEMENTS_PAR_SECONDE)
+
+# Fonction pour conserver des résultats dans la session (les plus anciens sont oubliés)
+def memoriser_resultats(cle, etat):
+    resultats = st.session_state.setdefault('resultats', {})
+    resultats.pop(cle, None)
+    resultats[cle] = etat
+    while len(resultats) > LIMITE_RESULTATS_SESSION:
+        del resultats[next(iter(resultats))]
+
+# Fonction pour géocoder une seule fois chaque adresse unique du fichier
+def geocoder_fichier(df, moteur, utiliser_cache, nb_workers, limiteur, politique, metriques):
+    adresses = dict.fromkeys(pd.concat([df['Origine'], df['Destination']]).dropna())
+    cache_adresses = CacheAdresses(FICHIER_CACHE) if utiliser_cache else None
+    coordonnees, introuvables = geocoder_adresses(
+        moteur, adresses, cache_adresses, nb_workers, limiteur, metriques, politique
+    )
+    if cache_adresses:
+        cache_adresses.fermer()
+    return coordonnees, {'adresses': len(adresses), 'introuvables': introuvables}
+
+# Fonction pour afficher le bilan du géocodage et des appels d'un calcul conservé
+def afficher_bilan(etat):
+    if etat['geocodage']:
+        introuvables = etat['geocodage']['introuvables']
+        st.info(f"📍 {etat['geocodage']['adresses']} adresses uniques, {len(introuvables)} introuvables")
+        if introuvables:
+            with st.expander("⚠️ Adresses introuvables (trajets non calculés)"):
+                st.dataframe(
+                    pd.DataFrame({'Adresse': list(introuvables), 'Raison': list(introuvables.values())}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+    
+    rapport = etat['metriques'].rapport()
+    elements = rapport['elements_factures']
+    st.caption(
+        f"📡 {rapport['latence_s']['nombre']} requêtes, "
+        f"{elements['basique']} éléments basiques et {elements['avance']} avancés facturés, "
+        f"{rapport['geocodages_factures']} géocodages"
+        + (f", latence moyenne {rapport['latence_s']['moyenne'] * 1000:.0f} ms"
+           if rapport['latence_s']['nombre'] else "")
+    )
+    locales = etat['metriques'].locales
+    if any(locales.values()):
+        st.caption(f"🔮 Sans appel: {locales['estimes']} trajets estimés, {locales['sur_place']} trajets sur place")
+    if etat['cache']:
+        st.caption(f"💾 Cache: {etat['cache']['succes']} trajets réutilisés, {etat['cache']['echecs']} calculés via l'API")
+    st.caption(
+        f"🔁 Reprises: {etat['reprises']['reprises']} (attente totale {etat['reprises']['attente']:.1f} s, "
+        f"{etat['reprises']['ouvertures']} pauses de quota)"
+    )
+
+# Fonction pour calculer un trajet par ligne ; les résultats partiels sont publiés comme aperçu de la tâche
+def executer_lignes(tache, df, moteur, cache, nb_workers, limiteur, politique, metriques, coordonnees=None,
+                    estimateur=None):
+    traites = 0
+    
+    def sur_resultat(position, tampon):
+        nonlocal traites
+        if tache.apercu is None:
+            tache.apercu = lambda: tableau_resultats(df, tampon.table(), LARGEUR_ADRESSE)[COLONNES_AFFICHAGE]
+        traites += 1
+        # Point d'annulation : l'arrêt abandonne les lots pas encore partis
+        tache.avancer(traites, len(df))
+    
+    tache.avancer(traites, len(df))
+    resultats = calculer_trajets(
+        df, moteur, datetime.now(), cache, nb_workers, limiteur, politique, metriques, coordonnees, estimateur,
+        sur_resultat=sur_resultat
+    )
+    tache.apercu = None
+    return {'df': df, 'resultats': resultats}
+
+# Fonction pour assembler le tableau affiché : colonnes du fichier et des résultats, jointes par l'index
+def tableau_resultats(df, resultats, largeur=None):
+    heures = colonne_heure(df)
+    jours = df['Jour'] if 'Jour' in df.columns else pd.Series(np.nan, index=df.index)
+    tableau = pd.DataFrame({
+        '#': np.arange(1, len(df) + 1),
+        'Origine': tronquer(df['Origine'], largeur),
+        'Destination': tronquer(df['Destination'], largeur),
+        'Mode': df['Mode de transport'],
+        'Jour': jours.where(jours.notna() & (jours.astype(str) != ''), 'Aujourd\'hui'),
+        'Heure': heures.fillna('') if heures is not None else '',
+    }, index=df.index)
+    return pd.concat([tableau, presenter_resultats(resultats)], axis=1)
+
+# Fonction pour afficher les résultats d'un trajet par ligne
+def afficher_lignes(etat):
+    df, resultats = etat['df'], etat['resultats']
+    
+    # Afficher les résultats
+    st.markdown("---")
+    st.markdown("### 📊 Résultats")
+    
+    # Statistiques
+    col1, col2, col3, col4 = st.columns(4)
+    calcules = resultats[COLONNE_CODE].isin(CODES_CALCULES)
+    succes = int(calcules.sum())
+    erreurs = len(resultats) - succes
+    
+    with col1:
+        st.metric("Total trajets", len(resultats))
+    with col2:
+        st.metric("✅ Succès", succes)
+    with col3:
+        st.metric("❌ Erreurs", erreurs)
+    with col4:
+        st.metric("💰 Coût estimé", f"{etat['metriques'].cout():.2f} $")
+    
+    afficher_bilan(etat)
+    
+    # Statistiques par mode et par jour, calculées sur les colonnes numériques
+    if succes > 0:
+        with st.expander("📈 Statistiques par mode et par jour", expanded=False):
+            statistiques = resumer_trajets(resultats.assign(Mode=df['Mode de transport']), 'Mode')
+            st.markdown("**Par mode de transport**")
+            st.dataframe(statistiques['par_mode'], use_container_width=True)
+            if not statistiques['par_jour'].empty:
+                st.markdown("**Par jour de départ**")
+                st.dataframe(statistiques['par_jour'], use_container_width=True)
+    
+    # Afficher le tableau avec les liens cliquables
+    st.markdown("#### 📋 Tableau des résultats")
+    st.markdown("💡 *Cliquez sur 'Voir l'itinéraire' pour ouvrir dans Google Maps*")
+    
+    # Tableau virtualisé : seules les lignes visibles sont rendues par le navigateur
+    tableau = tableau_resultats(df, resultats)
+    st.dataframe(
+        tableau[COLONNES_AFFICHAGE + ['Lien Google Maps']],
+        use_container_width=True,
+        height=600,
+        hide_index=True,
+        column_config={
+            'Lien Google Maps': st.column_config.LinkColumn("Itinéraire", display_text="🗺️ Voir l'itinéraire")
+        }
+    )
+    
+    # Bouton de téléchargement
+    st.download_button(
+        label=f"⬇️ Télécharger les résultats ({format_sortie.upper()})",
+        data=table_en_octets(table_resultats(df, resultats), format_sortie),
+        file_name=f"resultats_trajets_{etat['calcul']:%Y%m%d_%H%M%S}{EXTENSIONS[format_sortie]}",
+        mime=TYPES_MIME[format_sortie],
+        type="primary",
+        use_container_width=True
+    )
+    
+    # Afficher les erreurs si présentes
+    if erreurs > 0:
+        with st.expander("⚠️ Détails des erreurs", expanded=False):
+            st.dataframe(tableau[~calcules], use_container_width=True)
+
+# Fonction pour calculer le balayage des heures de départ
+def executer_balayage(tache, df, moteur, creneaux, cache, nb_workers, limiteur, politique, metriques, coordonnees=None):
+    # Paires uniques (origine, destination, mode) ; Heure de départ et Jour sont ignorés
+    paires, envoyees, modes_inconnus = paires_balayage([df], coordonnees)
+    
+    durees, _ = balayer(
+        moteur, envoyees, creneaux, cache, nb_workers, limiteur, politique, metriques, tache.avancer
+    )
+    return {
+        'creneaux': len(creneaux),
+        'modes_inconnus': modes_inconnus,
+        'resume': resumer_balayage(paires, creneaux, durees),
+        'profils': profils_balayage(paires, creneaux, durees),
     }
+
+# Fonction pour afficher le balayage des heures de départ
+def afficher_balayage(etat):
+    resume, profils = etat['resume'], etat['profils']
+    
+    st.markdown("### 🕒 Balayage des heures de départ")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Paires calculées", f"{int((resume['Créneaux calculés'] > 0).sum())}/{len(resume)}")
+    with col2:
+        st.metric("Créneaux", etat['creneaux'])
+    with col3:
+        st.metric("💰 Coût estimé", f"{etat['metriques'].cout():.2f} $")
+    afficher_bilan(etat)
+    if etat['modes_inconnus']:
+        st.warning(f"⚠️ Modes de transport inconnus, paires ignorées : {', '.join(map(str, etat['modes_inconnus']))} "
+                   f"(attendu : {', '.join(MODES_TRANSPORT)})")
+    
+    # Profil médian par mode : durée en minutes selon le créneau de départ
+    colonnes_creneaux = list(profils.columns[3:])
+    st.markdown("#### 📈 Durée médiane par créneau (minutes)")
+    st.line_chart(profils.groupby('Mode de transport')[colonnes_creneaux].median().T)
     
-    url = f"{base_url}&origin={origine}&destination={destination}&travelmode={mode_map.get(mode, 'driving')}"
-    return url
+    st.markdown("#### 🏁 Meilleur départ par paire")
+    st.dataframe(resume, use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    for colonne, nom, table, libelle in (
+        (col1, 'balayage_trajets', resume, "⬇️ Télécharger le résumé"),
+        (col2, 'profils_trajets', profils, "⬇️ Télécharger les profils"),
+    ):
+        with colonne:
+            st.download_button(
+                label=f"{libelle} ({format_sortie.upper()})",
+                data=table_en_octets(table, format_sortie),
+                file_name=f"{nom}_{etat['calcul']:%Y%m%d_%H%M%S}{EXTENSIONS[format_sortie]}",
+                mime=TYPES_MIME[format_sortie],
+                use_container_width=True
+            )
+
+# Fonction pour calculer la matrice origines × destinations
+def executer_matrice(tache, df, moteur, params, nb_workers, limiteur, politique, metriques, coordonnees=None):
+    # Les colonnes Origine et Destination sont deux listes d'adresses indépendantes
+    origines, destinations, envoyees_origines, envoyees_destinations = adresses_matrice([df], coordonnees)
+    
+    durees, distances = calculer_matrice(
+        moteur, envoyees_origines, envoyees_destinations, params, nb_workers, limiteur, politique, metriques,
+        tache.avancer
+    )
+    return {'origines': origines, 'destinations': destinations, 'durees': durees, 'distances': distances}
 
-# Fonction pour calculer un trajet
-def calculer_temps_trajet(gmaps, origine, destination, mode, heure_depart, jour_semaine=None):
+# Fonction pour afficher la matrice ; le classement suit k sans nouveau calcul
+def afficher_matrice(etat, k):
+    origines, destinations = etat['origines'], etat['destinations']
+    durees, distances = etat['durees'], etat['distances']
+    
+    st.markdown("### 🧮 Matrice origines × destinations")
+    st.info(f"{len(origines)} origines × {len(destinations)} destinations = {durees.size} trajets")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Trajets calculés", f"{int((~np.isnan(durees)).sum())}/{durees.size}")
+    with col2:
+        st.metric("Requêtes", etat['metriques'].lots)
+    with col3:
+        st.metric("💰 Coût estimé", f"{etat['metriques'].cout():.2f} $")
+    afficher_bilan(etat)
+    
+    st.markdown("#### 📍 Origine la plus proche de chaque destination")
+    st.dataframe(plus_proches(origines, destinations, durees, distances), use_container_width=True, hide_index=True)
+    
+    classement = k_plus_proches(origines, destinations, durees, distances, int(k))
+    with st.expander(f"🏁 Les {int(k)} origines les plus proches de chaque destination"):
+        st.dataframe(classement, use_container_width=True, hide_index=True)
+    
+    tampon = io.BytesIO()
+    enregistrer_matrice(tampon, origines, destinations, durees, distances)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button(
+            label="⬇️ Matrice dense (NumPy .npz)",
+            data=tampon.getvalue(),
+            file_name=f"matrice_trajets_{etat['calcul']:%Y%m%d_%H%M%S}.npz",
+            mime="application/octet-stream",
+            use_container_width=True
+        )
+    for colonne, nom, table, libelle in (
+        (col2, 'matrice_trajets', table_matrice(origines, destinations, durees, distances), "⬇️ Une ligne par couple"),
+        (col3, 'plus_proches', classement, "⬇️ Classement"),
+    ):
+        with colonne:
+            st.download_button(
+                label=f"{libelle} ({format_sortie.upper()})",
+                data=table_en_octets(table, format_sortie),
+                file_name=f"{nom}_{etat['calcul']:%Y%m%d_%H%M%S}{EXTENSIONS[format_sortie]}",
+                mime=TYPES_MIME[format_sortie],
+                use_container_width=True
+            )
+
+# Fonction exécutée en tâche de fond : aucun appel à Streamlit, la session peut être fermée entre-temps
+def calculer_tache(tache, mode, df, moteur, argument, nb_workers, limiteur, politique, creneau_cache, geocoder,
+                   rayon_estimation=None):
+    metriques = MetriquesAppels()
+    # Les connexions SQLite sont ouvertes dans le thread de la tâche, qui les utilise
+    cache = CacheTrajets(FICHIER_CACHE, creneau_cache) if creneau_cache and mode != 'matrice' else None
     try:
-        params = {
-            'origins': origine,
-            'destinations': destination,
-            'mode': mode,
-            'language': 'fr'
-        }
+        # Géocodage préalable des adresses uniques
+        coordonnees, geocodage = None, None
+        if geocoder:
+            tache.avancer(0, 0, "📍 Géocodage des adresses")
+            coordonnees, geocodage = geocoder_fichier(
+                df, moteur, creneau_cache is not None, nb_workers, limiteur, politique, metriques
+            )
         
-        if heure_depart and str(heure_depart).strip():
-            # Mapping des jours de la semaine en français
-            jours = {
-                'lundi': 0, 'monday': 0,
-                'mardi': 1, 'tuesday': 1,
-                'mercredi': 2, 'wednesday': 2,
-                'jeudi': 3, 'thursday': 3,
-                'vendredi': 4, 'friday': 4,
-                'samedi': 5, 'saturday': 5,
-                'dimanche': 6, 'sunday': 6
-            }
-            
-            # Déterminer la date du prochain jour spécifié
-            today = datetime.now()
-            
-            if jour_semaine and str(jour_semaine).strip():
-                # Trouver le jour demandé
-                jour_demande = None
-                for key, value in jours.items():
-                    if key.lower() == str(jour_semaine).strip().lower():
-                        jour_demande = value
-                        break
-                
-                if jour_demande is not None:
-                    # Calculer le nombre de jours jusqu'au prochain jour demandé
-                    jours_jusque = (jour_demande - today.weekday()) % 7
-                    if jours_jusque == 0:
-                        jours_jusque = 7  # Prendre la semaine prochaine si c'est aujourd'hui
-                    target_date = today + timedelta(days=jours_jusque)
-                else:
-                    target_date = today
-            else:
-                target_date = today
-            
-            # Définir l'heure
-            heures, minutes = str(heure_depart).split(':')
-            departure_time = target_date.replace(hour=int(heures), minute=int(minutes), second=0, microsecond=0)
-            params['departure_time'] = departure_time
-            
-            if mode == 'driving':
-                params['traffic_model'] = 'best_guess'
-        
-        result = gmaps.distance_matrix(**params)
-        
-        if result['status'] == 'OK':
-            element = result['rows'][0]['elements'][0]
-            
-            if element['status'] == 'OK':
-                temps = element['duration']['text']
-                distance = element['distance']['text']
-                
-                # Vérifier s'il y a des infos de trafic
-                if 'duration_in_traffic' in element:
-                    temps_trafic = element['duration_in_traffic']['text']
-                    return temps_trafic, distance, '✅ OK (avec trafic)'
-                
-                return temps, distance, '✅ OK'
-            else:
-                return 'Erreur', '-', f"❌ {element['status']}"
+        tache.avancer(0, 0, "🚗 Calcul des trajets")
+        if mode == 'balayage':
+            etat = executer_balayage(
+                tache, df, moteur, argument, cache, nb_workers, limiteur, politique, metriques, coordonnees
+            )
+        elif mode == 'matrice':
+            etat = executer_matrice(tache, df, moteur, argument, nb_workers, limiteur, politique, metriques, coordonnees)
         else:
-            return 'Erreur', '-', f"❌ {result['status']}"
-            
-    except Exception as e:
-        return 'Erreur', '-', f"❌ {str(e)}"
+            # Index des trajets en cache, pour estimer ceux qui en sont proches (trajets en coordonnées)
+            estimateur = None
+            if rayon_estimation and cache and coordonnees is not None:
+                tache.avancer(0, 0, "🔮 Indexation des trajets connus")
+                estimateur = IndexTrajets(cache, rayon_estimation)
+                tache.avancer(0, 0, "🚗 Calcul des trajets")
+            etat = executer_lignes(
+                tache, df, moteur, cache, nb_workers, limiteur, politique, metriques, coordonnees, estimateur
+            )
+    finally:
+        if cache:
+            cache.fermer()
+    
+    etat.update({
+        'mode': mode,
+        'calcul': datetime.now(),
+        'metriques': metriques,
+        'geocodage': geocodage,
+        'cache': {'succes': cache.succes, 'echecs': cache.echecs} if cache else None,
+        'reprises': {
+            'reprises': politique.reprises,
+            'attente': politique.attente,
+            'ouvertures': politique.disjoncteur.ouvertures,
+        },
+    })
+    return etat
+
+# Fonction pour afficher l'avancement d'une tâche (fragment relancé périodiquement, sans recharger la page)
+def afficher_progression(tache):
+    if tache.terminee:
+        st.rerun()
+    
+    st.markdown("### 📊 Progression")
+    if tache.etat == EN_ATTENTE:
+        st.info(f"⏳ En attente d'un worker libre ({gestionnaire.position(tache)} calcul(s) en cours ou en attente avant celui-ci)")
+    else:
+        st.progress(tache.traites / tache.total if tache.total else 0.0)
+        st.text(f"⏳ {tache.etape}: {tache.traites}/{tache.total} trajets" if tache.total else f"⏳ {tache.etape}...")
+    
+    # Tableau en cours de remplissage (un trajet par ligne)
+    apercu = tache.apercu
+    if apercu is not None:
+        st.dataframe(apercu(), use_container_width=True, height=400)
+    
+    if tache.annulation_demandee:
+        st.warning("⏹️ Annulation en cours : les requêtes déjà parties se terminent...")
+    elif st.button("⏹️ Annuler le calcul", key=f"annuler_{tache.id}"):
+        tache.annuler()
+    st.caption(
+        f"🔗 Tâche {tache.id} : le calcul continue si la page est fermée, "
+        "rouvrez cette adresse pour retrouver l'avancement et les résultats"
+    )
+
+# Fonction pour suivre une tâche : avancement tant qu'elle tourne, puis résultats conservés dans la session
+def suivre_tache(tache):
+    if not tache.terminee:
+        st.fragment(afficher_progression, run_every=rafraichir_secondes)(tache)
+        return None
+    if tache.etat == TERMINEE:
+        memoriser_resultats(tache.cle, tache.resultat)
+        return tache.resultat
+    if tache.etat == ANNULEE:
+        st.warning("⏹️ Calcul annulé")
+    else:
+        st.error(f"❌ Erreur lors du traitement: {tache.erreur}")
+        st.info("💡 Vérifiez que votre clé API est correcte et que les APIs nécessaires sont activées.")
+    return None
+
+# Fonction pour afficher des résultats conservés, selon leur mode de calcul
+def afficher_resultats(etat):
+    if etat['mode'] == 'balayage':
+        afficher_balayage(etat)
+    elif etat['mode'] == 'matrice':
+        afficher_matrice(etat, k_matrice)
+    else:
+        afficher_lignes(etat)
+    st.success("🎉 Traitement terminé avec succès !")
+
+gestionnaire = obtenir_gestionnaire()
 
 # Sidebar pour la configuration
 with st.sidebar:
@@ -132,11 +471,136 @@ with st.sidebar:
     
     st.info("📌 **Prérequis**\n\nActivez ces APIs dans Google Cloud Console:\n- Maps JavaScript API\n- Distance Matrix API")
     
+    nom_moteur = st.selectbox(
+        "🧭 Moteur d'itinéraire",
+        options=['google', 'simulateur'],
+        format_func=lambda nom: {'google': 'Google Maps', 'simulateur': 'Simulateur (hors ligne, sans quota)'}[nom],
+        help="Le simulateur reproduit les réponses de l'API pour tester sans clé ni coût"
+    )
+    
     api_key = st.text_input(
         "🔑 Clé API Google Maps",
         type="password",
-        help="Obtenez votre clé sur console.cloud.google.com"
+        help="Obtenez votre clé sur console.cloud.google.com",
+        disabled=nom_moteur != 'google'
+    )
+    cle_manquante = nom_moteur == 'google' and not api_key
+    
+    # Le cache ne doit contenir que des réponses de la vraie API Google
+    utiliser_cache = st.checkbox(
+        "💾 Réutiliser les trajets déjà calculés",
+        value=nom_moteur == 'google',
+        disabled=nom_moteur != 'google',
+        help=f"Les réponses sont conservées dans '{FICHIER_CACHE}' et réutilisées sans nouvel appel à l'API"
+    )
+    creneau_cache = st.number_input(
+        "⏱️ Créneau de départ (minutes)",
+        min_value=1,
+        max_value=240,
+        value=CRENEAU_MINUTES,
+        help="Deux heures de départ dans le même créneau partagent la même réponse en cache",
+        disabled=not utiliser_cache
+    )
+    
+    geocoder = st.checkbox(
+        "📍 Géocoder les adresses avant le calcul",
+        value=False,
+        help="Chaque adresse unique est géocodée une seule fois (Geocoding API) et les trajets sont envoyés en coordonnées. "
+             "Les adresses introuvables sont signalées avant tout calcul de trajet."
+    )
+    
+    # L'estimation s'appuie sur les trajets du cache exprimés en coordonnées
+    estimer = st.checkbox(
+        "🔮 Estimer les trajets proches de trajets connus",
+        value=False,
+        disabled=not (utiliser_cache and geocoder),
+        help="Un trajet dont les deux extrémités sont à moins du rayon d'un trajet déjà en cache (même mode et créneau) "
+             "reçoit une durée interpolée, marquée « Estimé », sans appel à l'API. Nécessite le cache et le géocodage."
+    ) and utiliser_cache and geocoder
+    rayon_estimation = st.number_input(
+        "📏 Rayon d'estimation (mètres)",
+        min_value=10,
+        max_value=5000,
+        value=RAYON_METRES,
+        step=50,
+        help="Plus le rayon est grand, plus de trajets sont estimés, avec une précision moindre",
+        disabled=not estimer
+    )
+    
+    with st.expander("🚦 Débit des appels"):
+        nb_workers = st.number_input("Requêtes en parallèle", min_value=1, max_value=32, value=NB_WORKERS)
+        requetes_par_seconde = st.number_input("Requêtes par seconde", min_value=1.0, value=float(REQUETES_PAR_SECONDE))
+        elements_par_seconde = st.number_input(
+            "Éléments par seconde",
+            min_value=1.0,
+            value=float(ELEMENTS_PAR_SECONDE),
+            help="Un élément = une paire origine/destination, unité de quota de l'API"
+        )
+        tentatives = st.number_input(
+            "Tentatives par requête",
+            min_value=1,
+            max_value=10,
+            value=TENTATIVES,
+            help="Les erreurs passagères (limite de débit, erreur serveur, délai dépassé) sont retentées"
+        )
+        st.caption(
+            f"🌐 Tous utilisateurs confondus : {TACHES_SIMULTANEES} calculs simultanés au plus, "
+            f"{REQUETES_PAR_SECONDE} requêtes et {ELEMENTS_PAR_SECONDE} éléments par seconde vers Google. "
+            f"Calculs en cours ou en attente : {gestionnaire.actives()}"
+        )
+    
+    format_sortie = st.selectbox(
+        "📄 Format du fichier de résultats",
+        options=list(EXTENSIONS),
+        format_func=lambda format_: {'csv': 'CSV (Excel)', 'parquet': 'Parquet', 'arrow': 'Arrow IPC'}[format_],
+        help="Parquet et Arrow conservent les types des colonnes et sont plus compacts pour les gros fichiers"
+    )
+    
+    mode_calcul = st.radio(
+        "🧮 Mode de calcul",
+        options=['lignes', 'balayage', 'matrice'],
+        format_func=lambda mode: {
+            'lignes': 'Un trajet par ligne',
+            'balayage': 'Balayage horaire',
+            'matrice': 'Matrice origines × destinations',
+        }[mode],
+        help="Balayage : chaque paire origine/destination/mode sur une grille d'heures de départ, "
+             "les colonnes Heure de départ et Jour sont ignorées. Matrice : tous les trajets entre les "
+             "adresses de la colonne Origine et celles de la colonne Destination."
     )
+    balayage = mode_calcul == 'balayage'
+    matrice = mode_calcul == 'matrice'
+    
+    with st.expander("🕒 Balayage horaire", expanded=balayage):
+        jours_balayage = st.multiselect("Jours", options=JOURS_SEMAINE, default=JOURS_OUVRES, disabled=not balayage)
+        heure_debut_balayage = st.time_input(
+            "Premier départ", value=datetime.strptime(HEURE_DEBUT, '%H:%M').time(), disabled=not balayage
+        )
+        heure_fin_balayage = st.time_input(
+            "Dernier départ", value=datetime.strptime(HEURE_FIN, '%H:%M').time(), disabled=not balayage
+        )
+        pas_balayage = st.number_input(
+            "Intervalle (minutes)", min_value=5, max_value=240, value=PAS_MINUTES, disabled=not balayage
+        )
+    
+    with st.expander("🧮 Matrice", expanded=matrice):
+        mode_matrice = st.selectbox(
+            "Mode de transport", options=list(MODES_TRANSPORT), disabled=not matrice
+        )
+        heure_matrice = st.text_input("Heure de départ (facultatif)", placeholder="08:00", disabled=not matrice)
+        k_matrice = st.number_input(
+            "Origines classées par destination", min_value=1, max_value=25, value=K_PLUS_PROCHES,
+            help="Les k origines (agences) les plus rapides pour chaque destination",
+            disabled=not matrice
+        )
+    
+    with st.expander("🖥️ Affichage"):
+        rafraichir_secondes = st.number_input(
+            "Rafraîchir l'avancement toutes les T secondes",
+            min_value=0.5,
+            value=RAFRAICHIR_SECONDES,
+            help="Le calcul tourne en tâche de fond : la page interroge son avancement à cet intervalle"
+        )
     
     st.markdown("---")
     
@@ -158,8 +622,8 @@ col1, col2 = st.columns([2, 1])
 with col1:
     st.header("📁 Importer votre fichier CSV")
     uploaded_file = st.file_uploader(
-        "Choisissez un fichier CSV",
-        type=['csv'],
+        "Choisissez un fichier CSV, Parquet ou Arrow",
+        type=[extension.lstrip('.') for extension in FORMATS],
         help="Le fichier doit contenir les colonnes: Origine, Destination, Mode de transport, Heure de départ"
     )
 
@@ -174,10 +638,10 @@ with col2:
 if uploaded_file is not None:
     try:
         # Lire le CSV
-        df = pd.read_csv(uploaded_file)
+        df = lire_table(uploaded_file, nom=uploaded_file.name)
         
         # Vérifier les colonnes
-        colonnes_requises = ['Origine', 'Destination', 'Mode de transport']
+        colonnes_requises = ['Origine', 'Destination'] if matrice else ['Origine', 'Destination', 'Mode de transport']
         colonnes_manquantes = [col for col in colonnes_requises if col not in df.columns]
         
         if colonnes_manquantes:
@@ -189,8 +653,44 @@ if uploaded_file is not None:
             with st.expander("👀 Aperçu des données", expanded=True):
                 st.dataframe(df, use_container_width=True)
             
+            # Valeurs invalides, signalées avant tout appel à l'API
+            if mode_calcul == 'lignes':
+                _, anomalies = normaliser_trajets(df)
+                if not anomalies.empty:
+                    st.warning(f"⚠️ {len(anomalies)} valeurs invalides : les lignes concernées ne seront pas calculées")
+                    with st.expander("🔎 Détail des valeurs invalides"):
+                        st.dataframe(anomalies, use_container_width=True, hide_index=True)
+            
             st.markdown("---")
             
+            # Résultats déjà calculés pour ce fichier (empreinte du contenu) et ces paramètres :
+            # les reruns (téléchargement, expander, format de sortie, k) ne rappellent pas l'API
+            cle_resultats = (
+                hashlib.sha256(uploaded_file.getvalue()).hexdigest(),
+                mode_calcul,
+                nom_moteur,
+                geocoder,
+                utiliser_cache and nom_moteur == 'google',
+                int(creneau_cache),
+                int(rayon_estimation) if estimer and mode_calcul == 'lignes' else None,
+                # Les départs sans date sont calculés pour aujourd'hui ou les jours suivants
+                datetime.now().date().isoformat(),
+            )
+            if balayage:
+                cle_resultats += (
+                    tuple(jours_balayage), heure_debut_balayage.strftime('%H:%M'),
+                    heure_fin_balayage.strftime('%H:%M'), int(pas_balayage)
+                )
+            elif matrice:
+                cle_resultats += (mode_matrice, heure_matrice.strip())
+            etat = st.session_state.setdefault('resultats', {}).get(cle_resultats)
+            
+            # Tâche de fond de ce fichier et de ces paramètres, retrouvée par l'URL après une reconnexion
+            tache = gestionnaire.obtenir(st.query_params.get('tache'))
+            if tache is not None and tache.cle != cle_resultats:
+                tache = None
+            tache_active = tache is not None and not tache.terminee
+            
             # Bouton de calcul
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
@@ -198,161 +698,84 @@ if uploaded_file is not None:
                     "🚀 Calculer les temps de trajet",
                     type="primary",
                     use_container_width=True,
-                    disabled=not api_key
+                    disabled=cle_manquante or tache_active
+                )
+                recalculer = etat is not None and not tache_active and st.button(
+                    "🔄 Recalculer",
+                    use_container_width=True,
+                    disabled=cle_manquante,
+                    help="Relance tous les appels, par exemple pour obtenir des durées de trafic à jour"
                 )
             
-            if not api_key:
+            if cle_manquante:
                 st.warning("⚠️ Veuillez entrer votre clé API dans la barre latérale")
             
-            # Si le bouton est cliqué
-            if bouton_calcul:
-                if not api_key:
-                    st.error("❌ Clé API manquante !")
-                else:
-                    try:
-                        # Initialiser Google Maps
-                        gmaps = googlemaps.Client(key=api_key)
-                        
-                        # Barre de progression
-                        st.markdown("### 📊 Progression")
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-                        
-                        # Conteneur pour les résultats en temps réel
-                        results_placeholder = st.empty()
-                        
-                        resultats = []
-                        
-                        # Calculer chaque trajet
-                        for idx, row in df.iterrows():
-                            # Mise à jour de la progression
-                            progress = (idx + 1) / len(df)
-                            progress_bar.progress(progress)
-                            status_text.text(f"⏳ Traitement: {idx + 1}/{len(df)} trajets")
-                            
-                            # Récupérer les données
-                            origine = row['Origine']
-                            destination = row['Destination']
-                            mode = obtenir_mode_transport(row['Mode de transport'])
-                            heure = row.get('Heure de départ', row.get('Heure de dÃ©part', ''))
-                            jour = row.get('Jour', '')
-                            
-                            # Calculer le trajet
-                            try:
-                                temps, distance, statut = calculer_temps_trajet(
-                                    gmaps, origine, destination, mode, heure, jour
-                                )
-                            except Exception as e:
-                                temps, distance, statut = 'Erreur', '-', f'❌ {str(e)}'
-                            
-                            # Générer l'URL Google Maps
-                            url_maps = generer_url_google_maps(origine, destination, mode)
-                            
-                            # Stocker les résultats
-                            resultats.append({
-                                '#': idx + 1,
-                                'Origine': origine[:50] + '...' if len(origine) > 50 else origine,
-                                'Destination': destination[:50] + '...' if len(destination) > 50 else destination,
-                                'Mode': row['Mode de transport'],
-                                'Jour': jour if jour else 'Aujourd\'hui',
-                                'Heure': heure,
-                                'Temps de trajet': temps,
-                                'Distance': distance,
-                                'Statut': statut,
-                                'URL': url_maps,
-                                'Origine_complete': origine,
-                                'Destination_complete': destination
-                            })
-                            
-                            # Afficher les résultats en temps réel
-                            if len(resultats) > 0:
-                                df_temp = pd.DataFrame(resultats)
-                                # Créer un DataFrame avec liens cliquables
-                                df_display = df_temp[['#', 'Origine', 'Destination', 'Mode', 'Jour', 'Heure', 'Temps de trajet', 'Distance', 'Statut']].copy()
-                                results_placeholder.dataframe(df_display, use_container_width=True, height=400)
-                            
-                            # Pause pour éviter de surcharger l'API
-                            time.sleep(0.5)
-                        
-                        # Compléter la progression
-                        progress_bar.progress(1.0)
-                        status_text.text(f"✅ Calcul terminé ! {len(df)}/{len(df)} trajets")
-                        
-                        # Créer le DataFrame de résultats complet
-                        df_resultats = pd.DataFrame(resultats)
-                        
-                        # Préparer le DataFrame pour le téléchargement (avec toutes les colonnes originales)
-                        df_download = pd.DataFrame([{
-                            'Origine': df.iloc[i]['Origine'],
-                            'Destination': df.iloc[i]['Destination'],
-                            'Mode de transport': df.iloc[i]['Mode de transport'],
-                            'Heure de départ': df.iloc[i].get('Heure de départ', df.iloc[i].get('Heure de dÃ©part', '')),
-                            'Jour': df.iloc[i].get('Jour', ''),
-                            'Temps de trajet': resultats[i]['Temps de trajet'],
-                            'Distance': resultats[i]['Distance'],
-                            'Lien Google Maps': resultats[i]['URL'],
-                            'Statut': resultats[i]['Statut']
-                        } for i in range(len(df))])
-                        
-                        # Afficher les résultats
-                        st.markdown("---")
-                        st.markdown("### 📊 Résultats")
-                        
-                        # Statistiques
-                        col1, col2, col3 = st.columns(3)
-                        succes = len(df_resultats[df_resultats['Statut'].str.contains('OK', na=False)])
-                        erreurs = len(df_resultats) - succes
-                        
-                        with col1:
-                            st.metric("Total trajets", len(df_resultats))
-                        with col2:
-                            st.metric("✅ Succès", succes)
-                        with col3:
-                            st.metric("❌ Erreurs", erreurs)
-                        
-                        # Afficher le tableau avec les liens cliquables
-                        st.markdown("#### 📋 Tableau des résultats")
-                        st.markdown("💡 *Cliquez sur 'Voir l'itinéraire' pour ouvrir dans Google Maps*")
-                        
-                        # Créer un affichage interactif avec liens
-                        for idx, row in df_resultats.iterrows():
-                            with st.expander(f"📍 Trajet #{row['#']} - {row['Origine'][:30]}... → {row['Destination'][:30]}..."):
-                                col1, col2 = st.columns([3, 1])
-                                with col1:
-                                    st.write(f"**Origine:** {row['Origine_complete']}")
-                                    st.write(f"**Destination:** {row['Destination_complete']}")
-                                    st.write(f"**Mode:** {row['Mode']} | **Jour:** {row['Jour']} | **Heure:** {row['Heure']}")
-                                    st.write(f"**⏱️ Temps:** {row['Temps de trajet']} | **📏 Distance:** {row['Distance']}")
-                                    st.write(f"**Statut:** {row['Statut']}")
-                                with col2:
-                                    st.link_button("🗺️ Voir l'itinéraire", row['URL'], use_container_width=True)
-                        
-                        # Bouton de téléchargement
-                        csv = df_download.to_csv(index=False, encoding='utf-8-sig')
-                        st.download_button(
-                            label="⬇️ Télécharger les résultats (CSV)",
-                            data=csv,
-                            file_name=f"resultats_trajets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv",
-                            type="primary",
-                            use_container_width=True
+            if etat is not None and not recalculer and not tache_active:
+                st.info(
+                    f"♻️ Résultats du calcul de {etat['calcul']:%H:%M} "
+                    "conservés pour ce fichier et ces paramètres, sans nouvel appel à l'API"
+                )
+            
+            # Si le bouton est cliqué : le calcul est soumis en tâche de fond
+            if ((bouton_calcul and etat is None) or recalculer) and not cle_manquante and not tache_active:
+                try:
+                    if balayage:
+                        argument = grille_creneaux(
+                            jours_balayage,
+                            heure_debut_balayage.strftime('%H:%M'),
+                            heure_fin_balayage.strftime('%H:%M'),
+                            int(pas_balayage)
                         )
-                        
-                        # Afficher les erreurs si présentes
-                        if erreurs > 0:
-                            with st.expander("⚠️ Détails des erreurs", expanded=False):
-                                df_erreurs = df_resultats[~df_resultats['Statut'].str.contains('OK', na=False)]
-                                st.dataframe(df_erreurs, use_container_width=True)
-                        
-                        st.success("🎉 Traitement terminé avec succès !")
-                        
-                    except Exception as e:
-                        st.error(f"❌ Erreur lors du traitement: {str(e)}")
-                        st.info("💡 Vérifiez que votre clé API est correcte et que les APIs nécessaires sont activées.")
+                    elif matrice:
+                        if heure_matrice.strip():
+                            lire_heure(heure_matrice)
+                        argument = preparer_parametres(MODES_TRANSPORT[mode_matrice], heure_matrice)
+                    else:
+                        argument = None
+                    
+                    # Moteur partagé ; débit propre à ce calcul, plafonné par le quota global vers Google
+                    moteur = obtenir_moteur(nom_moteur, api_key)
+                    utiliser_cache = utiliser_cache and nom_moteur == 'google'
+                    limiteur = LimiteurDebit(
+                        requetes_par_seconde, elements_par_seconde,
+                        parent=obtenir_limiteur_global() if nom_moteur == 'google' else None
+                    )
+                    politique = PolitiqueReprise(int(tentatives), disjoncteur=Disjoncteur())
+                    
+                    tache = gestionnaire.soumettre(
+                        calculer_tache, mode_calcul, df, moteur, argument, int(nb_workers), limiteur, politique,
+                        int(creneau_cache) if utiliser_cache else None, geocoder,
+                        int(rayon_estimation) if estimer and utiliser_cache else None,
+                        description=uploaded_file.name, cle=cle_resultats
+                    )
+                    st.query_params['tache'] = tache.id
+                    etat = None
+                    
+                except Exception as e:
+                    st.error(f"❌ Erreur lors du traitement: {str(e)}")
+            
+            # Avancement de la tâche en cours, ou résultats qu'elle vient de produire
+            if tache is not None:
+                resultat = suivre_tache(tache)
+                if resultat is not None:
+                    etat = resultat
+                elif not tache.terminee:
+                    etat = None
+            
+            # Affichage, à chaque rerun, des résultats conservés dans la session
+            if etat is not None:
+                afficher_resultats(etat)
     
     except Exception as e:
         st.error(f"❌ Erreur lors de la lecture du fichier: {str(e)}")
         st.info("💡 Assurez-vous que votre fichier CSV est bien formaté.")
+elif gestionnaire.obtenir(st.query_params.get('tache')) is not None:
+    # Reconnexion à une tâche de fond par son adresse, sans fichier uploadé
+    tache = gestionnaire.obtenir(st.query_params.get('tache'))
+    st.info(f"🔗 Calcul de '{tache.description}' retrouvé")
+    etat = suivre_tache(tache)
+    if etat is not None:
+        afficher_resultats(etat)
 else:
     # Instructions si aucun fichier
     st.info("👆 Commencez par uploader votre fichier CSV")
@@ -368,9 +791,12 @@ else:
     """)
     
     st.markdown("### 💰 Tarification Google Maps")
-    st.info("""
-    - 💵 **200$ de crédit gratuit par mois** (~40 000 requêtes)
-    - 📊 Distance Matrix API: ~0.005$ par requête
+    st.info(f"""
+    - 💵 **200$ de crédit gratuit par mois**
+    - 📊 Distance Matrix API: {PRIX_ELEMENT['basique']}$ par élément (origine × destination),
+      {PRIX_ELEMENT['avance']}$ en voiture avec heure de départ (trafic)
+    - 📍 Geocoding API: {PRIX_GEOCODAGE}$ par adresse
+    - ♻️ Les trajets servis par le cache ne sont pas facturés
     - 💳 Carte bancaire requise (même pour la version gratuite)
     """)
 
@@ -0,0 +1,164 @@
+"""Balayage des heures de départ sur une grille hebdomadaire.
+
+Chaque paire origine/destination est calculée pour tous les créneaux d'une
+grille (par exemple toutes les 15 minutes de 06:00 à 10:00, du lundi au
+vendredi). Les demandes d'un même créneau partagent les mêmes paramètres
+d'appel et sont donc regroupées dans les mêmes lots multi-origines /
+multi-destinations. Les durées sont rangées dans un tableau compact
+paires × créneaux, d'où sont tirés le meilleur départ de chaque paire et
+l'écart entre heures de pointe et heures creuses.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from lots_trajets import iterer_resultats
+from options_trajets import HEURE_DEBUT, HEURE_FIN, JOURS_OUVRES, JOURS_SEMAINE, NB_WORKERS, PAS_MINUTES, lire_heure
+
+# Plages de pointe des jours ouvrés, en heures décimales (début inclus, fin exclue)
+PLAGES_POINTE = [(7.0, 9.5), (16.5, 19.5)]
+
+
+def heures_journee(debut=HEURE_DEBUT, fin=HEURE_FIN, pas_minutes=PAS_MINUTES):
+    """Heures 'HH:MM' de `debut` à `fin` incluse, tous les `pas_minutes`"""
+    if pas_minutes <= 0:
+        raise ValueError("Le pas doit être positif")
+    heures_debut, minutes_debut = lire_heure(debut)
+    heures_fin, minutes_fin = lire_heure(fin)
+    premiere = heures_debut * 60 + minutes_debut
+    derniere = heures_fin * 60 + minutes_fin
+    if derniere < premiere:
+        raise ValueError(f"L'heure de fin ({fin}) précède l'heure de début ({debut})")
+    return [f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in range(premiere, derniere + 1, pas_minutes)]
+
+
+def grille_creneaux(jours=JOURS_OUVRES, debut=HEURE_DEBUT, fin=HEURE_FIN, pas_minutes=PAS_MINUTES, maintenant=None):
+    """Liste des créneaux (jour, heure, départ).
+
+    Chaque jour est pris à sa prochaine occurrence, la semaine prochaine
+    s'il s'agit d'aujourd'hui : tous les départs sont dans le futur.
+    """
+    if not jours:
+        raise ValueError("Aucun jour dans la grille de balayage")
+    maintenant = (maintenant or datetime.now()).replace(second=0, microsecond=0)
+    creneaux = []
+    for jour in jours:
+        jours_jusque = (JOURS_SEMAINE.index(jour) - maintenant.weekday()) % 7 or 7
+        date = maintenant + timedelta(days=jours_jusque)
+        for heure in heures_journee(debut, fin, pas_minutes):
+            heures, minutes = lire_heure(heure)
+            creneaux.append((jour, heure, date.replace(hour=heures, minute=minutes)))
+    return creneaux
+
+
+def est_pointe(jour, heure):
+    """Vrai si le créneau tombe dans une plage de pointe d'un jour ouvré"""
+    heures, minutes = lire_heure(heure)
+    decimal = heures + minutes / 60
+    return jour in JOURS_OUVRES and any(debut <= decimal < fin for debut, fin in PLAGES_POINTE)
+
+
+def parametres_creneau(mode, depart):
+    """Paramètres d'appel Distance Matrix d'un créneau"""
+    params = {'mode': mode, 'language': 'fr', 'departure_time': depart}
+    if mode == 'driving':
+        params['traffic_model'] = 'best_guess'
+    return params
+
+
+def balayer(moteur, paires, creneaux, cache=None, nb_workers=NB_WORKERS, limiteur=None, politique=None,
+            metriques=None, sur_resultat=None):
+    """Calcule chaque paire (origine, destination, mode) pour chaque créneau.
+
+    Retourne (durees, distances) : tableaux float32 paires × créneaux, en
+    secondes et en mètres, NaN lorsque le trajet n'a pas pu être calculé. La
+    durée retenue est celle avec trafic lorsque l'API la fournit. Une paire
+    None (adresse introuvable au géocodage) n'est pas envoyée.
+    `sur_resultat(traites, total)` est appelé après chaque trajet.
+    """
+    durees = np.full((len(paires), len(creneaux)), np.nan, dtype=np.float32)
+    distances = np.full((len(paires), len(creneaux)), np.nan, dtype=np.float32)
+
+    # Un seul dict de paramètres par (mode, créneau), partagé par toutes les paires
+    params = {}
+    demandes = []
+    envoyees = []
+    for ligne, paire in enumerate(paires):
+        if paire is None:
+            continue
+        origine, destination, mode = paire
+        envoyees.append(ligne)
+        for j, (_, _, depart) in enumerate(creneaux):
+            if (mode, j) not in params:
+                params[(mode, j)] = parametres_creneau(mode, depart)
+            demandes.append((origine, destination, params[(mode, j)]))
+
+    traites = 0
+    for i, element, erreur in iterer_resultats(moteur, demandes, cache, nb_workers, limiteur, politique, metriques):
+        position, creneau = divmod(i, len(creneaux))
+        paire = envoyees[position]
+        if not erreur and element['status'] == 'OK':
+            duree = element.get('duration_in_traffic', element['duration'])
+            durees[paire, creneau] = duree['value']
+            distances[paire, creneau] = element['distance']['value']
+        traites += 1
+        if sur_resultat:
+            sur_resultat(traites, len(demandes))
+    return durees, distances
+
+
+def _libelle(creneau):
+    jour, heure, _ = creneau
+    return f"{jour} {heure}"
+
+
+def profils_balayage(paires, creneaux, durees):
+    """Tableau large : une ligne par paire, une colonne de durée (minutes) par créneau.
+
+    `paires` est la liste (origine, destination, mode) à afficher, alignée sur
+    les lignes de `durees`.
+    """
+    profils = pd.DataFrame(paires, columns=['Origine', 'Destination', 'Mode de transport'])
+    minutes = pd.DataFrame(
+        np.round(durees.astype(np.float64) / 60, 1),
+        columns=[_libelle(creneau) for creneau in creneaux]
+    )
+    return pd.concat([profils, minutes], axis=1)
+
+
+def resumer_balayage(paires, creneaux, durees):
+    """Par paire : meilleur et pire départ, moyennes en pointe et en heures creuses"""
+    durees = durees.astype(np.float64)
+    valides = ~np.isnan(durees)
+    calcule = valides.any(axis=1)
+    pleines = np.where(valides, durees, np.inf)
+    vides = np.where(valides, durees, -np.inf)
+    meilleur = pleines.argmin(axis=1)
+    pire = vides.argmax(axis=1)
+    lignes = np.arange(len(paires))
+
+    pointe = np.array([est_pointe(jour, heure) for jour, heure, _ in creneaux], dtype=bool)
+
+    def moyenne(masque):
+        colonnes = valides & masque
+        nombre = colonnes.sum(axis=1)
+        somme = np.where(colonnes, durees, 0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(nombre > 0, somme / nombre, np.nan)
+
+    moyenne_pointe = moyenne(pointe)
+    moyenne_creuse = moyenne(~pointe)
+    libelles = np.array([_libelle(creneau) for creneau in creneaux], dtype=object)
+
+    resume = pd.DataFrame(paires, columns=['Origine', 'Destination', 'Mode de transport'])
+    resume['Créneaux calculés'] = valides.sum(axis=1)
+    resume['Meilleur départ'] = np.where(calcule, libelles[meilleur], None)
+    resume['Durée min (min)'] = np.where(calcule, np.round(pleines[lignes, meilleur] / 60, 1), np.nan)
+    resume['Pire départ'] = np.where(calcule, libelles[pire], None)
+    resume['Durée max (min)'] = np.where(calcule, np.round(vides[lignes, pire] / 60, 1), np.nan)
+    resume['Moyenne pointe (min)'] = np.round(moyenne_pointe / 60, 1)
+    resume['Moyenne creuse (min)'] = np.round(moyenne_creuse / 60, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        resume['Surcoût pointe (%)'] = np.round((moyenne_pointe / moyenne_creuse - 1) * 100, 1)
+    return resume
@@ -0,0 +1,193 @@
+"""Banc d'essai du débit du calcul de trajets, contre le simulateur Distance Matrix.
+
+Génère des fichiers de trajets synthétiques (taille, taux de doublons, mélange
+de modes et de jours configurables), les fait passer par la chaîne complète
+(lecture, préparation, lots, workers, écriture) avec un moteur simulé à
+latence réglable, puis enregistre les mesures au format JSON pour comparer
+les versions entre elles :
+
+    python benchmark_trajets.py --lignes 1000 10000 --latence 0.1 --sortie bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from formats_fichiers import EcrivainResultats, lire_table
+from limiteur_debit import LimiteurDebit
+from noyau_trajets import calculer_trajets, table_resultats
+from options_trajets import NB_WORKERS
+from simulateur_distance_matrix import SimulateurDistanceMatrix
+
+MODES = {'VOITURE': 0.5, 'TRANSPORTS': 0.3, 'VELO': 0.1, 'MARCHE': 0.1}
+JOURS = {'': 0.4, 'Lundi': 0.15, 'Mardi': 0.15, 'Mercredi': 0.1, 'Jeudi': 0.1, 'Vendredi': 0.1}
+HEURES = ['07:30', '08:00', '08:30', '09:00', '12:00', '17:30', '18:00']
+
+
+def generer_trajets(lignes, nb_origines=20, nb_destinations=500, taux_doublons=0.3,
+                    modes=MODES, jours=JOURS, graine=0):
+    """DataFrame de trajets synthétiques au format d'entrée de l'outil"""
+    aleatoire = random.Random(graine)
+    trajets = []
+    for _ in range(lignes):
+        if trajets and aleatoire.random() < taux_doublons:
+            trajets.append(aleatoire.choice(trajets))
+            continue
+        trajets.append((
+            f"Agence {aleatoire.randrange(nb_origines)}, Paris",
+            f"Client {aleatoire.randrange(nb_destinations)}, Île-de-France",
+            aleatoire.choices(list(modes), weights=list(modes.values()))[0],
+            aleatoire.choice(HEURES),
+            aleatoire.choices(list(jours), weights=list(jours.values()))[0],
+        ))
+    return pd.DataFrame(trajets, columns=['Origine', 'Destination', 'Mode de transport', 'Heure de départ', 'Jour'])
+
+
+class SimulateurChronometre(SimulateurDistanceMatrix):
+    """Simulateur qui mesure la durée de chaque appel"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latences = []
+        self._verrou_latences = threading.Lock()
+
+    def calculer_lot(self, origines, destinations, **params):
+        debut = time.perf_counter()
+        try:
+            return super().calculer_lot(origines, destinations, **params)
+        finally:
+            with self._verrou_latences:
+                self.latences.append(time.perf_counter() - debut)
+
+
+def lire_poids(texte):
+    """'VOITURE=0.5,VELO=0.1' -> {'VOITURE': 0.5, 'VELO': 0.1} ; un nom vide est permis"""
+    poids = {}
+    for partie in texte.split(','):
+        nom, valeur = partie.split('=')
+        poids[nom.strip()] = float(valeur)
+    return poids
+
+
+def _percentile(valeurs, p):
+    if not valeurs:
+        return None
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(p * len(valeurs)))]
+
+
+def executer_scenario(fichier, latence, nb_workers, qps, eps, dossier):
+    """Fait passer un fichier par la chaîne de calcul ; retourne les mesures"""
+    moteur = SimulateurChronometre(latence=latence, gigue=latence / 4)
+    limiteur = LimiteurDebit(qps, eps)
+    sortie = EcrivainResultats(os.path.join(dossier, 'resultats.csv'))
+
+    debut = time.perf_counter()
+    df = lire_table(fichier)
+    lecture = time.perf_counter() - debut
+    resultats = calculer_trajets(df, moteur, datetime.now(), nb_workers=nb_workers, limiteur=limiteur)
+    calcul = time.perf_counter() - debut - lecture
+    sortie.ecrire(table_resultats(df, resultats))
+    sortie.fermer()
+    total = time.perf_counter() - debut
+
+    return {
+        'lignes_par_seconde': round(len(df) / total, 1),
+        'appels_par_ligne': round(moteur.requetes / len(df), 4),
+        'appels': moteur.requetes,
+        'elements': moteur.elements,
+        'latence_p50_ms': round(_percentile(moteur.latences, 0.5) * 1000, 1) if moteur.latences else None,
+        'latence_p99_ms': round(_percentile(moteur.latences, 0.99) * 1000, 1) if moteur.latences else None,
+        'temps_total_s': round(total, 3),
+        'temps_lecture_s': round(lecture, 3),
+        'temps_calcul_s': round(calcul, 3),
+        'temps_ecriture_s': round(total - lecture - calcul, 3),
+        'temps_reseau_cumule_s': round(sum(moteur.latences), 3),
+    }
+
+
+def mesurer_memoire(fichier, nb_workers, dossier):
+    """Pic de mémoire Python (Mo) de la chaîne, sans latence pour rester rapide"""
+    tracemalloc.start()
+    try:
+        executer_scenario(fichier, 0.0, nb_workers, 1e9, 1e9, dossier)
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(pic / 2 ** 20, 2)
+
+
+def version_code():
+    """Commit git courant, pour rattacher les mesures à une version"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai du calcul de trajets")
+    parser.add_argument('--lignes', type=int, nargs='+', default=[1000, 10000],
+                        help="Tailles de fichier à mesurer (défaut: 1000 10000)")
+    parser.add_argument('--origines', type=int, default=20, help="Nombre d'adresses d'origine distinctes")
+    parser.add_argument('--destinations', type=int, default=500, help="Nombre d'adresses de destination distinctes")
+    parser.add_argument('--doublons', type=float, default=0.3, help="Proportion de lignes en double")
+    parser.add_argument('--modes', type=lire_poids, default=MODES,
+                        help="Mélange des modes, ex: VOITURE=0.5,TRANSPORTS=0.3,VELO=0.1,MARCHE=0.1")
+    parser.add_argument('--jours', type=lire_poids, default=JOURS,
+                        help="Mélange des jours (nom vide = aujourd'hui), ex: =0.4,Lundi=0.3,Vendredi=0.3")
+    parser.add_argument('--latence', type=float, default=0.1, help="Latence moyenne simulée par appel, en secondes")
+    parser.add_argument('--workers', type=int, default=NB_WORKERS)
+    parser.add_argument('--qps', type=float, default=50.0)
+    parser.add_argument('--eps', type=float, default=5000.0)
+    parser.add_argument('--graine', type=int, default=0)
+    parser.add_argument('--sortie', default='bench_trajets.json', help="Fichier JSON des mesures")
+    args = parser.parse_args(argv)
+
+    mesures = []
+    with tempfile.TemporaryDirectory() as dossier:
+        for lignes in args.lignes:
+            fichier = os.path.join(dossier, f"trajets_{lignes}.csv")
+            generer_trajets(
+                lignes, args.origines, args.destinations, args.doublons, args.modes, args.jours, args.graine
+            ).to_csv(fichier, index=False)
+
+            print(f"⏱️  {lignes} lignes...", flush=True)
+            mesure = {'lignes': lignes}
+            mesure.update(executer_scenario(fichier, args.latence, args.workers, args.qps, args.eps, dossier))
+            mesure['pic_memoire_mo'] = mesurer_memoire(fichier, args.workers, dossier)
+            mesures.append(mesure)
+            print(f"   {mesure['lignes_par_seconde']} lignes/s, {mesure['appels_par_ligne']} appel/ligne, "
+                  f"p50 {mesure['latence_p50_ms']} ms, p99 {mesure['latence_p99_ms']} ms, "
+                  f"pic mémoire {mesure['pic_memoire_mo']} Mo")
+
+    rapport = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'version': version_code(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'parametres': {
+            cle: valeur for cle, valeur in vars(args).items() if cle not in ('lignes', 'sortie')
+        },
+        'mesures': mesures,
+    }
+    with open(args.sortie, 'w', encoding='utf-8') as f:
+        json.dump(rapport, f, ensure_ascii=False, indent=2)
+    print(f"📊 Mesures enregistrées dans: {args.sortie}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Cache local (SQLite) des réponses Distance Matrix, partagé par le script et l'application.
+
+La clé d'un trajet est formée de l'origine et de la destination normalisées,
+du mode de transport et de l'heure de départ arrondie à un créneau. Chaque
+entrée expire selon une durée de vie propre au mode : les transports en commun
+et la voiture avec trafic changent plus vite que la marche ou le vélo.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from options_trajets import CRENEAU_MINUTES, FICHIER_CACHE
+
+# Durées de vie en secondes, par mode Google Maps
+DUREES_VIE = {
+    'transit': 24 * 3600,
+    'driving_trafic': 24 * 3600,
+    'driving': 7 * 24 * 3600,
+    'bicycling': 30 * 24 * 3600,
+    'walking': 30 * 24 * 3600,
+}
+
+
+def normaliser_adresse(adresse):
+    """Normalise une adresse pour la clé de cache (casse et espaces) ; vide pour une valeur absente"""
+    try:
+        # None, NaN : une valeur absente n'est pas égale à elle-même
+        absente = adresse is None or bool(adresse != adresse)
+    except TypeError:
+        # pd.NA : la comparaison elle-même est absente
+        absente = True
+    if absente:
+        return ''
+    return ' '.join(str(adresse).lower().split())
+
+
+def categorie_duree_vie(params):
+    """Catégorie de durée de vie d'un appel d'après ses paramètres"""
+    mode = params.get('mode', 'driving')
+    if mode == 'driving' and params.get('departure_time') is not None:
+        return 'driving_trafic'
+    return mode
+
+
+def categorie_cle(mode, creneau):
+    """Catégorie de durée de vie d'une entrée d'après son mode et son créneau enregistrés"""
+    mode = mode.split('/')[0]
+    if mode == 'driving' and creneau:
+        return 'driving_trafic'
+    return mode
+
+
+class CacheTrajets:
+    """Cache persistant des éléments de réponse Distance Matrix"""
+
+    def __init__(self, chemin=FICHIER_CACHE, creneau_minutes=CRENEAU_MINUTES, durees_vie=None):
+        self.chemin = chemin
+        self.creneau_minutes = creneau_minutes
+        self.durees_vie = dict(DUREES_VIE, **(durees_vie or {}))
+        self.succes = 0
+        self.echecs = 0
+        self._verrou = threading.Lock()
+        self._connexion = sqlite3.connect(chemin, check_same_thread=False)
+        self._connexion.execute(
+            'CREATE TABLE IF NOT EXISTS trajets ('
+            ' origine TEXT, destination TEXT, mode TEXT, creneau TEXT,'
+            ' element TEXT, enregistre REAL,'
+            ' PRIMARY KEY (origine, destination, mode, creneau))'
+        )
+        self._connexion.commit()
+
+    def creneau(self, params):
+        """Heure de départ arrondie au créneau : jour de la semaine et heure"""
+        depart = params.get('departure_time')
+        if depart is None:
+            return ''
+        minutes = (depart.hour * 60 + depart.minute) // self.creneau_minutes * self.creneau_minutes
+        return f"{depart.weekday()}-{minutes // 60:02d}:{minutes % 60:02d}"
+
+    def cle(self, origine, destination, params):
+        mode = params.get('mode', 'driving')
+        if params.get('traffic_model'):
+            mode = f"{mode}/{params['traffic_model']}"
+        return (
+            normaliser_adresse(origine),
+            normaliser_adresse(destination),
+            mode,
+            self.creneau(params),
+        )
+
+    def lire(self, origine, destination, params, compter=True):
+        """Retourne l'élément en cache encore valide, ou None.
+
+        Avec `compter=False`, l'accès n'est pas compté : l'appelant le compte
+        ensuite avec `compter`, une fois connu le sort d'un trajet absent.
+        """
+        duree_vie = self.durees_vie.get(categorie_duree_vie(params), 0)
+        with self._verrou:
+            ligne = self._connexion.execute(
+                'SELECT element, enregistre FROM trajets'
+                ' WHERE origine = ? AND destination = ? AND mode = ? AND creneau = ?',
+                self.cle(origine, destination, params)
+            ).fetchone()
+        trouve = ligne is not None and time.time() - ligne[1] <= duree_vie
+        if compter:
+            self.compter(trouve)
+        return json.loads(ligne[0]) if trouve else None
+
+    def compter(self, succes):
+        """Compte un trajet servi par le cache, ou un trajet à calculer via l'API"""
+        with self._verrou:
+            if succes:
+                self.succes += 1
+            else:
+                self.echecs += 1
+
+    def entrees(self):
+        """(origine, destination, mode, creneau, element JSON) de chaque entrée encore valide"""
+        maintenant = time.time()
+        with self._verrou:
+            lignes = self._connexion.execute(
+                'SELECT origine, destination, mode, creneau, element, enregistre FROM trajets'
+            ).fetchall()
+        return [
+            (origine, destination, mode, creneau, element)
+            for origine, destination, mode, creneau, element, enregistre in lignes
+            if maintenant - enregistre <= self.durees_vie.get(categorie_cle(mode, creneau), 0)
+        ]
+
+    def ecrire(self, origine, destination, params, element):
+        """Enregistre un élément de réponse ; seuls les trajets trouvés sont conservés"""
+        self.ecrire_lot([(origine, destination, params, element)])
+
+    def ecrire_lot(self, entrees):
+        """Enregistre plusieurs (origine, destination, params, element) en une transaction"""
+        maintenant = time.time()
+        lignes = [
+            self.cle(origine, destination, params) + (json.dumps(element), maintenant)
+            for origine, destination, params, element in entrees
+            if element and element.get('status') == 'OK'
+        ]
+        if not lignes:
+            return
+        with self._verrou:
+            self._connexion.executemany(
+                'INSERT OR REPLACE INTO trajets VALUES (?, ?, ?, ?, ?, ?)', lignes
+            )
+            self._connexion.commit()
+
+    def fermer(self):
+        with self._verrou:
+            self._connexion.close()
@@ -1,182 +1,690 @@
-import googlemaps
-import pandas as pd
 from datetime import datetime, timedelta
-import time
+import argparse
+import configparser
+import contextlib
+import glob
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Seules les valeurs par défaut sont importées au démarrage : les modules de calcul
+# (pandas, NumPy, googlemaps) ne le sont qu'au traitement d'un fichier, --help reste immédiat
+from moteurs_itineraire import MOTEURS
+from options_trajets import (
+    CRENEAU_MINUTES, ELEMENTS_PAR_SECONDE, EXTENSIONS, FICHIER_CACHE, HEURE_DEBUT, HEURE_FIN, HOTE_METRIQUES,
+    JOURS_OUVRES, K_PLUS_PROCHES, MODES_TRANSPORT, NB_WORKERS, PAS_MINUTES, RAYON_METRES, REQUETES_PAR_SECONDE,
+    TENTATIVES, lire_heure, lire_jours
+)
+
+# Mode flux : nombre de lignes lues et écrites à la fois
+TAILLE_BLOC = 5000
+
+# Nombre maximal de trajets en erreur détaillés dans le résumé
+MAX_ERREURS_AFFICHEES = 100
+
+# Traitement par lot : fichiers traités en parallèle, chacun dans son processus
+NB_PROCESSUS = min(4, os.cpu_count() or 1)
+
+# Clé API sans saisie : variable d'environnement, sinon section [google] du fichier de configuration
+VARIABLE_CLE_API = 'GOOGLE_MAPS_API_KEY'
+FICHIER_CONFIG = 'calcul_trajets.ini'
+
+# Codes de sortie, pour cron et les scripts d'enchaînement
+CODE_OK = 0
+CODE_ECHEC = 1                # au moins un fichier n'a pas pu être traité
+CODE_USAGE = 2                # clé API ou fichiers absents (comme les erreurs d'options d'argparse)
+CODE_TRAJETS_EN_ERREUR = 3    # tous les fichiers traités, mais certains trajets sont en erreur
 
 def afficher_progression(actuel, total):
-    """Affiche une barre de progression"""
-    pourcentage = int((actuel / total) * 100)
+    """Affiche une barre de progression (seulement dans un terminal, pas dans un journal)"""
+    if not sys.stdout.isatty():
+        return
+    pourcentage = int((actuel / total) * 100) if total else 100
     barre = '█' * (pourcentage // 2) + '░' * (50 - pourcentage // 2)
     print(f'\r[{barre}] {pourcentage}% ({actuel}/{total})', end='', flush=True)
 
-def obtenir_mode_transport(mode):
-    """Convertit le mode de transport en format Google Maps"""
-    modes = {
-        'VOITURE': 'driving',
-        'TRANSPORTS': 'transit',
-        'VELO': 'bicycling',
-        'MARCHE': 'walking'
-    }
-    return modes.get(mode.upper(), 'driving')
-
-def calculer_temps_trajet(gmaps, origine, destination, mode, heure_depart):
-    """Calcule le temps de trajet pour un itinéraire"""
+def chemin_sortie(args, fichier_entree, nom):
+    """Chemin d'un fichier produit, dans le dossier de sortie.
+
+    En traitement par lot, le nom est préfixé par celui du fichier d'entrée et
+    l'empreinte de son chemin : les fichiers traités en parallèle ne s'écrasent
+    pas, même quand deux dossiers contiennent un fichier de même nom.
+    """
+    from journal_trajets import empreinte_chemin
+    
+    if args.fichiers:
+        nom = f"{os.path.splitext(os.path.basename(fichier_entree))[0]}_{empreinte_chemin(fichier_entree)}_{nom}"
+    return os.path.join(args.dossier_sortie, nom)
+
+def afficher_metriques(metriques, fichier):
+    """Affiche le coût et la latence mesurés, puis écrit le rapport JSON des appels"""
+    rapport = metriques.rapport()
+    elements = rapport['elements_factures']
+    print(f"💰 Coût estimé: {rapport['cout_dollars']:.2f} $ "
+          f"({elements['basique']} éléments basiques, {elements['avance']} avancés, "
+          f"{rapport['geocodages_factures']} géocodages)")
+    if rapport['latence_s']['nombre']:
+        print(f"📡 {rapport['latence_s']['nombre']} requêtes, latence moyenne "
+              f"{rapport['latence_s']['moyenne'] * 1000:.0f} ms (p99 ≤ {rapport['latence_s']['p99']} s)")
+    metriques.ecrire_json(fichier)
+    print(f"📄 Rapport des appels: {fichier}")
+
+def executer_balayage(args, fichier_entree, df, moteur, cache, limiteur, politique, metriques, coordonnees=None):
+    """Calcule chaque paire unique sur la grille horaire et écrit profils et résumé.
+
+    Retourne CODE_TRAJETS_EN_ERREUR si un créneau d'une paire n'a pas pu être calculé.
+    """
+    from balayage_trajets import balayer, grille_creneaux, profils_balayage, resumer_balayage
+    from formats_fichiers import EcrivainResultats, lire_blocs
+    from noyau_trajets import paires_balayage
+    
+    creneaux = grille_creneaux(args.balayage_jours, args.balayage_debut, args.balayage_fin, args.balayage_pas)
+    
+    # Paires uniques (origine, destination, mode) ; Heure de départ et Jour sont ignorés
+    # Avec le géocodage, les paires dont une adresse est introuvable ne sont pas envoyées
+    blocs = lire_blocs(fichier_entree, args.taille_bloc, ['Origine', 'Destination', 'Mode de transport']) \
+        if df is None else [df]
+    paires, envoyees, modes_inconnus = paires_balayage(blocs, coordonnees)
+    if modes_inconnus:
+        print(f"\n⚠️  Modes de transport inconnus, paires ignorées: {', '.join(map(str, modes_inconnus))} "
+              f"(attendu: {', '.join(MODES_TRANSPORT)})")
+    
+    total = sum(paire is not None for paire in envoyees) * len(creneaux)
+    print(f"\n🕒 Balayage: {len(envoyees) - envoyees.count(None)} paires × {len(creneaux)} créneaux "
+          f"({', '.join(args.balayage_jours)}, {args.balayage_debut}-{args.balayage_fin} "
+          f"toutes les {args.balayage_pas} min) = {total} trajets\n")
+    afficher_progression(0, total)
+    durees, _ = balayer(
+        moteur, envoyees, creneaux, cache, args.workers, limiteur, politique, metriques, afficher_progression
+    )
+    print("\n")
+    
+    horodatage = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = EXTENSIONS[args.format_sortie]
+    nom_profils = chemin_sortie(args, fichier_entree, f"profils_trajets_{horodatage}{extension}")
+    nom_resume = chemin_sortie(args, fichier_entree, f"balayage_trajets_{horodatage}{extension}")
+    resume = resumer_balayage(paires, creneaux, durees)
+    for nom, table in ((nom_profils, profils_balayage(paires, creneaux, durees)), (nom_resume, resume)):
+        sortie = EcrivainResultats(nom, args.format_sortie)
+        sortie.ecrire(table)
+        sortie.fermer()
+    
+    print("=" * 70)
+    print("📈 RÉSUMÉ DU BALAYAGE")
+    print("=" * 70)
+    print(f"✅ Paires calculées: {int((resume['Créneaux calculés'] > 0).sum())}/{len(paires)}")
+    print(f"📊 Profils (minutes par créneau): {nom_profils}")
+    print(f"🏁 Meilleurs départs et heures de pointe: {nom_resume}")
+    if cache:
+        print(f"💾 Cache: {cache.succes} trajets réutilisés, {cache.echecs} calculés via l'API")
+        cache.fermer()
+    print(f"🔁 Reprises: {politique.reprises} (attente totale {politique.attente:.1f} s, "
+          f"{politique.disjoncteur.ouvertures} pauses de quota)")
+    afficher_metriques(
+        metriques, args.metriques or chemin_sortie(args, fichier_entree, f"balayage_trajets_{horodatage}_metriques.json")
+    )
+    
+    apercu = resume[['Origine', 'Destination', 'Mode de transport', 'Meilleur départ', 'Durée min (min)',
+                     'Surcoût pointe (%)']].head(MAX_ERREURS_AFFICHEES)
+    if not apercu.empty:
+        print("\n🏁 Meilleur départ par paire:")
+        print(apercu.to_string(index=False))
+        if len(resume) > len(apercu):
+            print(f"  ... et {len(resume) - len(apercu)} autres paires (voir {nom_resume})")
+    print("=" * 70)
+    
+    return CODE_TRAJETS_EN_ERREUR if (resume['Créneaux calculés'] < len(creneaux)).any() else CODE_OK
+
+def executer_matrice(args, fichier_entree, df, moteur, limiteur, politique, metriques, coordonnees=None):
+    """Calcule la matrice complète Origine × Destination et écrit matrice et classements.
+
+    Retourne CODE_TRAJETS_EN_ERREUR si un couple de la matrice n'a pas pu être calculé.
+    """
+    import numpy as np
+    
+    from formats_fichiers import EcrivainResultats, lire_blocs
+    from matrice_trajets import calculer_matrice, enregistrer_matrice, k_plus_proches, plus_proches, table_matrice
+    from noyau_trajets import adresses_matrice, preparer_parametres
+    
+    # Les colonnes Origine et Destination sont lues comme deux listes d'adresses indépendantes
+    # Avec le géocodage, les adresses introuvables ne sont pas envoyées
+    blocs = lire_blocs(fichier_entree, args.taille_bloc, ['Origine', 'Destination']) if df is None else [df]
+    origines, destinations, envoyees_origines, envoyees_destinations = adresses_matrice(blocs, coordonnees)
+    
+    params = preparer_parametres(MODES_TRANSPORT[args.matrice_mode], args.matrice_heure, maintenant=datetime.now())
+    total = len(origines) * len(destinations)
+    print(f"\n🧮 Matrice: {len(origines)} origines × {len(destinations)} destinations = {total} trajets "
+          f"({args.matrice_mode}{', départ ' + args.matrice_heure if args.matrice_heure else ''})\n")
+    afficher_progression(0, total)
+    durees, distances = calculer_matrice(
+        moteur, envoyees_origines, envoyees_destinations, params, args.workers, limiteur, politique, metriques,
+        afficher_progression
+    )
+    print("\n")
+    
+    horodatage = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = EXTENSIONS[args.format_sortie]
+    nom_matrice = chemin_sortie(args, fichier_entree, f"matrice_trajets_{horodatage}.npz")
+    nom_table = chemin_sortie(args, fichier_entree, f"matrice_trajets_{horodatage}{extension}")
+    nom_classement = chemin_sortie(args, fichier_entree, f"plus_proches_{horodatage}{extension}")
+    enregistrer_matrice(nom_matrice, origines, destinations, durees, distances)
+    classement = k_plus_proches(origines, destinations, durees, distances, args.k)
+    for nom, table in ((nom_table, table_matrice(origines, destinations, durees, distances)),
+                       (nom_classement, classement)):
+        sortie = EcrivainResultats(nom, args.format_sortie)
+        sortie.ecrire(table)
+        sortie.fermer()
+    
+    print("=" * 70)
+    print("📈 RÉSUMÉ DE LA MATRICE")
+    print("=" * 70)
+    print(f"✅ Trajets calculés: {int((~np.isnan(durees)).sum())}/{total}")
+    print(f"🧮 Matrice dense (NumPy): {nom_matrice}")
+    print(f"📊 Une ligne par couple: {nom_table}")
+    print(f"🏁 {args.k} origines les plus proches de chaque destination: {nom_classement}")
+    print(f"🔁 Reprises: {politique.reprises} (attente totale {politique.attente:.1f} s, "
+          f"{politique.disjoncteur.ouvertures} pauses de quota)")
+    afficher_metriques(
+        metriques, args.metriques or chemin_sortie(args, fichier_entree, f"matrice_trajets_{horodatage}_metriques.json")
+    )
+    
+    apercu = plus_proches(origines, destinations, durees, distances).head(MAX_ERREURS_AFFICHEES)
+    if not apercu.empty:
+        print("\n📍 Origine la plus proche de chaque destination:")
+        print(apercu.to_string(index=False))
+        if len(destinations) > len(apercu):
+            print(f"  ... et {len(destinations) - len(apercu)} autres destinations (voir {nom_classement})")
+    print("=" * 70)
+    
+    return CODE_TRAJETS_EN_ERREUR if np.isnan(durees).any() else CODE_OK
+
+def heure_option(texte):
+    """Heure de départ d'une option : 'HH:MM' normalisé, ou vide pour partir sans heure"""
+    if not texte.strip():
+        return ''
     try:
-        # Préparer les paramètres
-        params = {
-            'origins': origine,
-            'destinations': destination,
-            'mode': mode,
-            'language': 'fr'
-        }
-        
-        # Ajouter l'heure de départ si spécifiée
-        if heure_depart and str(heure_depart).strip():
-            today = datetime.now()
-            heures, minutes = str(heure_depart).split(':')
-            departure_time = today.replace(hour=int(heures), minute=int(minutes), second=0)
-            params['departure_time'] = departure_time
-            
-            # Options spécifiques selon le mode
-            if mode == 'driving':
-                params['traffic_model'] = 'best_guess'
-        
-        # Appel à l'API
-        result = gmaps.distance_matrix(**params)
-        
-        if result['status'] == 'OK':
-            element = result['rows'][0]['elements'][0]
-            
-            if element['status'] == 'OK':
-                temps = element['duration']['text']
-                distance = element['distance']['text']
-                return temps, distance, 'OK'
-            else:
-                return 'Erreur', '-', f"Trajet introuvable: {element['status']}"
-        else:
-            return 'Erreur', '-', f"Erreur API: {result['status']}"
-            
-    except Exception as e:
-        return 'Erreur', '-', str(e)
+        return '{:02d}:{:02d}'.format(*lire_heure(texte))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def nombre_positif(texte):
+    """Débit d'une option : nombre strictement positif"""
+    try:
+        valeur = float(texte)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"nombre invalide: '{texte}'")
+    if not valeur > 0:
+        raise argparse.ArgumentTypeError(f"doit être strictement positif: '{texte}'")
+    return valeur
+
+def lire_arguments(argv=None):
+    """Lit les options de la ligne de commande"""
+    parser = argparse.ArgumentParser(description="Calculateur de temps de trajet Google Maps")
+    parser.add_argument('fichiers', nargs='*',
+                        help="Fichiers ou motifs (ex: agences/*.csv) à traiter sans question ; "
+                             "sans fichier, le nom est demandé")
+    parser.add_argument('--dossier-sortie', default='.',
+                        help="Dossier des fichiers de résultats (défaut: dossier courant)")
+    parser.add_argument('--processus', type=int, default=NB_PROCESSUS,
+                        help=f"Fichiers traités en parallèle, qui se partagent --qps et --eps (défaut: {NB_PROCESSUS})")
+    parser.add_argument('--config', default=FICHIER_CONFIG,
+                        help=f"Fichier de configuration contenant la clé API, section [google], clé cle_api "
+                             f"(défaut: {FICHIER_CONFIG}) ; la variable {VARIABLE_CLE_API} est prioritaire")
+    parser.add_argument('--non-interactif', action='store_true',
+                        help="Ne jamais poser de question : échouer si la clé API ou le fichier manque")
+    parser.add_argument('--moteur', choices=MOTEURS, default='google',
+                        help="Moteur d'itinéraire (défaut: google) ; 'simulateur' fonctionne hors ligne, sans clé")
+    parser.add_argument('--url-api',
+                        help="URL de base de l'API Google (ex: serveur local simulateur_distance_matrix.py)")
+    parser.add_argument('--cache', default=FICHIER_CACHE,
+                        help=f"Fichier du cache des trajets (défaut: {FICHIER_CACHE})")
+    parser.add_argument('--sans-cache', action='store_true',
+                        help="Ne pas lire ni écrire le cache des trajets")
+    parser.add_argument('--creneau', type=int, default=CRENEAU_MINUTES,
+                        help=f"Arrondi de l'heure de départ pour le cache, en minutes (défaut: {CRENEAU_MINUTES})")
+    parser.add_argument('--workers', type=int, default=NB_WORKERS,
+                        help=f"Nombre de requêtes menées en parallèle (défaut: {NB_WORKERS})")
+    parser.add_argument('--qps', type=nombre_positif, default=REQUETES_PAR_SECONDE,
+                        help=f"Requêtes par seconde autorisées (défaut: {REQUETES_PAR_SECONDE})")
+    parser.add_argument('--eps', type=nombre_positif, default=ELEMENTS_PAR_SECONDE,
+                        help=f"Éléments par seconde autorisés (défaut: {ELEMENTS_PAR_SECONDE})")
+    parser.add_argument('--tentatives', type=int, default=TENTATIVES,
+                        help=f"Tentatives maximum par requête en cas d'erreur passagère (défaut: {TENTATIVES})")
+    parser.add_argument('--format-sortie', choices=sorted(EXTENSIONS), default='csv',
+                        help="Format du fichier de résultats (défaut: csv) ; parquet et arrow conservent les types")
+    parser.add_argument('--flux', action='store_true',
+                        help="Lire et écrire le fichier par blocs, à mémoire constante (gros fichiers)")
+    parser.add_argument('--taille-bloc', type=int, default=TAILLE_BLOC,
+                        help=f"Nombre de lignes par bloc en mode flux (défaut: {TAILLE_BLOC})")
+    parser.add_argument('--geocoder', action='store_true',
+                        help="Géocoder une fois chaque adresse unique et envoyer les trajets en coordonnées")
+    parser.add_argument('--estimer', action='store_true',
+                        help="Estimer sans appel les trajets proches de trajets déjà en cache (même mode et créneau) ; "
+                             "nécessite --geocoder et le cache")
+    parser.add_argument('--estimer-rayon', type=float, default=RAYON_METRES,
+                        help=f"Distance maximale entre les extrémités d'un trajet estimé et celles d'un trajet connu, "
+                             f"en mètres (défaut: {RAYON_METRES})")
+    parser.add_argument('--reprendre', action='store_true',
+                        help="Reprendre un calcul interrompu : les lignes réussies du journal ne sont pas recalculées")
+    parser.add_argument('--balayage', action='store_true',
+                        help="Calculer chaque paire sur une grille d'heures de départ (profils, meilleur départ)")
+    parser.add_argument('--balayage-jours', type=lire_jours, default=JOURS_OUVRES,
+                        help="Jours de la grille, ex: Lundi-Vendredi ou Lundi,Jeudi (défaut: Lundi-Vendredi)")
+    parser.add_argument('--balayage-debut', default=HEURE_DEBUT,
+                        help=f"Première heure de départ de la grille (défaut: {HEURE_DEBUT})")
+    parser.add_argument('--balayage-fin', default=HEURE_FIN,
+                        help=f"Dernière heure de départ de la grille (défaut: {HEURE_FIN})")
+    parser.add_argument('--balayage-pas', type=int, default=PAS_MINUTES,
+                        help=f"Intervalle entre deux départs, en minutes (défaut: {PAS_MINUTES})")
+    parser.add_argument('--matrice', action='store_true',
+                        help="Calculer tous les trajets entre les adresses des colonnes Origine et Destination")
+    parser.add_argument('--matrice-mode', type=str.upper, choices=list(MODES_TRANSPORT), default='VOITURE',
+                        help="Mode de transport de la matrice (défaut: VOITURE)")
+    parser.add_argument('--matrice-heure', type=heure_option, default='',
+                        help="Heure de départ de la matrice, ex: 08:00 (défaut: sans heure de départ)")
+    parser.add_argument('--k', type=int, default=K_PLUS_PROCHES,
+                        help=f"Nombre d'origines les plus proches classées par destination (défaut: {K_PLUS_PROCHES})")
+    parser.add_argument('--metriques',
+                        help="Rapport JSON des appels et du coût (défaut: à côté du fichier de résultats)")
+    parser.add_argument('--prometheus',
+                        help="Fichier de métriques au format Prometheus, mis à jour pendant le calcul")
+    parser.add_argument('--port-metriques', type=int,
+                        help="Servir les métriques Prometheus sur http://<hôte>:<port>/metrics pendant le calcul")
+    parser.add_argument('--hote-metriques', default=HOTE_METRIQUES,
+                        help=f"Adresse d'écoute de --port-metriques (défaut: {HOTE_METRIQUES}, "
+                             "0.0.0.0 pour toutes les interfaces)")
+    return parser.parse_args(argv)
 
-def main():
+def lire_cle_api(chemin_config=FICHIER_CONFIG):
+    """Clé API de la variable d'environnement, sinon du fichier de configuration ; None si absente"""
+    cle_api = os.environ.get(VARIABLE_CLE_API, '').strip()
+    if not cle_api and chemin_config and os.path.exists(chemin_config):
+        config = configparser.ConfigParser()
+        config.read(chemin_config, encoding='utf-8')
+        cle_api = config.get('google', 'cle_api', fallback='').strip()
+    return cle_api or None
+
+def developper_motifs(motifs):
+    """Liste des fichiers désignés par des chemins ou des motifs (*.csv, agences/**/*.parquet), sans doublon"""
+    fichiers = []
+    for motif in motifs:
+        if not any(caractere in motif for caractere in '*?['):
+            fichiers.append(motif)
+            continue
+        correspondances = sorted(glob.glob(motif, recursive=True))
+        if not correspondances:
+            print(f"⚠️  Aucun fichier ne correspond à '{motif}'")
+        fichiers.extend(correspondances)
+    return list(dict.fromkeys(fichiers))
+
+def traiter_fichier_journalise(args, fichier_entree, cle_api, limiteur):
+    """Traite un fichier dans un processus du lot ; sa sortie console va dans un journal à côté des résultats"""
+    nom_journal = chemin_sortie(args, fichier_entree, "calcul.log")
+    with open(nom_journal, 'w', encoding='utf-8') as journal, contextlib.redirect_stdout(journal):
+        try:
+            code = traiter_fichier(args, fichier_entree, cle_api, limiteur)
+        except Exception as e:
+            print(f"\n❌ Erreur inattendue: {e}")
+            code = CODE_ECHEC
+    return code, nom_journal
+
+def traiter_lot(args, fichiers, cle_api):
+    """Traite plusieurs fichiers en parallèle, dans des processus qui se partagent le même débit"""
+    from limiteur_debit import GestionnaireDebit
+    
+    nb_processus = max(1, min(args.processus, len(fichiers)))
+    print(f"📚 {len(fichiers)} fichiers, {nb_processus} en parallèle, "
+          f"{args.qps:g} requêtes/s et {args.eps:g} éléments/s au total\n")
+    if args.metriques or args.prometheus or args.port_metriques:
+        print("ℹ️  --metriques, --prometheus et --port-metriques valent pour un seul fichier : "
+              "chaque rapport des appels est écrit à côté des résultats de son fichier\n")
+        args.metriques = args.prometheus = args.port_metriques = None
+    
+    codes = {}
+    with GestionnaireDebit() as gestionnaire:
+        limiteur = gestionnaire.LimiteurDebit(args.qps, args.eps)
+        with ProcessPoolExecutor(max_workers=nb_processus) as executeur:
+            en_cours = {
+                executeur.submit(traiter_fichier_journalise, args, fichier, cle_api, limiteur): fichier
+                for fichier in fichiers
+            }
+            for future in as_completed(en_cours):
+                fichier = en_cours[future]
+                try:
+                    codes[fichier], nom_journal = future.result()
+                except Exception as e:
+                    codes[fichier], nom_journal = CODE_ECHEC, f"erreur du processus: {e}"
+                symbole = {CODE_OK: '✅', CODE_TRAJETS_EN_ERREUR: '⚠️ '}.get(codes[fichier], '❌')
+                print(f"{symbole} [{len(codes)}/{len(fichiers)}] {fichier} (détail: {nom_journal})")
+    
+    echecs = [fichier for fichier, code in codes.items() if code == CODE_ECHEC]
+    partiels = [fichier for fichier, code in codes.items() if code == CODE_TRAJETS_EN_ERREUR]
+    print("\n" + "=" * 70)
+    print(f"📈 LOT: {len(fichiers) - len(echecs)}/{len(fichiers)} fichiers traités, "
+          f"{len(partiels)} avec des trajets en erreur, {len(echecs)} en échec")
+    print("=" * 70)
+    if echecs:
+        return CODE_ECHEC
+    return CODE_TRAJETS_EN_ERREUR if partiels else CODE_OK
+
+def main(argv=None):
+    args = lire_arguments(argv)
+    
     print("=" * 70)
     print("🗺️  CALCULATEUR DE TEMPS DE TRAJET GOOGLE MAPS")
     print("=" * 70)
     print()
     
-    # 1. Demander la clé API
-    cle_api = input("📝 Entrez votre clé API Google Maps: ").strip()
+    # 1. Clé API : variable d'environnement ou fichier de configuration, sinon saisie (inutile avec le simulateur)
+    cle_api = None
+    if args.moteur == 'google':
+        cle_api = lire_cle_api(args.config)
+        if not cle_api and not args.fichiers and not args.non_interactif:
+            cle_api = input("📝 Entrez votre clé API Google Maps: ").strip()
+        
+        if not cle_api:
+            print(f"❌ Clé API requise ! (variable {VARIABLE_CLE_API} ou fichier {args.config})")
+            return CODE_USAGE
     
-    if not cle_api:
-        print("❌ Clé API requise !")
-        return
+    os.makedirs(args.dossier_sortie, exist_ok=True)
     
-    # 2. Demander le fichier CSV
-    fichier_csv = input("📁 Entrez le nom du fichier CSV (ex: Estimation trajet - Feuille 1.csv): ").strip()
+    # Fichiers ou motifs donnés sur la ligne de commande : aucune question posée
+    if args.fichiers:
+        fichiers = developper_motifs(args.fichiers)
+        if not fichiers:
+            print("❌ Aucun fichier à traiter")
+            return CODE_USAGE
+        if len(fichiers) == 1:
+            return traiter_fichier(args, fichiers[0], cle_api)
+        return traiter_lot(args, fichiers, cle_api)
+    
+    if args.non_interactif:
+        print("❌ Aucun fichier à traiter")
+        return CODE_USAGE
+    
+    # 2. Demander le fichier des trajets
+    fichier_entree = input("📁 Entrez le nom du fichier CSV, Parquet ou Arrow (ex: Estimation trajet - Feuille 1.csv): ").strip()
+    return traiter_fichier(args, fichier_entree, cle_api)
+
+def traiter_fichier(args, fichier_entree, cle_api, limiteur=None):
+    """Calcule les trajets d'un fichier et écrit ses résultats ; retourne le code de sortie.
+
+    `limiteur` est le débit partagé en traitement par lot ; à défaut, le
+    fichier a son propre débit (--qps, --eps).
+    """
+    from analyse_trajets import CODES_CALCULES, COLONNE_CODE, StatistiquesTrajets
+    from cache_trajets import CacheTrajets
+    from estimation_trajets import IndexTrajets
+    from formats_fichiers import EcrivainResultats, compter_lignes, lire_blocs, lire_colonnes, lire_table
+    from geocodage import CacheAdresses, geocoder_adresses
+    from journal_trajets import JournalTrajets
+    from limiteur_debit import LimiteurDebit
+    from metriques import ExportPrometheus, MetriquesAppels
+    from moteurs_itineraire import creer_moteur
+    from normalisation_trajets import COLONNES_HEURE, normaliser_trajets
+    from noyau_trajets import calculer_trajets, table_resultats
+    from reprises import Disjoncteur, PolitiqueReprise
     
     try:
-        # Lire le CSV
-        print(f"\n📂 Lecture du fichier '{fichier_csv}'...")
-        df = pd.read_csv(fichier_csv)
+        # Lire le fichier (en mode flux, seulement les noms de colonnes pour l'instant)
+        print(f"\n📂 Lecture du fichier '{fichier_entree}'...")
+        if args.flux:
+            colonnes = lire_colonnes(fichier_entree)
+            total = compter_lignes(fichier_entree)
+        else:
+            df = lire_table(fichier_entree)
+            colonnes = df.columns
+            total = len(df)
         
         # Vérifier les colonnes
-        colonnes_requises = ['Origine', 'Destination', 'Mode de transport']
+        colonnes_requises = ['Origine', 'Destination'] if args.matrice else ['Origine', 'Destination', 'Mode de transport']
         for col in colonnes_requises:
-            if col not in df.columns:
+            if col not in colonnes:
                 print(f"❌ Colonne manquante: '{col}'")
-                return
+                return CODE_ECHEC
         
-        print(f"✅ {len(df)} trajets trouvés")
+        print(f"✅ {total} trajets trouvés")
         
     except FileNotFoundError:
-        print(f"❌ Fichier '{fichier_csv}' introuvable !")
-        return
+        print(f"❌ Fichier '{fichier_entree}' introuvable !")
+        return CODE_ECHEC
     except Exception as e:
-        print(f"❌ Erreur lors de la lecture du CSV: {e}")
-        return
+        print(f"❌ Erreur lors de la lecture du fichier: {e}")
+        return CODE_ECHEC
+    
+    # Vérifier modes, jours et heures avant tout appel, à partir d'une heure de référence commune
+    maintenant = datetime.now()
+    normalise = None
+    if not args.matrice and not args.balayage:
+        if args.flux:
+            a_verifier = [
+                nom for nom in colonnes
+                if nom in ('Origine', 'Destination', 'Mode de transport', 'Jour', *COLONNES_HEURE)
+            ]
+            blocs_verifies = (
+                normaliser_trajets(bloc, maintenant)[1]
+                for bloc in lire_blocs(fichier_entree, args.taille_bloc, a_verifier)
+            )
+        else:
+            normalise, anomalies = normaliser_trajets(df, maintenant)
+            blocs_verifies = [anomalies]
+        nb_anomalies = 0
+        for anomalies in blocs_verifies:
+            if nb_anomalies == 0 and not anomalies.empty:
+                print("\n⚠️  Valeurs invalides (les lignes concernées ne seront pas calculées):")
+            for ligne, probleme in zip(anomalies['Ligne'], anomalies['Problème']):
+                if nb_anomalies < MAX_ERREURS_AFFICHEES:
+                    print(f"  - Ligne {ligne}: {probleme}")
+                nb_anomalies += 1
+        if nb_anomalies > MAX_ERREURS_AFFICHEES:
+            print(f"  ... et {nb_anomalies - MAX_ERREURS_AFFICHEES} autres")
+        if nb_anomalies:
+            print(f"⚠️  {nb_anomalies} valeurs invalides")
     
-    # 3. Initialiser Google Maps
-    print("\n🔌 Connexion à l'API Google Maps...")
+    # 3. Initialiser le moteur d'itinéraire
+    print(f"\n🔌 Connexion au moteur d'itinéraire '{args.moteur}'...")
     try:
-        gmaps = googlemaps.Client(key=cle_api)
+        moteur = creer_moteur(args.moteur, cle_api, args.url_api)
         print("✅ Connexion réussie !")
     except Exception as e:
         print(f"❌ Erreur de connexion: {e}")
-        return
+        return CODE_ECHEC
     
-    # 4. Calculer les trajets
-    print(f"\n🚀 Calcul des temps de trajet en cours...\n")
+    # Le cache ne doit contenir que des réponses de la vraie API Google
+    cache_actif = not args.sans_cache and args.moteur == 'google' and not args.url_api
+    if not args.sans_cache and not cache_actif:
+        print("ℹ️  Moteur simulé ou URL d'API personnalisée: cache désactivé")
+    cache = CacheTrajets(args.cache, args.creneau) if cache_actif else None
+    if limiteur is None:
+        limiteur = LimiteurDebit(args.qps, args.eps)
+    politique = PolitiqueReprise(args.tentatives, disjoncteur=Disjoncteur())
+    metriques = MetriquesAppels()
+    export = None
+    if args.prometheus or args.port_metriques:
+        export = ExportPrometheus(metriques, args.prometheus, args.port_metriques, hote=args.hote_metriques)
     
-    resultats = []
-    
-    for idx, row in df.iterrows():
-        # Afficher la progression
-        afficher_progression(idx, len(df))
+    # Géocodage préalable : les adresses introuvables sont signalées avant tout calcul de trajet
+    coordonnees = None
+    if args.geocoder:
+        print("\n📍 Géocodage des adresses...")
+        if args.flux:
+            blocs_adresses = lire_blocs(fichier_entree, args.taille_bloc, ['Origine', 'Destination'])
+        else:
+            blocs_adresses = [df[['Origine', 'Destination']]]
+        adresses = {}
+        for bloc in blocs_adresses:
+            adresses.update(dict.fromkeys(bloc['Origine'].dropna()))
+            adresses.update(dict.fromkeys(bloc['Destination'].dropna()))
         
-        # Récupérer les données
-        origine = row['Origine']
-        destination = row['Destination']
-        mode = obtenir_mode_transport(row['Mode de transport'])
-        heure = row.get('Heure de départ', row.get('Heure de dÃ©part', ''))
+        cache_adresses = CacheAdresses(args.cache) if cache_actif else None
+        coordonnees, introuvables = geocoder_adresses(
+            moteur, adresses, cache_adresses, args.workers, limiteur, metriques, politique
+        )
+        print(f"✅ {len(adresses)} adresses uniques, {len(introuvables)} introuvables")
+        if cache_adresses:
+            print(f"💾 Cache des adresses: {cache_adresses.succes} réutilisées, {cache_adresses.echecs} géocodées via l'API")
+            cache_adresses.fermer()
         
-        # Calculer le trajet
-        temps, distance, statut = calculer_temps_trajet(gmaps, origine, destination, mode, heure)
+        if introuvables:
+            print("\n⚠️  Adresses introuvables (les trajets concernés ne seront pas calculés):")
+            for adresse, raison in list(introuvables.items())[:MAX_ERREURS_AFFICHEES]:
+                print(f"  - {adresse} ({raison})")
+            if len(introuvables) > MAX_ERREURS_AFFICHEES:
+                print(f"  ... et {len(introuvables) - MAX_ERREURS_AFFICHEES} autres")
+    
+    # Estimation des trajets proches de trajets connus : seuls les trajets en coordonnées sont indexés
+    estimateur = None
+    if args.estimer and not args.matrice and not args.balayage:
+        if cache and coordonnees is not None:
+            estimateur = IndexTrajets(cache, args.estimer_rayon)
+            print(f"\n🔮 Estimation: {estimateur.trajets} trajets connus indexés (rayon {args.estimer_rayon:g} m)")
+        else:
+            print("\nℹ️  Estimation désactivée: elle nécessite le cache et --geocoder")
+    
+    # Mode matrice : produit complet des deux listes d'adresses, découpé en tuiles
+    if args.matrice:
+        if cache:
+            cache.fermer()
+        code = executer_matrice(args, fichier_entree, df if not args.flux else None, moteur, limiteur, politique,
+                                metriques, coordonnees)
+        if export:
+            export.arreter()
+        return code
+    
+    # Mode balayage : chaque paire sur toute la grille horaire, sans journal de reprise
+    if args.balayage:
+        code = executer_balayage(args, fichier_entree, df if not args.flux else None, moteur, cache, limiteur,
+                                 politique, metriques, coordonnees)
+        if export:
+            export.arreter()
+        return code
+    
+    # Journal de reprise : chaque ligne terminée y est ajoutée immédiatement
+    journal = JournalTrajets(fichier_entree, args.dossier_sortie)
+    deja_calcules = {}
+    if args.reprendre:
+        deja_calcules = {
+            ligne: resultat
+            for ligne, resultat in journal.charger().items()
+            if resultat.get(COLONNE_CODE) == 'OK'
+        }
+        print(f"\n♻️  Reprise: {len(deja_calcules)} trajets déjà calculés seront réutilisés")
+    journal.ouvrir(reprendre=args.reprendre)
+    
+    # 4. Calculer les trajets, bloc par bloc
+    print(f"\n🚀 Calcul des temps de trajet en cours...\n")
+    
+    blocs = lire_blocs(fichier_entree, args.taille_bloc) if args.flux else [df]
+    nom_sortie = chemin_sortie(
+        args, fichier_entree, f"resultats_trajets_{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXTENSIONS[args.format_sortie]}"
+    )
+    sortie = EcrivainResultats(nom_sortie, args.format_sortie)
+    
+    # Compteurs et statistiques du résumé, tenus au fil de l'eau
+    succes = 0
+    erreurs = 0
+    lignes_erreur = []
+    statistiques = StatistiquesTrajets()
+    
+    def sur_resultat(position, tampon):
+        nonlocal traites
+        journal.enregistrer(tampon.index[position], tampon.ligne(position))
+        traites += 1
+        afficher_progression(traites, max(total, traites))
+    
+    traites = len(deja_calcules)
+    afficher_progression(traites, total)
+    
+    for bloc in blocs:
+        resultats = calculer_trajets(
+            bloc, moteur, maintenant, cache, args.workers, limiteur, politique, metriques, coordonnees, estimateur,
+            normalise=normalise, deja_calcules=deja_calcules, sur_resultat=sur_resultat
+        )
         
-        # Stocker les résultats
-        resultats.append({
-            'Origine': origine,
-            'Destination': destination,
-            'Mode de transport': row['Mode de transport'],
-            'Heure de départ': heure,
-            'Temps de trajet': temps,
-            'Distance': distance,
-            'Statut': statut
-        })
+        # 5. Ajouter les résultats du bloc au fichier de sortie
+        sortie.ecrire(table_resultats(bloc, resultats))
+        statistiques.ajouter(resultats, bloc['Mode de transport'])
         
-        # Pause pour éviter de surcharger l'API
-        time.sleep(0.2)
+        calcules = resultats[COLONNE_CODE].isin(CODES_CALCULES)
+        succes += int(calcules.sum())
+        erreurs += int((~calcules).sum())
+        en_erreur = bloc[~calcules.to_numpy()]
+        for idx, origine, destination, statut in zip(
+            en_erreur.index, en_erreur['Origine'], en_erreur['Destination'], resultats['Statut'][~calcules]
+        ):
+            if len(lignes_erreur) >= MAX_ERREURS_AFFICHEES:
+                break
+            lignes_erreur.append((idx, origine, destination, statut))
+    
+    sortie.fermer()
+    if export:
+        export.arreter()
     
     # Terminer la barre de progression
-    afficher_progression(len(df), len(df))
+    afficher_progression(traites, max(total, traites))
     print("\n")
     
-    # 5. Créer le DataFrame de résultats
-    df_resultats = pd.DataFrame(resultats)
-    
-    # 6. Sauvegarder les résultats
-    nom_sortie = f"resultats_trajets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    df_resultats.to_csv(nom_sortie, index=False, encoding='utf-8-sig')
+    # Toutes les lignes sont dans le fichier de sortie : le journal n'est plus utile
+    journal.fermer(supprimer=True)
     
     print(f"\n✅ Calcul terminé !")
     print(f"📊 Résultats sauvegardés dans: {nom_sortie}")
     
-    # 7. Afficher un résumé
+    # 6. Afficher un résumé
     print("\n" + "=" * 70)
     print("📈 RÉSUMÉ")
     print("=" * 70)
     
-    succes = len(df_resultats[df_resultats['Statut'] == 'OK'])
-    erreurs = len(df_resultats[df_resultats['Statut'] != 'OK'])
+    print(f"✅ Trajets réussis: {succes}/{traites}")
+    print(f"❌ Trajets en erreur: {erreurs}/{traites}")
     
-    print(f"✅ Trajets réussis: {succes}/{len(df)}")
-    print(f"❌ Trajets en erreur: {erreurs}/{len(df)}")
+    if cache:
+        print(f"💾 Cache: {cache.succes} trajets réutilisés, {cache.echecs} calculés via l'API")
+        cache.fermer()
+    
+    if any(metriques.locales.values()):
+        print(f"🔮 Sans appel: {metriques.locales['estimes']} trajets estimés, "
+              f"{metriques.locales['sur_place']} trajets sur place")
+    
+    print(f"🔁 Reprises: {politique.reprises} (attente totale {politique.attente:.1f} s, "
+          f"{politique.disjoncteur.ouvertures} pauses de quota)")
+    
+    # Coût et latence mesurés sur les appels réellement effectués
+    afficher_metriques(metriques, args.metriques or f"{os.path.splitext(nom_sortie)[0]}_metriques.json")
+    
+    # Statistiques cumulées bloc par bloc : le fichier de sortie n'est pas relu
+    if succes > 0:
+        resume = statistiques.resume()
+        print("\n⏱️  Par mode de transport:")
+        print(resume['par_mode'].to_string())
+        if not resume['par_jour'].empty:
+            print("\n📅 Par jour de départ:")
+            print(resume['par_jour'].to_string())
     
     if erreurs > 0:
         print("\n⚠️  Trajets en erreur:")
-        for idx, row in df_resultats[df_resultats['Statut'] != 'OK'].iterrows():
-            print(f"  - Ligne {idx+1}: {row['Origine']} → {row['Destination']}")
-            print(f"    Raison: {row['Statut']}")
+        for idx, origine, destination, statut in lignes_erreur:
+            print(f"  - Ligne {idx+1}: {origine} → {destination}")
+            print(f"    Raison: {statut}")
+        if erreurs > len(lignes_erreur):
+            print(f"  ... et {erreurs - len(lignes_erreur)} autres (voir le fichier de résultats)")
     
     print("\n" + "=" * 70)
-    print("🎉 Terminé ! Vous pouvez ouvrir le fichier CSV avec Excel.")
+    if args.format_sortie == 'csv':
+        print("🎉 Terminé ! Vous pouvez ouvrir le fichier CSV avec Excel.")
+    else:
+        print(f"🎉 Terminé ! Fichier {args.format_sortie} prêt pour pandas, Arrow ou DuckDB.")
     print("=" * 70)
+    
+    return CODE_TRAJETS_EN_ERREUR if erreurs else CODE_OK
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         print("\n\n⚠️  Opération annulée par l'utilisateur.")
+        print("💡 Relancez avec --reprendre pour repartir des trajets déjà calculés.")
+        sys.exit(130)
     except Exception as e:
-        print(f"\n❌ Erreur inattendue: {e}")
\ No newline at end of file
+        print(f"\n❌ Erreur inattendue: {e}")
+        sys.exit(CODE_ECHEC)
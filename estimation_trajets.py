@@ -0,0 +1,162 @@
+"""Réponses locales : trajets sur place et estimation à partir des trajets déjà calculés.
+
+Un trajet dont l'origine et la destination sont identiques est répondu sans
+appel, avec le code de statut SUR_PLACE : ses durées nulles restent hors des
+statistiques. En mode estimation (optionnel), un trajet en coordonnées dont les deux
+extrémités tombent à moins d'un rayon donné des extrémités d'un trajet déjà
+présent dans le cache, pour le même mode et le même créneau de départ, reçoit
+une durée interpolée au lieu d'un appel facturé. L'élément produit porte
+`'estime': True` et ses valeurs sont rangées avec le code de statut ESTIME.
+
+Les trajets connus sont rangés dans une grille dont les cellules font la
+taille du rayon, indexée par la cellule de l'origine : une estimation
+n'examine que les 9 cellules autour de l'origine demandée.
+"""
+import json
+import math
+
+from cache_trajets import normaliser_adresse
+from options_trajets import RAYON_METRES
+
+# Nombre maximal de trajets connus combinés dans une estimation
+VOISINS = 4
+
+RAYON_TERRE_METRES = 6371000
+METRES_PAR_DEGRE = 111320
+
+
+def texte_duree(secondes):
+    """Durée au format des réponses Google en français"""
+    minutes = max(1, round(secondes / 60)) if secondes else 0
+    heures, minutes = divmod(minutes, 60)
+    if heures == 0:
+        return f"{minutes} min"
+    texte = f"{heures} heure{'s' if heures > 1 else ''}"
+    return f"{texte} {minutes} min" if minutes else texte
+
+
+def texte_distance(metres):
+    """Distance au format des réponses Google en français"""
+    if metres < 1000:
+        return f"{metres} m"
+    return f"{metres / 1000:.1f} km".replace('.', ',')
+
+
+def lire_coordonnees(texte):
+    """(lat, lng) d'une chaîne 'lat,lng', ou None pour une adresse"""
+    try:
+        lat, lng = (float(partie) for partie in str(texte).split(','))
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def distance_metres(a, b):
+    """Distance à vol d'oiseau (haversine)"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return RAYON_TERRE_METRES * 2 * math.asin(math.sqrt(h))
+
+
+def trajet_sur_place(origine, destination):
+    """Élément de réponse d'un trajet dont l'origine est la destination, ou None.
+
+    Deux adresses absentes ou vides ne font pas un trajet sur place.
+    """
+    origine, destination = normaliser_adresse(origine), normaliser_adresse(destination)
+    if not origine or origine != destination:
+        return None
+    return {
+        'status': 'OK',
+        'sur_place': True,
+        'distance': {'value': 0, 'text': texte_distance(0)},
+        'duration': {'value': 0, 'text': texte_duree(0)},
+    }
+
+
+class IndexTrajets:
+    """Grille spatiale des trajets du cache, par mode et créneau de départ.
+
+    Seules les entrées encore valides et exprimées en coordonnées (trajets
+    géocodés) sont indexées. Un trajet connu n'est transposé que s'il est
+    long d'au moins deux rayons : l'écart relatif de longueur reste borné.
+    """
+
+    def __init__(self, cache, rayon=RAYON_METRES, voisins=VOISINS):
+        self.cache = cache
+        self.rayon = rayon
+        self.voisins = voisins
+        self.trajets = 0
+        # (mode, créneau) -> {cellule de l'origine: [(origine, destination, élément JSON)]}
+        self._grilles = {}
+        for origine, destination, mode, creneau, element in cache.entrees():
+            self.ajouter((mode, creneau), origine, destination, element)
+
+    def _cellule(self, point):
+        lat, lng = point
+        return (
+            math.floor(lat * METRES_PAR_DEGRE / self.rayon),
+            math.floor(lng * METRES_PAR_DEGRE * math.cos(math.radians(lat)) / self.rayon),
+        )
+
+    def ajouter(self, cle, origine, destination, element):
+        """Indexe un trajet connu ; `element` est l'élément de réponse en JSON"""
+        o, d = lire_coordonnees(origine), lire_coordonnees(destination)
+        if o is None or d is None or distance_metres(o, d) < 2 * self.rayon:
+            return
+        self._grilles.setdefault(cle, {}).setdefault(self._cellule(o), []).append((o, d, element))
+        self.trajets += 1
+
+    def proches(self, cle, o, d):
+        """Trajets connus dont les deux extrémités sont dans le rayon, du plus proche au plus éloigné"""
+        grille = self._grilles.get(cle)
+        if not grille:
+            return []
+        ligne, colonne = self._cellule(o)
+        proches = []
+        for dl in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                for o_connu, d_connu, element in grille.get((ligne + dl, colonne + dc), ()):
+                    ecart_origine = distance_metres(o, o_connu)
+                    if ecart_origine > self.rayon:
+                        continue
+                    ecart_destination = distance_metres(d, d_connu)
+                    if ecart_destination > self.rayon:
+                        continue
+                    proches.append((ecart_origine + ecart_destination, o_connu, d_connu, element))
+        proches.sort(key=lambda proche: proche[0])
+        return proches[:self.voisins]
+
+    def estimer(self, origine, destination, params):
+        """Élément estimé d'après les trajets connus proches, ou None.
+
+        Chaque trajet connu est mis à l'échelle du rapport des distances à vol
+        d'oiseau, puis les trajets sont pondérés par l'inverse de leur écart.
+        """
+        o, d = lire_coordonnees(origine), lire_coordonnees(destination)
+        if o is None or d is None:
+            return None
+        _, _, mode, creneau = self.cache.cle(origine, destination, params)
+        proches = self.proches((mode, creneau), o, d)
+        if not proches:
+            return None
+
+        longueur = distance_metres(o, d)
+        sommes = {}
+        for ecart, o_connu, d_connu, element in proches:
+            element = json.loads(element)
+            poids = 1 / (1 + ecart)
+            echelle = longueur / distance_metres(o_connu, d_connu)
+            for champ in ('duration', 'distance', 'duration_in_traffic'):
+                if champ in element:
+                    total, poids_total = sommes.get(champ, (0.0, 0.0))
+                    sommes[champ] = (total + poids * echelle * element[champ]['value'], poids_total + poids)
+
+        estimation = {'status': 'OK', 'estime': True}
+        for champ, (total, poids_total) in sommes.items():
+            valeur = round(total / poids_total)
+            texte = texte_distance(valeur) if champ == 'distance' else texte_duree(valeur)
+            estimation[champ] = {'value': valeur, 'text': texte}
+        return estimation
@@ -0,0 +1,176 @@
+"""Lecture et écriture des fichiers de trajets : CSV, Parquet et Arrow IPC.
+
+Le format est déduit de l'extension. Parquet et Arrow conservent les types des
+colonnes (entiers, catégories, dates) et sont plus rapides à lire et à écrire
+que le CSV sur les gros historiques. Les résultats Parquet sont écrits par
+groupes de lignes, relisibles partiellement sans charger tout le fichier.
+Parquet et Arrow nécessitent pyarrow.
+"""
+import io
+import os
+
+import pandas as pd
+
+FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+TYPES_MIME = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+
+# Nombre maximal de lignes par groupe dans les fichiers Parquet écrits
+TAILLE_GROUPE_LIGNES = 50000
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Le module 'pyarrow' est requis pour les formats Parquet et Arrow (pip install pyarrow)")
+    return pyarrow
+
+
+def format_fichier(nom):
+    """Format ('csv', 'parquet' ou 'arrow') d'après l'extension du nom de fichier"""
+    extension = os.path.splitext(str(nom))[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Format de fichier non pris en charge: '{extension}' (attendu: {', '.join(FORMATS)})")
+    return FORMATS[extension]
+
+
+def lire_table(source, nom=None, colonnes=None):
+    """Lit un fichier entier dans un DataFrame.
+
+    `source` est un chemin ou un fichier ouvert (upload Streamlit) ; dans ce
+    dernier cas, `nom` donne l'extension.
+    """
+    format_ = format_fichier(nom or source)
+    if format_ == 'csv':
+        return pd.read_csv(source, usecols=colonnes)
+    pa = _pyarrow()
+    if format_ == 'parquet':
+        return pa.parquet.read_table(source, columns=colonnes).to_pandas()
+    table = pa.ipc.open_file(source).read_all()
+    return (table.select(colonnes) if colonnes else table).to_pandas()
+
+
+def lire_colonnes(chemin):
+    """Noms des colonnes d'un fichier, sans lire les données"""
+    format_ = format_fichier(chemin)
+    if format_ == 'csv':
+        return list(pd.read_csv(chemin, nrows=0).columns)
+    pa = _pyarrow()
+    if format_ == 'parquet':
+        return pa.parquet.ParquetFile(chemin).schema_arrow.names
+    with pa.memory_map(chemin) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def compter_lignes(chemin):
+    """Nombre de lignes de données, sans charger le fichier en mémoire"""
+    format_ = format_fichier(chemin)
+    if format_ == 'csv':
+        with open(chemin, 'rb') as f:
+            return max(sum(1 for _ in f) - 1, 0)
+    pa = _pyarrow()
+    if format_ == 'parquet':
+        return pa.parquet.ParquetFile(chemin).metadata.num_rows
+    with pa.memory_map(chemin) as source:
+        lecteur = pa.ipc.open_file(source)
+        return sum(lecteur.get_batch(i).num_rows for i in range(lecteur.num_record_batches))
+
+
+def lire_blocs(chemin, taille_bloc, colonnes=None):
+    """Lit un fichier par blocs de `taille_bloc` lignes ; l'index suit les numéros de ligne"""
+    format_ = format_fichier(chemin)
+    if format_ == 'csv':
+        yield from pd.read_csv(chemin, chunksize=taille_bloc, usecols=colonnes)
+        return
+
+    pa = _pyarrow()
+    if format_ == 'parquet':
+        lots = pa.parquet.ParquetFile(chemin).iter_batches(batch_size=taille_bloc, columns=colonnes)
+    else:
+        source = pa.memory_map(chemin)
+        lecteur = pa.ipc.open_file(source)
+        lots = (lecteur.get_batch(i) for i in range(lecteur.num_record_batches))
+
+    debut = 0
+    for lot in lots:
+        for decalage in range(0, lot.num_rows, taille_bloc):
+            morceau = lot.slice(decalage, taille_bloc)
+            if colonnes and format_ == 'arrow':
+                morceau = morceau.select(colonnes)
+            df = morceau.to_pandas()
+            df.index = pd.RangeIndex(debut, debut + len(df))
+            debut += len(df)
+            yield df
+
+
+class EcrivainResultats:
+    """Écrit un fichier de résultats bloc par bloc, dans le format choisi"""
+
+    def __init__(self, chemin, format_=None):
+        self.chemin = chemin
+        self.format = format_ or format_fichier(chemin)
+        self._premier = True
+        self._schema = None
+        self._ecrivain = None
+
+    def _table(self, df):
+        pa = _pyarrow()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._schema is None:
+            self._schema = table.schema
+        else:
+            # Un bloc peut avoir une colonne entièrement vide, typée différemment
+            table = table.cast(self._schema)
+        return table
+
+    def ecrire(self, df):
+        if self.format == 'csv':
+            df.to_csv(
+                self.chemin,
+                mode='w' if self._premier else 'a',
+                header=self._premier,
+                index=False,
+                encoding='utf-8-sig' if self._premier else 'utf-8'
+            )
+        else:
+            pa = _pyarrow()
+            table = self._table(df)
+            if self._ecrivain is None:
+                if self.format == 'parquet':
+                    self._ecrivain = pa.parquet.ParquetWriter(self.chemin, table.schema)
+                else:
+                    self._ecrivain = pa.ipc.new_file(self.chemin, table.schema)
+            if self.format == 'parquet':
+                self._ecrivain.write_table(table, row_group_size=TAILLE_GROUPE_LIGNES)
+            else:
+                self._ecrivain.write_table(table)
+        self._premier = False
+
+    def fermer(self):
+        if self._ecrivain is not None:
+            self._ecrivain.close()
+            self._ecrivain = None
+
+
+def table_en_octets(df, format_):
+    """Contenu d'un fichier de résultats en mémoire (pour un téléchargement)"""
+    if format_ == 'csv':
+        return df.to_csv(index=False, encoding='utf-8-sig')
+    tampon = io.BytesIO()
+    ecrivain = EcrivainResultats(tampon, format_)
+    ecrivain.ecrire(df)
+    ecrivain.fermer()
+    return tampon.getvalue()
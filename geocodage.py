@@ -0,0 +1,133 @@
+"""Géocodage préalable des adresses, avec cache persistant adresse -> coordonnées.
+
+Les adresses uniques du fichier sont géocodées une seule fois avant tout appel
+Distance Matrix. Les trajets sont ensuite envoyés en latitude/longitude : les
+requêtes sont plus légères et deux écritures d'un même lieu partagent la même
+clé dans le cache des trajets. Les adresses introuvables sont connues avant
+qu'aucun quota Distance Matrix ne soit consommé.
+"""
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_trajets import FICHIER_CACHE, normaliser_adresse
+from metriques import statut_erreur
+from options_trajets import NB_WORKERS
+
+
+def formater_coordonnees(lat, lng):
+    """Coordonnées au format 'lat,lng' accepté par l'API"""
+    return f"{lat:.6f},{lng:.6f}"
+
+
+class CacheAdresses:
+    """Cache persistant des coordonnées des adresses déjà géocodées"""
+
+    def __init__(self, chemin=FICHIER_CACHE):
+        self.chemin = chemin
+        self.succes = 0
+        self.echecs = 0
+        self._verrou = threading.Lock()
+        self._connexion = sqlite3.connect(chemin, check_same_thread=False)
+        self._connexion.execute(
+            'CREATE TABLE IF NOT EXISTS adresses ('
+            ' adresse TEXT PRIMARY KEY, lat REAL, lng REAL, enregistre REAL)'
+        )
+        self._connexion.commit()
+
+    def lire(self, adresse):
+        """Retourne (lat, lng) ou None si l'adresse n'a jamais été géocodée"""
+        with self._verrou:
+            ligne = self._connexion.execute(
+                'SELECT lat, lng FROM adresses WHERE adresse = ?',
+                (normaliser_adresse(adresse),)
+            ).fetchone()
+            if ligne is None:
+                self.echecs += 1
+            else:
+                self.succes += 1
+        return ligne
+
+    def ecrire(self, adresse, lat, lng):
+        with self._verrou:
+            self._connexion.execute(
+                'INSERT OR REPLACE INTO adresses VALUES (?, ?, ?, ?)',
+                (normaliser_adresse(adresse), lat, lng, time.time())
+            )
+            self._connexion.commit()
+
+    def fermer(self):
+        with self._verrou:
+            self._connexion.close()
+
+
+def appeler_geocodage(moteur, adresse, metriques=None):
+    """Géocode une adresse ; retourne (lat, lng) ou None, lève une exception si l'appel échoue.
+
+    Avec des `MetriquesAppels`, chaque tentative est enregistrée.
+    """
+    debut = time.perf_counter()
+    try:
+        position = moteur.geocoder(adresse)
+    except Exception as e:
+        if metriques:
+            metriques.enregistrer_geocodage(time.perf_counter() - debut, statut_erreur(e))
+        raise
+    if metriques:
+        metriques.enregistrer_geocodage(time.perf_counter() - debut, 'OK' if position else 'ZERO_RESULTS')
+    return position
+
+
+def geocoder_adresse(moteur, adresse, metriques=None, politique=None):
+    """Géocode une adresse ; retourne ((lat, lng), None) ou (None, raison).
+
+    Avec une `PolitiqueReprise`, les erreurs passagères (quota, timeout) sont
+    retentées avant que l'adresse ne soit déclarée introuvable.
+    """
+    try:
+        if politique:
+            position = politique.executer(appeler_geocodage, moteur, adresse, metriques)
+        else:
+            position = appeler_geocodage(moteur, adresse, metriques)
+    except Exception as e:
+        # Certaines exceptions du client (Timeout) n'ont pas de message
+        return None, str(e) or type(e).__name__
+    if position is None:
+        return None, 'ZERO_RESULTS'
+    return position, None
+
+
+def geocoder_adresses(moteur, adresses, cache=None, nb_workers=NB_WORKERS, limiteur=None, metriques=None,
+                      politique=None):
+    """Géocode chaque adresse unique une seule fois.
+
+    Retourne (coordonnees, introuvables) : `coordonnees` associe chaque adresse
+    résolue à sa chaîne 'lat,lng', `introuvables` associe les autres à la
+    raison de l'échec. La `PolitiqueReprise` et son disjoncteur sont ceux des
+    appels Distance Matrix : le client Google ne retente rien lui-même.
+    """
+    coordonnees = {}
+    introuvables = {}
+    a_geocoder = []
+    for adresse in dict.fromkeys(adresses):
+        position = cache.lire(adresse) if cache else None
+        if position is not None:
+            coordonnees[adresse] = formater_coordonnees(*position)
+        else:
+            a_geocoder.append(adresse)
+
+    def geocoder(adresse):
+        if limiteur:
+            limiteur.acquerir(1)
+        return geocoder_adresse(moteur, adresse, metriques, politique)
+
+    with ThreadPoolExecutor(max_workers=max(1, nb_workers)) as executeur:
+        for adresse, (position, raison) in zip(a_geocoder, executeur.map(geocoder, a_geocoder)):
+            if position is None:
+                introuvables[adresse] = raison
+                continue
+            coordonnees[adresse] = formater_coordonnees(*position)
+            if cache:
+                cache.ecrire(adresse, *position)
+    return coordonnees, introuvables
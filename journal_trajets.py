@@ -0,0 +1,74 @@
+"""Journal de reprise des calculs longs.
+
+Chaque ligne terminée est ajoutée à un fichier JSON Lines propre au fichier
+d'entrée, rangé dans le dossier de sortie. Son nom reprend le nom et le
+chemin du fichier d'entrée ainsi que l'empreinte SHA-256 de son contenu :
+deux fichiers identiques traités dans le même lot ont chacun leur journal.
+Après une interruption, le calcul peut reprendre en réutilisant les lignes
+déjà journalisées.
+"""
+import hashlib
+import json
+import os
+
+PREFIXE_JOURNAL = '.journal_trajets_'
+
+
+def empreinte_fichier(chemin):
+    """Empreinte SHA-256 du contenu d'un fichier, lu par morceaux"""
+    empreinte = hashlib.sha256()
+    with open(chemin, 'rb') as f:
+        for morceau in iter(lambda: f.read(1 << 20), b''):
+            empreinte.update(morceau)
+    return empreinte.hexdigest()
+
+
+def empreinte_chemin(chemin):
+    """Empreinte courte du chemin absolu d'un fichier : distingue deux fichiers de même nom"""
+    return hashlib.sha256(os.path.abspath(chemin).encode('utf-8')).hexdigest()[:8]
+
+
+class JournalTrajets:
+    """Journal append-only des résultats, indexés par numéro de ligne"""
+
+    def __init__(self, fichier_entree, dossier='.'):
+        self.empreinte = empreinte_fichier(fichier_entree)
+        nom = os.path.splitext(os.path.basename(fichier_entree))[0]
+        self.chemin = os.path.join(
+            dossier, f"{PREFIXE_JOURNAL}{nom}_{empreinte_chemin(fichier_entree)}_{self.empreinte[:16]}.jsonl"
+        )
+        self._fichier = None
+
+    def charger(self):
+        """Retourne {ligne: resultat} pour les lignes déjà journalisées"""
+        lignes = {}
+        if not os.path.exists(self.chemin):
+            return lignes
+        with open(self.chemin, encoding='utf-8') as f:
+            for texte in f:
+                try:
+                    entree = json.loads(texte)
+                except ValueError:
+                    # Dernière ligne tronquée par l'interruption
+                    continue
+                if entree.get('empreinte') == self.empreinte:
+                    lignes[entree['ligne']] = entree['resultat']
+        return lignes
+
+    def ouvrir(self, reprendre=False):
+        """Ouvre le journal en écriture ; sans reprise, l'ancien journal est effacé"""
+        self._fichier = open(self.chemin, 'a' if reprendre else 'w', encoding='utf-8', buffering=1)
+
+    def enregistrer(self, ligne, resultat):
+        self._fichier.write(json.dumps(
+            {'empreinte': self.empreinte, 'ligne': int(ligne), 'resultat': resultat},
+            ensure_ascii=False,
+            default=str
+        ) + '\n')
+
+    def fermer(self, supprimer=False):
+        if self._fichier:
+            self._fichier.close()
+            self._fichier = None
+        if supprimer and os.path.exists(self.chemin):
+            os.remove(self.chemin)
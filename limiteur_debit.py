@@ -0,0 +1,74 @@
+"""Limiteur de débit à seaux de jetons pour les appels Distance Matrix.
+
+Deux seaux sont partagés par tous les workers : un pour le nombre de requêtes
+par seconde, un pour le nombre d'éléments (origines x destinations) par
+seconde, qui est l'unité de quota et de facturation de l'API. Un limiteur
+peut dépendre d'un limiteur parent : chaque calcul garde son propre débit,
+et le parent plafonne l'ensemble des calculs qui le partagent. Entre
+plusieurs processus, le limiteur est servi par un `GestionnaireDebit`.
+"""
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from options_trajets import ELEMENTS_PAR_SECONDE, REQUETES_PAR_SECONDE
+
+
+class LimiteurDebit:
+    """Seaux de jetons requêtes/s et éléments/s, utilisables depuis plusieurs threads"""
+
+    def __init__(self, requetes_par_seconde=REQUETES_PAR_SECONDE, elements_par_seconde=ELEMENTS_PAR_SECONDE,
+                 parent=None):
+        if requetes_par_seconde <= 0 or elements_par_seconde <= 0:
+            raise ValueError("Les débits autorisés doivent être positifs")
+        self.requetes_par_seconde = float(requetes_par_seconde)
+        self.elements_par_seconde = float(elements_par_seconde)
+        self._jetons_requetes = self.requetes_par_seconde
+        self._jetons_elements = self.elements_par_seconde
+        self._dernier_remplissage = time.monotonic()
+        self.parent = parent
+        self._verrou = threading.Lock()
+
+    def _remplir(self):
+        maintenant = time.monotonic()
+        ecoule = maintenant - self._dernier_remplissage
+        self._dernier_remplissage = maintenant
+        self._jetons_requetes = min(
+            self.requetes_par_seconde,
+            self._jetons_requetes + ecoule * self.requetes_par_seconde
+        )
+        self._jetons_elements = min(
+            self.elements_par_seconde,
+            self._jetons_elements + ecoule * self.elements_par_seconde
+        )
+
+    def acquerir(self, elements=1):
+        """Bloque jusqu'à ce qu'une requête de `elements` éléments puisse partir"""
+        # Une requête plus grosse que la capacité du seau passe dès qu'il est plein
+        seuil_elements = min(elements, self.elements_par_seconde)
+        while True:
+            with self._verrou:
+                self._remplir()
+                if self._jetons_requetes >= 1 and self._jetons_elements >= seuil_elements:
+                    self._jetons_requetes -= 1
+                    self._jetons_elements -= elements
+                    break
+                attente = max(
+                    (1 - self._jetons_requetes) / self.requetes_par_seconde,
+                    (seuil_elements - self._jetons_elements) / self.elements_par_seconde
+                )
+            time.sleep(attente)
+        if self.parent:
+            self.parent.acquerir(elements)
+
+
+class GestionnaireDebit(BaseManager):
+    """Processus serveur d'un LimiteurDebit partagé par plusieurs processus.
+
+    `gestionnaire.LimiteurDebit(...)` retourne un mandataire transmissible aux
+    processus de travail : chaque `acquerir` s'exécute dans le serveur, tous
+    les processus puisent donc dans les mêmes seaux.
+    """
+
+
+GestionnaireDebit.register('LimiteurDebit', LimiteurDebit)
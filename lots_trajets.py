@@ -0,0 +1,228 @@
+"""Regroupement des trajets en appels Distance Matrix multi-origines / multi-destinations.
+
+Au lieu d'un appel par ligne, les trajets sont regroupés par paramètres d'appel
+(mode, heure de départ, modèle de trafic), dédoublonnés, puis répartis en lots
+qui respectent les limites de l'API. Les résultats sont ensuite redistribués
+dans l'ordre des lignes d'origine.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from googlemaps.exceptions import ApiError
+
+from estimation_trajets import trajet_sur_place
+from metriques import statut_erreur
+from options_trajets import NB_WORKERS
+
+# Limites de l'API Distance Matrix par requête
+LIMITE_ORIGINES = 25
+LIMITE_DESTINATIONS = 25
+LIMITE_ELEMENTS = 100
+
+
+def cle_parametres(params):
+    """Clé de regroupement : tous les paramètres d'appel hors origines/destinations"""
+    return tuple(sorted(
+        (cle, valeur) for cle, valeur in params.items()
+        if cle not in ('origins', 'destinations')
+    ))
+
+
+def _decouper(elements, taille):
+    return [elements[i:i + taille] for i in range(0, len(elements), taille)]
+
+
+def _paquets_par_axe(paires, limite_axe, limite_autre_axe):
+    """Regroupe des paires (a, b) en paquets (liste de a, liste de b) sans élément inutile.
+
+    Les b de chaque a sont découpés en tranches, puis les a qui partagent
+    exactement la même tranche de b sont fusionnés dans un même paquet.
+    """
+    voisins = {}
+    for a, b in paires:
+        voisins.setdefault(a, []).append(b)
+
+    par_tranche = {}
+    for a, liste_b in voisins.items():
+        for tranche in _decouper(liste_b, limite_autre_axe):
+            par_tranche.setdefault(tuple(tranche), []).append(a)
+
+    paquets = []
+    for tranche, liste_a in par_tranche.items():
+        taille_a = min(limite_axe, LIMITE_ELEMENTS // len(tranche))
+        for morceau in _decouper(liste_a, taille_a):
+            paquets.append((morceau, list(tranche)))
+    return paquets
+
+
+def _paquets(paires):
+    """Choisit l'orientation (par origine ou par destination) donnant le moins d'appels"""
+    par_origine = _paquets_par_axe(paires, LIMITE_ORIGINES, LIMITE_DESTINATIONS)
+    par_destination = [
+        (origines, destinations)
+        for destinations, origines in _paquets_par_axe(
+            [(d, o) for o, d in paires], LIMITE_DESTINATIONS, LIMITE_ORIGINES
+        )
+    ]
+    return par_origine if len(par_origine) <= len(par_destination) else par_destination
+
+
+def planifier_lots(demandes):
+    """Construit les lots d'appels à partir d'une liste de demandes.
+
+    Chaque demande est un tuple (origine, destination, params). Retourne une
+    liste de lots, chacun étant un dict avec les clés 'params', 'origines',
+    'destinations' et 'indices' (positions des demandes couvertes par le lot).
+    """
+    groupes = {}
+    for i, (origine, destination, params) in enumerate(demandes):
+        cle = cle_parametres(params)
+        if cle not in groupes:
+            groupes[cle] = (params, {})
+        groupes[cle][1].setdefault((origine, destination), []).append(i)
+
+    lots = []
+    for params, paires in groupes.values():
+        for origines, destinations in _paquets(list(paires)):
+            indices = [
+                i
+                for origine in origines
+                for destination in destinations
+                for i in paires.get((origine, destination), [])
+            ]
+            lots.append({
+                'params': params,
+                'origines': origines,
+                'destinations': destinations,
+                'indices': indices,
+            })
+    return lots
+
+
+def appeler_lot(moteur, lot, metriques=None):
+    """Appelle le moteur d'itinéraire pour un lot ; lève une exception si l'appel échoue.
+
+    Avec des `MetriquesAppels`, chaque tentative est enregistrée (latence,
+    statut, éléments facturés).
+    """
+    elements = len(lot['origines']) * len(lot['destinations'])
+    debut = time.perf_counter()
+    try:
+        result = moteur.calculer_lot(lot['origines'], lot['destinations'], **lot['params'])
+        if result['status'] != 'OK':
+            raise ApiError(result['status'])
+    except Exception as e:
+        if metriques:
+            metriques.enregistrer_appel(lot['params'], elements, time.perf_counter() - debut, statut_erreur(e))
+        raise
+    if metriques:
+        metriques.enregistrer_appel(lot['params'], elements, time.perf_counter() - debut, 'OK')
+    return result
+
+
+def executer_lot(moteur, lot, politique=None, metriques=None):
+    """Exécute un lot et retourne {(origine, destination): (element, erreur)}.
+
+    Avec une `PolitiqueReprise`, les erreurs passagères sont retentées avant
+    d'être reportées sur chaque trajet du lot.
+    """
+    reponses = {}
+    if metriques:
+        metriques.enregistrer_lot()
+    try:
+        if politique:
+            result = politique.executer(appeler_lot, moteur, lot, metriques)
+        else:
+            result = appeler_lot(moteur, lot, metriques)
+        for origine, ligne in zip(lot['origines'], result['rows']):
+            for destination, element in zip(lot['destinations'], ligne['elements']):
+                reponses[(origine, destination)] = (element, None)
+        return reponses
+    except ApiError as e:
+        erreur = f"Erreur API: {e}"
+    except Exception as e:
+        # Certaines exceptions du client (Timeout) n'ont pas de message
+        erreur = str(e) or type(e).__name__
+
+    for origine in lot['origines']:
+        for destination in lot['destinations']:
+            reponses[(origine, destination)] = (None, erreur)
+    return reponses
+
+
+def iterer_lots(moteur, lots, nb_workers=NB_WORKERS, limiteur=None, politique=None, metriques=None):
+    """Exécute des lots en parallèle et produit (lot, reponses) au fil de leur achèvement.
+
+    `reponses` est le dict retourné par `executer_lot`. Les lots sont exécutés
+    par `nb_workers` threads au rythme autorisé par le `LimiteurDebit`.
+    """
+    def executer(lot):
+        if limiteur:
+            limiteur.acquerir(len(lot['origines']) * len(lot['destinations']))
+        return executer_lot(moteur, lot, politique, metriques)
+
+    executeur = ThreadPoolExecutor(max_workers=max(1, nb_workers))
+    try:
+        en_cours = {executeur.submit(executer, lot): lot for lot in lots}
+        for future in as_completed(en_cours):
+            yield en_cours[future], future.result()
+    finally:
+        # Interruption : abandonner les lots qui n'ont pas encore démarré
+        executeur.shutdown(wait=True, cancel_futures=True)
+
+
+def iterer_resultats(moteur, demandes, cache=None, nb_workers=NB_WORKERS, limiteur=None, politique=None,
+                     metriques=None, estimateur=None):
+    """Exécute les demandes par lots et produit (indice, element, erreur) au fil des lots.
+
+    `element` est l'élément brut renvoyé par l'API pour la paire demandée ;
+    `erreur` est un message lorsque l'appel lui-même a échoué. Avec un
+    `CacheTrajets`, les trajets déjà connus sont servis sans appel réseau.
+    Les lots sont exécutés par `nb_workers` threads au rythme autorisé par le
+    `LimiteurDebit` : les résultats arrivent donc dans le désordre et c'est
+    l'indice qui permet de les replacer. Une `PolitiqueReprise` retente les
+    erreurs passagères ; des `MetriquesAppels` mesurent appels et accès au cache.
+    Les trajets sur place sont répondus localement ; avec un `IndexTrajets`,
+    ceux qui sont proches de trajets connus sont estimés sans appel.
+    """
+    a_calculer = []
+    for i, (origine, destination, params) in enumerate(demandes):
+        element = trajet_sur_place(origine, destination)
+        if element is not None:
+            if metriques:
+                metriques.enregistrer_local('sur_place')
+            yield i, element, None
+            continue
+
+        element = cache.lire(origine, destination, params, compter=False) if cache else None
+        if element is None and estimateur:
+            element = estimateur.estimer(origine, destination, params)
+            if element is not None:
+                # Estimé sans appel : ni réutilisé, ni calculé via l'API
+                if metriques:
+                    metriques.enregistrer_local('estimes')
+                yield i, element, None
+                continue
+        if cache:
+            cache.compter(element is not None)
+            if metriques:
+                metriques.enregistrer_cache(element is not None)
+        if element is not None:
+            yield i, element, None
+        else:
+            a_calculer.append(i)
+
+    sous_demandes = [demandes[i] for i in a_calculer]
+    lots = planifier_lots(sous_demandes)
+    for lot, reponses in iterer_lots(moteur, lots, nb_workers, limiteur, politique, metriques):
+        if cache:
+            cache.ecrire_lot(
+                (origine, destination, lot['params'], element)
+                for (origine, destination), (element, _) in reponses.items()
+            )
+        for j in lot['indices']:
+            origine, destination, _ = sous_demandes[j]
+            element, erreur = reponses.get(
+                (origine, destination), (None, 'Réponse absente pour ce trajet')
+            )
+            yield a_calculer[j], element, erreur
@@ -0,0 +1,143 @@
+"""Matrice complète des trajets entre deux listes d'adresses.
+
+Le produit origines × destinations (par exemple 300 agences × 2 000 sites
+clients) est découpé en tuiles qui respectent les limites de l'API par
+requête, sans passer par un fichier d'une ligne par trajet. Les durées et
+distances sont rangées dans des tableaux denses, enregistrés au format NumPy
+(.npz), d'où sont tirées les requêtes « agence la plus proche » et « k plus
+proches ».
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from lots_trajets import LIMITE_DESTINATIONS, LIMITE_ELEMENTS, LIMITE_ORIGINES, iterer_lots
+from options_trajets import K_PLUS_PROCHES, NB_WORKERS
+
+
+def forme_tuile(nb_origines, nb_destinations):
+    """(origines, destinations) par tuile, donnant le moins de requêtes pour ce produit"""
+    meilleure = None
+    for origines in range(1, min(LIMITE_ORIGINES, max(nb_origines, 1)) + 1):
+        destinations = min(LIMITE_DESTINATIONS, LIMITE_ELEMENTS // origines, max(nb_destinations, 1))
+        requetes = math.ceil(nb_origines / origines) * math.ceil(nb_destinations / destinations)
+        if meilleure is None or requetes < meilleure[0]:
+            meilleure = (requetes, origines, destinations)
+    return meilleure[1], meilleure[2]
+
+
+def decouper_matrice(origines, destinations, params):
+    """Lots couvrant tout le produit origines × destinations.
+
+    Les adresses None (introuvables au géocodage) sont écartées. Chaque lot
+    porte, en plus des clés de `planifier_lots`, les positions 'lignes' et
+    'colonnes' de ses adresses dans la matrice.
+    """
+    lignes = [i for i, origine in enumerate(origines) if origine is not None]
+    colonnes = [j for j, destination in enumerate(destinations) if destination is not None]
+    taille_lignes, taille_colonnes = forme_tuile(len(lignes), len(colonnes))
+    lots = []
+    for debut_lignes in range(0, len(lignes), taille_lignes):
+        tuile_lignes = lignes[debut_lignes:debut_lignes + taille_lignes]
+        for debut_colonnes in range(0, len(colonnes), taille_colonnes):
+            tuile_colonnes = colonnes[debut_colonnes:debut_colonnes + taille_colonnes]
+            lots.append({
+                'params': params,
+                'origines': [origines[i] for i in tuile_lignes],
+                'destinations': [destinations[j] for j in tuile_colonnes],
+                'lignes': tuile_lignes,
+                'colonnes': tuile_colonnes,
+            })
+    return lots
+
+
+def calculer_matrice(moteur, origines, destinations, params, nb_workers=NB_WORKERS, limiteur=None,
+                     politique=None, metriques=None, sur_resultat=None):
+    """Calcule tous les trajets origines × destinations avec les mêmes paramètres d'appel.
+
+    Retourne (durees, distances) : tableaux float32 origines × destinations,
+    en secondes et en mètres, NaN lorsque le trajet n'a pas pu être calculé.
+    La durée retenue est celle avec trafic lorsque l'API la fournit.
+    `sur_resultat(traites, total)` est appelé après chaque tuile.
+    """
+    durees = np.full((len(origines), len(destinations)), np.nan, dtype=np.float32)
+    distances = np.full((len(origines), len(destinations)), np.nan, dtype=np.float32)
+    lots = decouper_matrice(origines, destinations, params)
+    total = sum(len(lot['lignes']) * len(lot['colonnes']) for lot in lots)
+
+    traites = 0
+    for lot, reponses in iterer_lots(moteur, lots, nb_workers, limiteur, politique, metriques):
+        for i, origine in zip(lot['lignes'], lot['origines']):
+            for j, destination in zip(lot['colonnes'], lot['destinations']):
+                element, erreur = reponses.get((origine, destination), (None, 'Réponse absente'))
+                if not erreur and element['status'] == 'OK':
+                    duree = element.get('duration_in_traffic', element['duration'])
+                    durees[i, j] = duree['value']
+                    distances[i, j] = element['distance']['value']
+        traites += len(lot['lignes']) * len(lot['colonnes'])
+        if sur_resultat:
+            sur_resultat(traites, total)
+    return durees, distances
+
+
+def enregistrer_matrice(chemin, origines, destinations, durees, distances):
+    """Enregistre la matrice et ses libellés dans un fichier NumPy compressé (.npz)"""
+    np.savez_compressed(
+        chemin,
+        origines=np.array(origines, dtype=str),
+        destinations=np.array(destinations, dtype=str),
+        durees=durees,
+        distances=distances,
+    )
+
+
+def charger_matrice(chemin):
+    """Relit une matrice enregistrée : (origines, destinations, durees, distances)"""
+    with np.load(chemin) as donnees:
+        return (
+            list(donnees['origines']), list(donnees['destinations']),
+            donnees['durees'], donnees['distances'],
+        )
+
+
+def table_matrice(origines, destinations, durees, distances):
+    """Format long (une ligne par couple), pour CSV, Parquet ou Arrow"""
+    return pd.DataFrame({
+        'Origine': pd.Categorical(np.repeat(np.array(origines, dtype=object), len(destinations))),
+        'Destination': pd.Categorical(np.tile(np.array(destinations, dtype=object), len(origines))),
+        'Durée (min)': np.round(durees.astype(np.float64).ravel() / 60, 1),
+        'Distance (km)': np.round(distances.astype(np.float64).ravel() / 1000, 2),
+    })
+
+
+def k_plus_proches(origines, destinations, durees, distances, k=K_PLUS_PROCHES):
+    """Pour chaque destination, les `k` origines les plus rapides, de la plus proche à la plus lointaine"""
+    k = max(1, min(k, len(origines)))
+    pleines = np.where(np.isnan(durees), np.inf, durees).T
+    # Sélection des k meilleures sans trier toute la ligne, puis tri de ces k seulement
+    if k < len(origines):
+        candidats = np.argpartition(pleines, k - 1, axis=1)[:, :k]
+    else:
+        candidats = np.tile(np.arange(len(origines)), (len(destinations), 1))
+    ordre = np.argsort(np.take_along_axis(pleines, candidats, axis=1), axis=1, kind='stable')
+    rangs = np.take_along_axis(candidats, ordre, axis=1)
+    colonnes = np.arange(len(destinations))[:, None]
+    valeurs = pleines[colonnes, rangs]
+    calcules = np.isfinite(valeurs)
+
+    destination, rang = np.nonzero(calcules)
+    origine = rangs[destination, rang]
+    return pd.DataFrame({
+        'Destination': np.array(destinations, dtype=object)[destination],
+        'Rang': rang + 1,
+        'Origine': np.array(origines, dtype=object)[origine],
+        'Durée (min)': np.round(valeurs[destination, rang].astype(np.float64) / 60, 1),
+        'Distance (km)': np.round(distances[origine, destination].astype(np.float64) / 1000, 2),
+    })
+
+
+def plus_proches(origines, destinations, durees, distances):
+    """Pour chaque destination, l'origine la plus rapide (agence la plus proche)"""
+    classement = k_plus_proches(origines, destinations, durees, distances, k=1)
+    return classement.drop(columns='Rang').rename(columns={'Origine': 'Origine la plus proche'})
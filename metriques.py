@@ -0,0 +1,272 @@
+"""Instrumentation des appels et comptabilité des coûts.
+
+Chaque appel Distance Matrix ou Geocoding est enregistré (latence, statut,
+éléments facturés), ainsi que les reprises et les accès au cache. Les mesures
+sont agrégées en compteurs et en histogrammes, exportables en JSON à la fin
+d'un calcul, ou au format texte Prometheus (fichier ou point d'accès HTTP)
+pendant les calculs longs. Le coût est calculé à partir des éléments
+réellement facturés.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from googlemaps import exceptions
+
+from options_trajets import HOTE_METRIQUES
+
+# Tarifs Google Maps Platform en dollars (hors crédit mensuel offert)
+PRIX_ELEMENT = {
+    'basique': 0.005,
+    # Distance Matrix Advanced : voiture avec heure de départ (trafic)
+    'avance': 0.01,
+}
+PRIX_GEOCODAGE = 0.005
+
+SEUILS_LATENCE = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SEUILS_ELEMENTS = [1, 5, 10, 25, 50, 100]
+
+
+def statut_erreur(erreur):
+    """Statut court d'une exception levée par un appel"""
+    if isinstance(erreur, exceptions.ApiError):
+        return erreur.status
+    if isinstance(erreur, exceptions.HTTPError):
+        return f"HTTP_{erreur.status_code}"
+    if isinstance(erreur, exceptions.Timeout):
+        return 'TIMEOUT'
+    if isinstance(erreur, exceptions.TransportError):
+        return 'TRANSPORT'
+    return type(erreur).__name__
+
+
+def sku_lot(params):
+    """Catégorie de facturation d'un appel Distance Matrix"""
+    if params.get('mode', 'driving') == 'driving' and params.get('departure_time') is not None:
+        return 'avance'
+    return 'basique'
+
+
+class Histogramme:
+    """Histogramme cumulatif à seuils fixes, au sens de Prometheus"""
+
+    def __init__(self, seuils):
+        self.seuils = list(seuils)
+        self.comptes = [0] * (len(self.seuils) + 1)
+        self.somme = 0.0
+        self.nombre = 0
+
+    def observer(self, valeur):
+        for i, seuil in enumerate(self.seuils):
+            if valeur <= seuil:
+                self.comptes[i] += 1
+                break
+        else:
+            self.comptes[-1] += 1
+        self.somme += valeur
+        self.nombre += 1
+
+    def cumul(self):
+        """[(seuil, nombre d'observations <= seuil)], le dernier seuil étant '+Inf'"""
+        total = 0
+        cumul = []
+        for seuil, compte in zip(self.seuils + ['+Inf'], self.comptes):
+            total += compte
+            cumul.append((seuil, total))
+        return cumul
+
+    def quantile(self, q):
+        """Estimation d'un quantile : seuil du premier intervalle qui l'atteint"""
+        if not self.nombre:
+            return None
+        for seuil, total in self.cumul():
+            if total >= q * self.nombre:
+                return seuil
+        return '+Inf'
+
+    def rapport(self):
+        return {
+            'nombre': self.nombre,
+            'somme': round(self.somme, 6),
+            'moyenne': round(self.somme / self.nombre, 6) if self.nombre else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'seuils': {str(seuil): total for seuil, total in self.cumul()},
+        }
+
+
+class MetriquesAppels:
+    """Compteurs et histogrammes des appels, partagés par tous les workers"""
+
+    def __init__(self):
+        self.debut = time.time()
+        self.requetes = {}
+        self.lots = 0
+        self.elements_factures = {sku: 0 for sku in PRIX_ELEMENT}
+        self.geocodages = {}
+        self.cache = {'succes': 0, 'echecs': 0}
+        self.locales = {'sur_place': 0, 'estimes': 0}
+        self.latence = Histogramme(SEUILS_LATENCE)
+        self.latence_geocodage = Histogramme(SEUILS_LATENCE)
+        self.elements_par_requete = Histogramme(SEUILS_ELEMENTS)
+        self._verrou = threading.Lock()
+
+    def enregistrer_lot(self):
+        """Un lot commence : les tentatives au-delà de la première sont des reprises"""
+        with self._verrou:
+            self.lots += 1
+
+    def enregistrer_appel(self, params, elements, latence, statut):
+        with self._verrou:
+            self.requetes[statut] = self.requetes.get(statut, 0) + 1
+            self.latence.observer(latence)
+            self.elements_par_requete.observer(elements)
+            if statut == 'OK':
+                self.elements_factures[sku_lot(params)] += elements
+
+    def enregistrer_geocodage(self, latence, statut):
+        with self._verrou:
+            self.geocodages[statut] = self.geocodages.get(statut, 0) + 1
+            self.latence_geocodage.observer(latence)
+
+    def enregistrer_cache(self, succes):
+        with self._verrou:
+            self.cache['succes' if succes else 'echecs'] += 1
+
+    def enregistrer_local(self, nature):
+        """Trajet répondu sans appel : 'sur_place' ou 'estimes'"""
+        with self._verrou:
+            self.locales[nature] += 1
+
+    @property
+    def reprises(self):
+        return max(0, sum(self.requetes.values()) - self.lots)
+
+    @property
+    def geocodages_factures(self):
+        """Les géocodages sans résultat sont facturés, pas les erreurs"""
+        return self.geocodages.get('OK', 0) + self.geocodages.get('ZERO_RESULTS', 0)
+
+    def cout(self):
+        """Coût en dollars des éléments et géocodages facturés"""
+        return (
+            sum(self.elements_factures[sku] * prix for sku, prix in PRIX_ELEMENT.items())
+            + self.geocodages_factures * PRIX_GEOCODAGE
+        )
+
+    def rapport(self):
+        with self._verrou:
+            return {
+                'debut': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.debut)),
+                'duree_s': round(time.time() - self.debut, 3),
+                'requetes': dict(self.requetes),
+                'lots': self.lots,
+                'reprises': self.reprises,
+                'elements_factures': dict(self.elements_factures),
+                'geocodages': dict(self.geocodages),
+                'geocodages_factures': self.geocodages_factures,
+                'cache': dict(self.cache),
+                'reponses_locales': dict(self.locales),
+                'cout_dollars': round(self.cout(), 4),
+                'latence_s': self.latence.rapport(),
+                'latence_geocodage_s': self.latence_geocodage.rapport(),
+                'elements_par_requete': self.elements_par_requete.rapport(),
+            }
+
+    def ecrire_json(self, chemin):
+        with open(chemin, 'w', encoding='utf-8') as f:
+            json.dump(self.rapport(), f, ensure_ascii=False, indent=2)
+
+    def format_prometheus(self):
+        """Exposition au format texte Prometheus"""
+        lignes = []
+
+        def compteur(nom, aide, valeurs, etiquette):
+            lignes.append(f"# HELP {nom} {aide}")
+            lignes.append(f"# TYPE {nom} counter")
+            for cle, valeur in valeurs.items():
+                lignes.append(f'{nom}{{{etiquette}="{cle}"}} {valeur}')
+
+        def histogramme(nom, aide, histo):
+            lignes.append(f"# HELP {nom} {aide}")
+            lignes.append(f"# TYPE {nom} histogram")
+            for seuil, total in histo.cumul():
+                lignes.append(f'{nom}_bucket{{le="{seuil}"}} {total}')
+            lignes.append(f"{nom}_sum {histo.somme}")
+            lignes.append(f"{nom}_count {histo.nombre}")
+
+        with self._verrou:
+            compteur('trajets_requetes_total', "Requêtes Distance Matrix par statut", self.requetes, 'statut')
+            compteur('trajets_elements_factures_total', "Éléments Distance Matrix facturés",
+                     self.elements_factures, 'sku')
+            compteur('trajets_geocodages_total', "Requêtes Geocoding par statut", self.geocodages, 'statut')
+            compteur('trajets_cache_total', "Accès au cache des trajets", self.cache, 'resultat')
+            compteur('trajets_reponses_locales_total', "Trajets répondus sans appel", self.locales, 'nature')
+            lignes.append("# HELP trajets_reprises_total Tentatives supplémentaires après une erreur passagère")
+            lignes.append("# TYPE trajets_reprises_total counter")
+            lignes.append(f"trajets_reprises_total {self.reprises}")
+            lignes.append("# HELP trajets_cout_dollars Coût estimé des appels facturés")
+            lignes.append("# TYPE trajets_cout_dollars gauge")
+            lignes.append(f"trajets_cout_dollars {self.cout():.4f}")
+            histogramme('trajets_latence_secondes', "Latence des requêtes Distance Matrix", self.latence)
+            histogramme('trajets_elements_par_requete', "Éléments par requête Distance Matrix",
+                        self.elements_par_requete)
+        return '\n'.join(lignes) + '\n'
+
+    def ecrire_prometheus(self, chemin):
+        """Écrit le fichier de façon atomique (collecteur textfile de node_exporter)"""
+        temporaire = f"{chemin}.tmp"
+        with open(temporaire, 'w', encoding='utf-8') as f:
+            f.write(self.format_prometheus())
+        os.replace(temporaire, chemin)
+
+
+class ExportPrometheus:
+    """Export périodique vers un fichier et/ou point d'accès HTTP /metrics"""
+
+    def __init__(self, metriques, fichier=None, port=None, intervalle=10.0, hote=HOTE_METRIQUES):
+        self.metriques = metriques
+        self.fichier = fichier
+        self.intervalle = intervalle
+        self._arret = threading.Event()
+        self._serveur = None
+        self._fil = None
+        if port:
+            self._serveur = ThreadingHTTPServer((hote, port), self._gestionnaire())
+            self._serveur.daemon_threads = True
+            threading.Thread(target=self._serveur.serve_forever, daemon=True).start()
+        if fichier:
+            self._fil = threading.Thread(target=self._boucle, daemon=True)
+            self._fil.start()
+
+    def _gestionnaire(self):
+        metriques = self.metriques
+
+        class Gestionnaire(BaseHTTPRequestHandler):
+            def do_GET(self):
+                contenu = metriques.format_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(contenu)))
+                self.end_headers()
+                self.wfile.write(contenu)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Gestionnaire
+
+    def _boucle(self):
+        while not self._arret.wait(self.intervalle):
+            self.metriques.ecrire_prometheus(self.fichier)
+
+    def arreter(self):
+        self._arret.set()
+        if self._fil:
+            self._fil.join()
+        if self.fichier:
+            self.metriques.ecrire_prometheus(self.fichier)
+        if self._serveur:
+            self._serveur.shutdown()
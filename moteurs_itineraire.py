@@ -0,0 +1,72 @@
+"""Moteurs d'itinéraire interchangeables.
+
+Le calcul des trajets ne dépend que de cette interface : un appel par paire
+(`calculer`), un appel par lot au format de réponse Distance Matrix
+(`calculer_lot`) et le géocodage d'une adresse (`geocoder`). Google Maps en est
+une implémentation ; le simulateur local (`simulateur_distance_matrix`) en est
+une autre, pour travailler hors ligne sans consommer de quota.
+"""
+
+MOTEURS = ('google', 'simulateur')
+
+# Délai des reprises internes du client `googlemaps` : quasi nul, pour que toute
+# reprise (limite de débit, erreurs 5xx) passe par PolitiqueReprise et soit comptée
+DELAI_REPRISES_CLIENT = 0.001
+
+
+class MoteurItineraire:
+    """Interface commune des moteurs d'itinéraire"""
+
+    nom = None
+
+    def calculer_lot(self, origines, destinations, **params):
+        """Retourne une réponse au format Distance Matrix ({'status', 'rows'}).
+
+        Lève une exception de `googlemaps.exceptions` si l'appel échoue.
+        """
+        raise NotImplementedError
+
+    def calculer(self, origine, destination, **params):
+        """Retourne l'élément de réponse d'une seule paire origine/destination"""
+        return self.calculer_lot([origine], [destination], **params)['rows'][0]['elements'][0]
+
+    def geocoder(self, adresse):
+        """Retourne (lat, lng) ou None si l'adresse est introuvable"""
+        raise NotImplementedError
+
+
+class MoteurGoogle(MoteurItineraire):
+    """Google Maps Distance Matrix et Geocoding, via le client `googlemaps`"""
+
+    nom = 'google'
+
+    def __init__(self, cle_api, url_api=None, **options):
+        import googlemaps
+
+        # Les reprises sont gérées par PolitiqueReprise : le client n'en fait aucune de son côté
+        # (une erreur 5xx remonte aussitôt en Timeout au lieu d'être retentée pendant 60 s)
+        options.setdefault('retry_over_query_limit', False)
+        options.setdefault('retry_timeout', DELAI_REPRISES_CLIENT)
+        if url_api:
+            options['base_url'] = url_api
+        self.client = googlemaps.Client(key=cle_api, **options)
+
+    def calculer_lot(self, origines, destinations, **params):
+        return self.client.distance_matrix(origines, destinations, **params)
+
+    def geocoder(self, adresse):
+        resultats = self.client.geocode(adresse, language='fr')
+        if not resultats:
+            return None
+        location = resultats[0]['geometry']['location']
+        return location['lat'], location['lng']
+
+
+def creer_moteur(nom, cle_api=None, url_api=None, **options):
+    """Crée le moteur d'itinéraire demandé ('google' ou 'simulateur')"""
+    if nom == 'google':
+        return MoteurGoogle(cle_api, url_api, **options)
+    if nom == 'simulateur':
+        from simulateur_distance_matrix import SimulateurDistanceMatrix
+        return SimulateurDistanceMatrix(**options)
+    raise ValueError(f"Moteur inconnu: '{nom}' (attendu: {', '.join(MOTEURS)})")
@@ -0,0 +1,145 @@
+"""Normalisation des colonnes d'entrée, en un seul passage par colonne.
+
+Les modes de transport, jours et heures de départ de tout le fichier sont
+résolus d'un coup, à partir d'une seule heure de référence : toutes les
+lignes partagent la même date de départ, et les valeurs invalides sont
+connues avant le moindre appel à l'API. La boucle des appels reçoit ensuite
+des enregistrements prêts à envoyer (mode de l'API, départ en datetime).
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from options_trajets import MODES_TRANSPORT
+
+# Jours de la semaine acceptés (français et anglais) -> numéro du jour
+NUMEROS_JOURS = {
+    'lundi': 0, 'monday': 0,
+    'mardi': 1, 'tuesday': 1,
+    'mercredi': 2, 'wednesday': 2,
+    'jeudi': 3, 'thursday': 3,
+    'vendredi': 4, 'friday': 4,
+    'samedi': 5, 'saturday': 5,
+    'dimanche': 6, 'sunday': 6
+}
+
+# Nom de la colonne d'heure, y compris mal décodé (export Excel en Latin-1)
+COLONNES_HEURE = ['Heure de départ', 'Heure de dÃ©part']
+
+# HH:MM, éventuellement suivi de secondes (heures relues depuis Parquet ou Excel)
+MOTIF_HEURE = r'^(\d{1,2}):(\d{2})(?::\d{2})?$'
+
+
+def _texte(colonne, index):
+    """Colonne en texte nettoyé ; vide si la colonne ou la valeur est absente"""
+    if colonne is None:
+        return pd.Series('', index=index, dtype='string')
+    return colonne.astype('string').str.strip().fillna('')
+
+
+def colonne_heure(df):
+    """Colonne des heures de départ, sous son nom correct ou mal décodé"""
+    for nom in COLONNES_HEURE:
+        if nom in df.columns:
+            return df[nom]
+    return None
+
+
+def normaliser_trajets(df, maintenant=None):
+    """Résout mode, jour et heure de départ de chaque ligne.
+
+    Une origine ou une destination vide rend la ligne invalide : elle n'est
+    jamais envoyée dans un lot, où elle ferait échouer toute la requête.
+    Retourne (normalise, anomalies). `normalise` est aligné sur l'index de
+    `df`, avec les colonnes 'mode' (mode de l'API), 'depart' (datetime ou
+    NaT sans heure de départ) et 'erreur' (message, vide si la ligne est
+    valide). Un jour désigne sa prochaine occurrence, la semaine prochaine
+    s'il s'agit d'aujourd'hui ; sans jour, le départ est aujourd'hui.
+    `anomalies` liste chaque valeur invalide (ligne, colonne, valeur, problème).
+    """
+    reference = pd.Timestamp(maintenant or datetime.now()).normalize()
+    index = df.index
+
+    modes = _texte(df.get('Mode de transport'), index)
+    mode_api = modes.str.upper().map(MODES_TRANSPORT)
+    mode_invalide = mode_api.isna()
+
+    heures = _texte(colonne_heure(df), index)
+    extraits = heures.str.extract(MOTIF_HEURE)
+    heure = pd.to_numeric(extraits[0])
+    minute = pd.to_numeric(extraits[1])
+    avec_heure = heures != ''
+    heure_invalide = avec_heure & (heure.isna() | (heure > 23) | (minute > 59))
+
+    jours = _texte(df.get('Jour'), index)
+    numero_jour = jours.str.lower().map(NUMEROS_JOURS)
+    avec_jour = jours != ''
+    jour_invalide = avec_jour & numero_jour.isna()
+
+    # Jours jusqu'à la prochaine occurrence du jour demandé (1 à 7), 0 sans jour
+    decalage = ((numero_jour - reference.weekday()) % 7).replace(0, 7).where(avec_jour & ~jour_invalide, 0)
+    depart = (
+        reference
+        + pd.to_timedelta(decalage.astype('float64'), unit='D')
+        + pd.to_timedelta(heure, unit='h')
+        + pd.to_timedelta(minute, unit='m')
+    ).where(avec_heure & ~heure_invalide)
+
+    adresses = {nom: _texte(df[nom], index) for nom in ('Origine', 'Destination') if nom in df.columns}
+    controles = [
+        (valeurs == '', nom, valeurs, f"{nom} manquante") for nom, valeurs in adresses.items()
+    ] + [
+        (mode_invalide, 'Mode de transport', modes, "Mode de transport inconnu: '{}' (attendu: "
+                                                    + ', '.join(MODES_TRANSPORT) + ")"),
+        (heure_invalide, 'Heure de départ', heures, "Heure de départ invalide: '{}' (attendu: HH:MM)"),
+        (jour_invalide, 'Jour', jours, "Jour inconnu: '{}'"),
+    ]
+    erreur = np.full(len(index), None, dtype=object)
+    morceaux = []
+    for masque, colonne, valeurs, message in reversed(controles):
+        messages = valeurs[masque].map(message.format)
+        # La première anomalie de la ligne (dans l'ordre des contrôles) l'emporte
+        erreur[masque.to_numpy()] = messages.to_numpy(dtype=object)
+        morceaux.append(pd.DataFrame({
+            'Ligne': masque[masque].index + 1,
+            'Colonne': colonne,
+            'Valeur': valeurs[masque].astype(object),
+            'Problème': messages.astype(object),
+        }))
+    anomalies = pd.concat(morceaux[::-1], ignore_index=True).sort_values('Ligne', kind='stable')
+
+    normalise = pd.DataFrame({
+        'mode': np.where(mode_invalide, None, mode_api.to_numpy(dtype=object)),
+        'depart': depart,
+        'erreur': erreur,
+    }, index=index)
+    return normalise, anomalies.reset_index(drop=True)
+
+
+def parametres_appel(mode, depart):
+    """Paramètres d'appel Distance Matrix d'un trajet normalisé"""
+    params = {'mode': mode, 'language': 'fr'}
+    if not pd.isna(depart):
+        params['departure_time'] = depart.to_pydatetime()
+        if mode == 'driving':
+            params['traffic_model'] = 'best_guess'
+    return params
+
+
+def enregistrements(normalise):
+    """(indice, mode, params, erreur) par ligne ; les lignes de mêmes paramètres partagent un dict.
+
+    `params` est None et `erreur` le message pour une ligne invalide.
+    """
+    partages = {}
+    for idx, mode, depart, erreur in zip(
+        normalise.index, normalise['mode'], normalise['depart'], normalise['erreur']
+    ):
+        if not pd.isna(erreur):
+            yield idx, mode, None, erreur
+            continue
+        cle = (mode, depart)
+        if cle not in partages:
+            partages[cle] = parametres_appel(mode, depart)
+        yield idx, mode, partages[cle], None
@@ -0,0 +1,237 @@
+"""Moteur de calcul commun au script et à l'application.
+
+Les deux interfaces passent par `calculer_trajets(trajets, moteur, ...)` :
+même normalisation des modes, jours et heures, mêmes lots, cache, estimation
+et workers, même lecture des réponses (durée avec trafic comprise) et mêmes
+colonnes de résultats, lien Google Maps compris. Le module peut aussi être
+appelé seul (banc d'essai, autres scripts).
+
+pandas et le client Google ne sont importés qu'au premier calcul : importer
+le module ne coûte rien au démarrage du script.
+"""
+from datetime import datetime, timedelta
+
+from options_trajets import MODES_TRANSPORT, NB_WORKERS
+
+URL_ITINERAIRE = "https://www.google.com/maps/dir/?api=1"
+
+
+def obtenir_mode_transport(mode):
+    """Convertit le mode de transport du fichier en mode Google Maps ; None pour un mode inconnu"""
+    return MODES_TRANSPORT.get(str(mode).strip().upper())
+
+
+def preparer_parametres(mode, heure_depart, jour_semaine=None, maintenant=None):
+    """Paramètres d'appel Distance Matrix d'un trajet.
+
+    Un jour désigne sa prochaine occurrence (la semaine prochaine s'il s'agit
+    d'aujourd'hui) ; sans jour, le départ est aujourd'hui.
+    """
+    from normalisation_trajets import NUMEROS_JOURS
+
+    params = {
+        'mode': mode,
+        'language': 'fr'
+    }
+
+    if heure_depart and str(heure_depart).strip():
+        aujourd_hui = maintenant or datetime.now()
+        jour_demande = NUMEROS_JOURS.get(str(jour_semaine or '').strip().lower())
+        if jour_demande is not None:
+            jours_jusque = (jour_demande - aujourd_hui.weekday()) % 7 or 7
+            date_depart = aujourd_hui + timedelta(days=jours_jusque)
+        else:
+            date_depart = aujourd_hui
+
+        heures, minutes = str(heure_depart).split(':')
+        params['departure_time'] = date_depart.replace(
+            hour=int(heures), minute=int(minutes), second=0, microsecond=0
+        )
+        if mode == 'driving':
+            params['traffic_model'] = 'best_guess'
+
+    return params
+
+
+def interpreter_element(element, erreur):
+    """Convertit un élément de réponse Distance Matrix en (temps, distance, statut).
+
+    Le temps est la durée avec trafic lorsque l'API la fournit.
+    """
+    if erreur:
+        return 'Erreur', '-', erreur
+    if element['status'] != 'OK':
+        return 'Erreur', '-', f"Trajet introuvable: {element['status']}"
+
+    temps = element.get('duration_in_traffic', element['duration'])['text']
+    distance = element['distance']['text']
+    if element.get('estime'):
+        return temps, distance, 'Estimé'
+    if element.get('sur_place'):
+        return temps, distance, 'Sur place'
+    if 'duration_in_traffic' in element:
+        return temps, distance, 'OK (avec trafic)'
+    return temps, distance, 'OK'
+
+
+def generer_urls_google_maps(origines, destinations, modes):
+    """Liens d'itinéraire Google Maps d'une colonne de trajets (modes de l'API, voiture par défaut)"""
+    return (
+        URL_ITINERAIRE + "&origin=" + origines.astype(str) + "&destination=" + destinations.astype(str)
+        + "&travelmode=" + modes.fillna('driving')
+    )
+
+
+def calculer_trajets(trajets, moteur, maintenant=None, cache=None, nb_workers=None, limiteur=None,
+                     politique=None, metriques=None, coordonnees=None, estimateur=None, normalise=None,
+                     deja_calcules=None, sur_resultat=None):
+    """Calcule un lot de trajets et retourne les résultats, alignés sur l'index de `trajets`.
+
+    `trajets` est un DataFrame (ou une liste de dicts) avec les colonnes
+    Origine, Destination, Mode de transport et, facultatives, Heure de départ
+    et Jour. Le résultat a les colonnes 'Temps de trajet', 'Distance',
+    'Statut', 'Lien Google Maps' et les colonnes numériques typées.
+
+    Modes, jours et heures sont normalisés d'un coup à partir de `maintenant`
+    (ou repris de `normalise`, déjà calculé par `normaliser_trajets`). Avec
+    `coordonnees` (adresse -> 'lat,lng'), les trajets sont envoyés en
+    coordonnées et ceux dont une adresse est introuvable ne sont pas envoyés.
+    Les lignes de `deja_calcules` ({index: dict de `TamponResultats.ligne`})
+    ne sont pas recalculées. `sur_resultat(position, tampon)` est appelé pour
+    chaque autre ligne terminée ; le `TamponResultats` permet d'en lire le
+    résultat ou d'afficher les résultats partiels. Cache, estimateur,
+    limiteur, politique de reprise et métriques sont ceux de `iterer_resultats`.
+    """
+    import pandas as pd
+
+    from analyse_trajets import TamponResultats
+    from lots_trajets import iterer_resultats
+    from normalisation_trajets import enregistrements, normaliser_trajets
+
+    if not isinstance(trajets, pd.DataFrame):
+        trajets = pd.DataFrame(trajets)
+    if normalise is None:
+        normalise, _ = normaliser_trajets(trajets, maintenant or datetime.now())
+
+    tampon = TamponResultats(trajets.index, normalise['depart'])
+    demandes = []
+    lignes_demandes = []
+
+    for position, ((idx, _, params, erreur), origine, destination) in enumerate(zip(
+        enregistrements(normalise), trajets['Origine'], trajets['Destination']
+    )):
+        # Ligne déjà calculée lors d'une exécution précédente
+        if deja_calcules and idx in deja_calcules:
+            tampon.restaurer(position, deja_calcules[idx])
+            continue
+
+        try:
+            if erreur is not None:
+                raise ValueError(erreur)
+            if coordonnees is not None:
+                for adresse in (origine, destination):
+                    if adresse not in coordonnees:
+                        raise ValueError(f"Adresse introuvable: {adresse}")
+                origine, destination = coordonnees[origine], coordonnees[destination]
+        except Exception as e:
+            tampon.erreur_saisie(position, str(e))
+            if sur_resultat:
+                sur_resultat(position, tampon)
+            continue
+
+        demandes.append((origine, destination, params))
+        lignes_demandes.append(position)
+
+    # Calculer les trajets par lots
+    for i, element, erreur in iterer_resultats(
+        moteur, demandes, cache, nb_workers or NB_WORKERS, limiteur, politique, metriques, estimateur
+    ):
+        position = lignes_demandes[i]
+        tampon.ecrire(position, interpreter_element(element, erreur), element, erreur)
+        if sur_resultat:
+            sur_resultat(position, tampon)
+
+    resultats = tampon.table()
+    resultats.insert(3, 'Lien Google Maps', generer_urls_google_maps(
+        trajets['Origine'], trajets['Destination'], normalise['mode']
+    ))
+    return resultats
+
+
+def paires_balayage(blocs, coordonnees=None):
+    """Paires uniques (origine, destination, mode) des blocs et demandes correspondantes pour `balayer`.
+
+    Heure de départ et Jour sont ignorés. Les paires dont le mode est inconnu
+    sont écartées plutôt que calculées en voiture. Avec `coordonnees`, une
+    paire dont une adresse est introuvable n'est pas envoyée : sa demande
+    vaut None. Retourne (paires, demandes, modes inconnus), paires et
+    demandes alignées.
+    """
+    import pandas as pd
+
+    paires = {}
+    for bloc in blocs:
+        for paire in bloc[['Origine', 'Destination', 'Mode de transport']].itertuples(index=False, name=None):
+            if not any(pd.isna(valeur) for valeur in paire):
+                paires.setdefault(paire, None)
+
+    valides, demandes, modes_inconnus = [], [], {}
+    for origine, destination, mode in paires:
+        mode_api = obtenir_mode_transport(mode)
+        if mode_api is None:
+            modes_inconnus.setdefault(mode, None)
+            continue
+        valides.append((origine, destination, mode))
+        if coordonnees is not None:
+            if origine not in coordonnees or destination not in coordonnees:
+                demandes.append(None)
+                continue
+            origine, destination = coordonnees[origine], coordonnees[destination]
+        demandes.append((origine, destination, mode_api))
+    return valides, demandes, list(modes_inconnus)
+
+
+def adresses_matrice(blocs, coordonnees=None):
+    """Origines et destinations uniques des blocs, lues comme deux listes indépendantes.
+
+    Retourne (origines, destinations, origines envoyées, destinations
+    envoyées) ; avec `coordonnees`, les adresses envoyées sont les
+    coordonnées, None pour une adresse introuvable.
+    """
+    origines, destinations = {}, {}
+    for bloc in blocs:
+        origines.update(dict.fromkeys(bloc['Origine'].dropna()))
+        destinations.update(dict.fromkeys(bloc['Destination'].dropna()))
+    origines, destinations = list(origines), list(destinations)
+    if coordonnees is None:
+        return origines, destinations, origines, destinations
+    return (
+        origines,
+        destinations,
+        [coordonnees.get(adresse) for adresse in origines],
+        [coordonnees.get(adresse) for adresse in destinations],
+    )
+
+
+def table_resultats(trajets, resultats):
+    """Fichier de résultats : colonnes d'entrée puis résultats, jointes par l'index.
+
+    Les colonnes d'entrée sont typées en texte : en Parquet ou Arrow, un
+    premier bloc dont l'heure ou le jour est entièrement vide ne fixe pas un
+    type numérique que les blocs suivants ne pourraient pas respecter.
+    """
+    import pandas as pd
+
+    from analyse_trajets import COLONNES_NUMERIQUES
+    from normalisation_trajets import colonne_heure
+
+    heures = colonne_heure(trajets)
+    entree = pd.DataFrame({
+        'Origine': trajets['Origine'],
+        'Destination': trajets['Destination'],
+        'Mode de transport': trajets['Mode de transport'],
+        'Heure de départ': heures if heures is not None else '',
+        'Jour': trajets['Jour'] if 'Jour' in trajets.columns else '',
+    }, index=trajets.index).astype('string')
+    sortie = resultats[['Temps de trajet', 'Distance', 'Lien Google Maps', 'Statut', *COLONNES_NUMERIQUES]]
+    return pd.concat([entree, sortie], axis=1)
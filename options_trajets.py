@@ -0,0 +1,72 @@
+"""Valeurs par défaut des options du script et de l'application.
+
+Ce module n'importe rien : le script peut lire ses options et afficher son
+aide sans charger pandas, NumPy ni le client Google. Les modules de calcul
+reprennent ici les valeurs qui les concernent.
+"""
+
+# Cache des trajets : fichier SQLite et arrondi de l'heure de départ
+FICHIER_CACHE = 'cache_trajets.sqlite'
+CRENEAU_MINUTES = 15
+
+# Nombre de requêtes menées en parallèle par défaut
+NB_WORKERS = 4
+
+# Débit autorisé : requêtes et éléments (origines x destinations) par seconde
+REQUETES_PAR_SECONDE = 10
+ELEMENTS_PAR_SECONDE = 1000
+
+# Tentatives maximum par requête en cas d'erreur passagère
+TENTATIVES = 5
+
+# Distance maximale entre les extrémités d'un trajet estimé et celles d'un trajet connu
+RAYON_METRES = 300
+
+# Nombre d'agences proposées par destination dans le classement de la matrice
+K_PLUS_PROCHES = 3
+
+# Adresse d'écoute du point d'accès /metrics : la machine locale, sauf hôte explicite
+HOTE_METRIQUES = '127.0.0.1'
+
+# Formats des fichiers de résultats -> extension
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Modes de transport du fichier -> modes de l'API
+MODES_TRANSPORT = {
+    'VOITURE': 'driving',
+    'TRANSPORTS': 'transit',
+    'VELO': 'bicycling',
+    'MARCHE': 'walking'
+}
+
+JOURS_SEMAINE = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
+
+# Grille du balayage des heures de départ
+JOURS_OUVRES = JOURS_SEMAINE[:5]
+HEURE_DEBUT = '06:00'
+HEURE_FIN = '10:00'
+PAS_MINUTES = 15
+
+
+def lire_jours(texte):
+    """'Lundi,Mercredi' ou 'Lundi-Vendredi' -> liste de jours de JOURS_SEMAINE"""
+    noms = {jour.lower(): jour for jour in JOURS_SEMAINE}
+    jours = []
+    for partie in str(texte).split(','):
+        bornes = [borne.strip().lower() for borne in partie.split('-')]
+        for borne in bornes:
+            if borne not in noms:
+                raise ValueError(f"Jour inconnu: '{borne}' (attendu: {', '.join(JOURS_SEMAINE)})")
+        debut = JOURS_SEMAINE.index(noms[bornes[0]])
+        fin = JOURS_SEMAINE.index(noms[bornes[-1]])
+        jours.extend(JOURS_SEMAINE[debut:fin + 1])
+    return list(dict.fromkeys(jours))
+
+
+def lire_heure(texte):
+    """'HH:MM' -> (heures, minutes)"""
+    heures, _, minutes = str(texte).strip().partition(':')
+    if not (heures.isdigit() and len(heures) <= 2 and minutes.isdigit() and len(minutes) == 2
+            and int(heures) < 24 and int(minutes) < 60):
+        raise ValueError(f"Heure invalide: '{texte}' (attendu: HH:MM)")
+    return int(heures), int(minutes)
@@ -0,0 +1,152 @@
+"""Reprise des appels en échec : classement des erreurs, backoff et disjoncteur de quota.
+
+Les erreurs passagères (limite de débit, erreurs serveur, délais dépassés) sont
+retentées avec un backoff exponentiel à gigue. Les erreurs définitives
+(NOT_FOUND, ZERO_RESULTS, requête invalide...) ne le sont pas. Un disjoncteur
+partagé par tous les workers suspend les appels quand le quota du jour est
+épuisé, ou quand la limite de débit persiste malgré le backoff, puis abandonne
+proprement si le quota ne revient pas. À la fin d'une pause, les workers
+repartent à des instants étalés pour ne pas retomber ensemble sur la limite.
+"""
+import random
+import threading
+import time
+
+from googlemaps import exceptions
+
+from options_trajets import TENTATIVES
+
+DELAI_BASE = 1.0
+DELAI_MAX = 30.0
+
+# Disjoncteur : durée de la pause et nombre de pauses consécutives avant abandon
+PAUSE_QUOTA = 60.0
+OUVERTURES_MAX = 3
+
+# Étalement de la reprise des workers après une pause, en fraction de la pause
+GIGUE_PAUSE = 0.25
+
+STATUTS_REESSAYABLES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+STATUTS_QUOTA = {'OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT'}
+
+
+class QuotaEpuise(Exception):
+    """Le quota de l'API n'est pas revenu après plusieurs pauses"""
+
+
+def est_quota(erreur):
+    """Vrai si l'erreur signale un quota ou une limite de débit atteints"""
+    return isinstance(erreur, exceptions.ApiError) and erreur.status in STATUTS_QUOTA
+
+
+def est_reessayable(erreur):
+    """Vrai si l'erreur est passagère et mérite une nouvelle tentative"""
+    if isinstance(erreur, (exceptions.Timeout, exceptions.TransportError)):
+        return True
+    if isinstance(erreur, exceptions.HTTPError):
+        return erreur.status_code == 429 or erreur.status_code >= 500
+    if isinstance(erreur, exceptions.ApiError):
+        return erreur.status in STATUTS_REESSAYABLES
+    return False
+
+
+class Disjoncteur:
+    """Suspend tous les workers pendant `pause` secondes quand le quota est atteint.
+
+    Chaque pause ouvre une nouvelle fenêtre : l'échec d'un appel lancé avant
+    la dernière pause ne la rouvre pas, si bien qu'une même vague d'échecs ne
+    compte qu'une ouverture.
+    """
+
+    def __init__(self, pause=PAUSE_QUOTA, ouvertures_max=OUVERTURES_MAX, gigue=GIGUE_PAUSE):
+        self.pause = pause
+        self.ouvertures_max = ouvertures_max
+        self.gigue = gigue
+        self.ouvertures = 0
+        self._ouvertures_consecutives = 0
+        self._fenetre = 0
+        self._ferme_a = 0.0
+        self._verrou = threading.Lock()
+
+    def declencher(self, fenetre=None):
+        """Ouvre le disjoncteur ; `fenetre` est celle retournée par `attendre` avant l'appel en échec"""
+        with self._verrou:
+            if time.monotonic() < self._ferme_a:
+                # Déjà ouvert par un autre worker
+                return
+            if fenetre is not None and fenetre != self._fenetre:
+                # Appel lancé avant la dernière pause : cet épisode est déjà compté
+                return
+            self.ouvertures += 1
+            self._ouvertures_consecutives += 1
+            self._fenetre += 1
+            self._ferme_a = time.monotonic() + self.pause
+
+    def reussite(self):
+        with self._verrou:
+            self._ouvertures_consecutives = 0
+
+    def attendre(self):
+        """Attend la fermeture du disjoncteur ; retourne (durée attendue, fenêtre courante)"""
+        with self._verrou:
+            if self._ouvertures_consecutives >= self.ouvertures_max:
+                raise QuotaEpuise("Quota épuisé, appels interrompus")
+            attente = self._ferme_a - time.monotonic()
+            fenetre = self._fenetre
+        if attente <= 0:
+            return 0.0, fenetre
+        # Reprise étalée : les workers ne repartent pas tous au même instant
+        attente += random.uniform(0, self.pause * self.gigue)
+        time.sleep(attente)
+        return attente, fenetre
+
+
+class PolitiqueReprise:
+    """Exécute un appel avec reprises ; comptabilise les reprises et le temps d'attente"""
+
+    def __init__(self, tentatives=TENTATIVES, delai_base=DELAI_BASE, delai_max=DELAI_MAX, disjoncteur=None):
+        self.tentatives = max(1, tentatives)
+        self.delai_base = delai_base
+        self.delai_max = delai_max
+        self.disjoncteur = disjoncteur
+        self.reprises = 0
+        self.attente = 0.0
+        self._verrou = threading.Lock()
+
+    def _compter(self, reprises, attente):
+        with self._verrou:
+            self.reprises += reprises
+            self.attente += attente
+
+    def executer(self, fonction, *args, **kwargs):
+        """Appelle `fonction` ; une limite de débit qui persiste après tout le backoff met
+        tous les workers en pause, puis l'appel reprend avec un nouveau backoff"""
+        tentative = 0
+        while True:
+            fenetre = None
+            if self.disjoncteur:
+                attente, fenetre = self.disjoncteur.attendre()
+                self._compter(0, attente)
+            try:
+                resultat = fonction(*args, **kwargs)
+            except Exception as e:
+                derniere = tentative >= self.tentatives - 1
+                # Pause commune seulement si le quota du jour est épuisé ou si le backoff n'a pas suffi ;
+                # après des pauses répétées sans succès, `attendre` lève QuotaEpuise
+                if est_quota(e) and self.disjoncteur and (e.status == 'OVER_DAILY_LIMIT' or derniere):
+                    self.disjoncteur.declencher(fenetre)
+                    if est_reessayable(e):
+                        tentative = 0
+                        self._compter(1, 0.0)
+                        continue
+                if not est_reessayable(e) or derniere:
+                    raise
+                # Backoff exponentiel à gigue complète, limite de débit comprise
+                delai = random.uniform(0, min(self.delai_max, self.delai_base * 2 ** tentative))
+                time.sleep(delai)
+                self._compter(1, delai)
+                tentative += 1
+                continue
+            if self.disjoncteur:
+                self.disjoncteur.reussite()
+            return resultat
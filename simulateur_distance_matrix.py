@@ -0,0 +1,268 @@
+"""Simulateur local de l'API Distance Matrix, utilisable comme moteur ou comme serveur HTTP.
+
+Le simulateur reproduit la forme des réponses Google (statuts, textes en
+français, `duration_in_traffic` en voiture avec heure de départ), les limites
+par requête (25 origines, 25 destinations, 100 éléments), une latence
+configurable et une limite de débit qui renvoie OVER_QUERY_LIMIT. Les durées
+sont déterministes pour une même paire, ce qui permet de comparer des
+exécutions et des moteurs entre eux.
+
+En serveur HTTP, il remplace maps.googleapis.com pour le client `googlemaps`.
+Le simulateur ignore la clé, mais le client exige une clé de la forme AIza... :
+
+    python simulateur_distance_matrix.py --port 8765
+    GOOGLE_MAPS_API_KEY=AIzaFAKE python calcul_trajets.py --url-api http://127.0.0.1:8765
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from googlemaps import exceptions
+
+from estimation_trajets import texte_distance, texte_duree
+from lots_trajets import LIMITE_DESTINATIONS, LIMITE_ELEMENTS, LIMITE_ORIGINES
+from moteurs_itineraire import MoteurItineraire
+
+# Vitesses moyennes (km/h) et temps fixe (s) par mode
+VITESSES = {'driving': 35.0, 'transit': 22.0, 'bicycling': 15.0, 'walking': 4.8}
+TEMPS_FIXE = {'driving': 60, 'transit': 300, 'bicycling': 30, 'walking': 0}
+
+# Centre des adresses simulées (Paris)
+CENTRE = (48.8566, 2.3522)
+
+
+def _alea(*cles):
+    """Nombre pseudo-aléatoire dans [0, 1[ déterminé par les clés"""
+    empreinte = hashlib.md5('|'.join(str(cle) for cle in cles).encode('utf-8')).digest()
+    return int.from_bytes(empreinte[:8], 'big') / 2 ** 64
+
+
+def _coordonnees(adresse):
+    """Coordonnées d'une adresse : 'lat,lng' telles quelles, sinon position simulée"""
+    try:
+        lat, lng = (float(partie) for partie in str(adresse).split(','))
+        return lat, lng
+    except ValueError:
+        return (
+            CENTRE[0] + (_alea('lat', adresse) - 0.5) * 0.4,
+            CENTRE[1] + (_alea('lng', adresse) - 0.5) * 0.6,
+        )
+
+
+def _distance_km(a, b):
+    """Distance à vol d'oiseau (haversine)"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(h))
+
+
+def facteur_trafic(depart, traffic_model=None):
+    """Surcoût du trafic selon l'heure de départ"""
+    heure = depart.hour + depart.minute / 60
+    if depart.weekday() < 5 and (7 <= heure < 9.5 or 16.5 <= heure < 19.5):
+        facteur = 1.45
+    elif 6 <= heure < 21:
+        facteur = 1.15
+    else:
+        facteur = 1.0
+    if traffic_model == 'pessimistic':
+        facteur *= 1.2
+    elif traffic_model == 'optimistic':
+        facteur *= 0.9
+    return facteur
+
+
+class SimulateurDistanceMatrix(MoteurItineraire):
+    """Moteur d'itinéraire simulé, sans réseau ni quota"""
+
+    nom = 'simulateur'
+
+    def __init__(self, latence=0.15, gigue=0.05, requetes_par_seconde=None, elements_par_seconde=None,
+                 taux_erreurs=0.0, taux_sans_resultat=0.0, graine=0):
+        self.latence = latence
+        self.gigue = gigue
+        self.requetes_par_seconde = requetes_par_seconde
+        self.elements_par_seconde = elements_par_seconde
+        self.taux_erreurs = taux_erreurs
+        self.taux_sans_resultat = taux_sans_resultat
+        self.requetes = 0
+        self.elements = 0
+        self.refus = 0
+        self._aleatoire = random.Random(graine)
+        self._fenetre = deque()
+        self._verrou = threading.Lock()
+
+    def _admettre(self, elements):
+        """Applique la limite de débit sur une fenêtre glissante d'une seconde"""
+        with self._verrou:
+            maintenant = time.monotonic()
+            while self._fenetre and maintenant - self._fenetre[0][0] > 1.0:
+                self._fenetre.popleft()
+            elements_fenetre = sum(n for _, n in self._fenetre)
+            if ((self.requetes_par_seconde and len(self._fenetre) + 1 > self.requetes_par_seconde)
+                    or (self.elements_par_seconde and elements_fenetre + elements > self.elements_par_seconde)):
+                self.refus += 1
+                return False
+            self._fenetre.append((maintenant, elements))
+            self.requetes += 1
+            self.elements += elements
+            return True
+
+    def _attendre(self):
+        with self._verrou:
+            attente = max(0.0, self._aleatoire.gauss(self.latence, self.gigue))
+            panne = self._aleatoire.random() < self.taux_erreurs
+        time.sleep(attente)
+        return panne
+
+    def _element(self, origine, destination, mode, depart, traffic_model):
+        if not str(origine).strip() or not str(destination).strip():
+            return {'status': 'NOT_FOUND'}
+        if _alea('sans_resultat', origine, destination, mode) < self.taux_sans_resultat:
+            return {'status': 'ZERO_RESULTS'}
+
+        # Distance routière : vol d'oiseau majoré, au moins quelques centaines de mètres
+        detour = 1.2 + 0.3 * _alea('detour', origine, destination)
+        metres = max(200, round(_distance_km(_coordonnees(origine), _coordonnees(destination)) * detour * 1000))
+        secondes = round(metres / 1000 / VITESSES.get(mode, VITESSES['driving']) * 3600 + TEMPS_FIXE.get(mode, 0))
+        element = {
+            'status': 'OK',
+            'distance': {'value': metres, 'text': texte_distance(metres)},
+            'duration': {'value': secondes, 'text': texte_duree(secondes)},
+        }
+        if mode == 'driving' and depart is not None:
+            secondes_trafic = round(secondes * facteur_trafic(depart, traffic_model))
+            element['duration_in_traffic'] = {'value': secondes_trafic, 'text': texte_duree(secondes_trafic)}
+        return element
+
+    def reponse(self, origines, destinations, mode='driving', departure_time=None, traffic_model=None, **params):
+        """Réponse brute au format JSON de l'API, sans lever d'exception.
+
+        Retourne (code HTTP, réponse) : 503 simule une panne passagère du serveur.
+        """
+        origines = list(origines) if isinstance(origines, (list, tuple)) else [origines]
+        destinations = list(destinations) if isinstance(destinations, (list, tuple)) else [destinations]
+        if len(origines) > LIMITE_ORIGINES or len(destinations) > LIMITE_DESTINATIONS:
+            return 200, {'status': 'MAX_DIMENSIONS_EXCEEDED', 'rows': []}
+        if len(origines) * len(destinations) > LIMITE_ELEMENTS:
+            return 200, {'status': 'MAX_ELEMENTS_EXCEEDED', 'rows': []}
+        if not self._admettre(len(origines) * len(destinations)):
+            return 200, {'status': 'OVER_QUERY_LIMIT', 'rows': []}
+        if self._attendre():
+            return 503, None
+
+        if isinstance(departure_time, (int, float)):
+            departure_time = datetime.fromtimestamp(departure_time)
+        elif departure_time == 'now':
+            departure_time = datetime.now()
+        return 200, {
+            'status': 'OK',
+            'origin_addresses': [str(origine) for origine in origines],
+            'destination_addresses': [str(destination) for destination in destinations],
+            'rows': [
+                {'elements': [
+                    self._element(origine, destination, mode, departure_time, traffic_model)
+                    for destination in destinations
+                ]}
+                for origine in origines
+            ],
+        }
+
+    def calculer_lot(self, origines, destinations, **params):
+        code, reponse = self.reponse(origines, destinations, **params)
+        if code != 200:
+            raise exceptions.HTTPError(code)
+        if reponse['status'] != 'OK':
+            if reponse['status'] == 'OVER_QUERY_LIMIT':
+                raise exceptions._OverQueryLimit(reponse['status'])
+            raise exceptions.ApiError(reponse['status'])
+        return reponse
+
+    def geocoder(self, adresse):
+        if not str(adresse).strip() or 'introuvable' in str(adresse).lower():
+            return None
+        return _coordonnees(adresse)
+
+
+def _gestionnaire(simulateur):
+    class Gestionnaire(BaseHTTPRequestHandler):
+        def _repondre(self, code, corps):
+            contenu = json.dumps(corps or {}, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(contenu)))
+            self.end_headers()
+            self.wfile.write(contenu)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {cle: valeurs[0] for cle, valeurs in parse_qs(url.query).items()}
+            if url.path == '/maps/api/distancematrix/json':
+                depart = params.get('departure_time')
+                if depart and depart != 'now':
+                    depart = int(depart)
+                code, corps = simulateur.reponse(
+                    params.get('origins', '').split('|'),
+                    params.get('destinations', '').split('|'),
+                    mode=params.get('mode', 'driving'),
+                    departure_time=depart,
+                    traffic_model=params.get('traffic_model')
+                )
+                self._repondre(code, corps)
+            elif url.path == '/maps/api/geocode/json':
+                position = simulateur.geocoder(params.get('address', ''))
+                if position is None:
+                    self._repondre(200, {'status': 'ZERO_RESULTS', 'results': []})
+                else:
+                    self._repondre(200, {'status': 'OK', 'results': [
+                        {'geometry': {'location': {'lat': position[0], 'lng': position[1]}}}
+                    ]})
+            else:
+                self._repondre(404, {'status': 'NOT_FOUND'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Gestionnaire
+
+
+def servir(simulateur, hote='127.0.0.1', port=8765):
+    """Sert le simulateur en HTTP, à la place de maps.googleapis.com"""
+    serveur = ThreadingHTTPServer((hote, port), _gestionnaire(simulateur))
+    serveur.daemon_threads = True
+    return serveur
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur local simulant l'API Distance Matrix")
+    parser.add_argument('--hote', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latence', type=float, default=0.15, help="Latence moyenne par requête, en secondes")
+    parser.add_argument('--gigue', type=float, default=0.05, help="Écart type de la latence, en secondes")
+    parser.add_argument('--qps', type=float, help="Requêtes par seconde avant OVER_QUERY_LIMIT")
+    parser.add_argument('--eps', type=float, help="Éléments par seconde avant OVER_QUERY_LIMIT")
+    parser.add_argument('--taux-erreurs', type=float, default=0.0, help="Proportion de réponses HTTP 503")
+    args = parser.parse_args(argv)
+
+    simulateur = SimulateurDistanceMatrix(
+        args.latence, args.gigue, args.qps, args.eps, args.taux_erreurs
+    )
+    serveur = servir(simulateur, args.hote, args.port)
+    print(f"🛰️  Simulateur Distance Matrix sur http://{args.hote}:{args.port}")
+    print(f"   Utilisation: GOOGLE_MAPS_API_KEY=AIzaFAKE python calcul_trajets.py --url-api http://{args.hote}:{args.port}")
+    try:
+        serveur.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 {simulateur.requetes} requêtes, {simulateur.elements} éléments, {simulateur.refus} refus")
+
+
+if __name__ == "__main__":
+    main()
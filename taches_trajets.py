@@ -0,0 +1,129 @@
+"""Exécution des calculs en tâches de fond.
+
+Les calculs longs sont soumis à un pool de workers partagé par tout le
+processus (toutes les sessions de l'application) : la page reste réactive,
+peut suivre l'avancement, annuler le calcul ou s'y reconnecter après la
+fermeture de l'onglet grâce à l'identifiant de la tâche. Le nombre de
+tâches simultanées est plafonné ; les tâches suivantes attendent leur tour.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+TACHES_SIMULTANEES = 2
+
+# Durée de conservation d'une tâche terminée (reconnexion, téléchargement)
+CONSERVATION_SECONDES = 3600
+
+EN_ATTENTE = 'en_attente'
+EN_COURS = 'en_cours'
+TERMINEE = 'terminee'
+ANNULEE = 'annulee'
+ECHEC = 'echec'
+
+
+class TacheAnnulee(Exception):
+    """Levée dans le calcul d'une tâche dont l'annulation a été demandée"""
+
+
+class Tache:
+    """Calcul soumis au gestionnaire : état, avancement, résultat ou erreur"""
+
+    def __init__(self, description='', cle=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.description = description
+        self.cle = cle
+        self.etat = EN_ATTENTE
+        self.etape = ''
+        self.traites = 0
+        self.total = 0
+        self.apercu = None
+        self.resultat = None
+        self.erreur = None
+        self.creation = time.time()
+        self.debut = None
+        self.fin = None
+        self._annulation = threading.Event()
+
+    @property
+    def terminee(self):
+        return self.etat in (TERMINEE, ANNULEE, ECHEC)
+
+    @property
+    def annulation_demandee(self):
+        return self._annulation.is_set()
+
+    def annuler(self):
+        """Demande l'arrêt : le calcul s'interrompt au prochain résultat"""
+        self._annulation.set()
+
+    def verifier(self):
+        """Lève TacheAnnulee si l'annulation a été demandée"""
+        if self._annulation.is_set():
+            raise TacheAnnulee()
+
+    def avancer(self, traites, total, etape=None):
+        """Publie l'avancement ; sert aussi de point d'annulation"""
+        self.verifier()
+        self.traites, self.total = traites, total
+        if etape is not None:
+            self.etape = etape
+
+
+class GestionnaireTaches:
+    """Pool de workers partagé par toutes les sessions, avec registre des tâches"""
+
+    def __init__(self, taches_simultanees=TACHES_SIMULTANEES, conservation=CONSERVATION_SECONDES):
+        self.conservation = conservation
+        self._executeur = ThreadPoolExecutor(max_workers=max(1, taches_simultanees), thread_name_prefix='tache')
+        self._taches = {}
+        self._verrou = threading.Lock()
+
+    def soumettre(self, fonction, *args, description='', cle=None):
+        """Planifie `fonction(tache, *args)` et retourne la Tache, dont le résultat sera la valeur retournée"""
+        tache = Tache(description, cle)
+        with self._verrou:
+            self._purger()
+            self._taches[tache.id] = tache
+        self._executeur.submit(self._executer, tache, fonction, args)
+        return tache
+
+    def _executer(self, tache, fonction, args):
+        tache.debut = time.time()
+        try:
+            tache.verifier()
+            tache.etat = EN_COURS
+            tache.resultat = fonction(tache, *args)
+            tache.etat = TERMINEE
+        except TacheAnnulee:
+            tache.etat = ANNULEE
+        except Exception as e:
+            tache.erreur = str(e)
+            tache.etat = ECHEC
+        finally:
+            tache.apercu = None
+            tache.fin = time.time()
+
+    def _purger(self):
+        limite = time.time() - self.conservation
+        for identifiant in [i for i, tache in self._taches.items() if tache.terminee and tache.fin < limite]:
+            del self._taches[identifiant]
+
+    def obtenir(self, identifiant):
+        """Tache de cet identifiant, ou None si elle est inconnue ou expirée"""
+        with self._verrou:
+            return self._taches.get(identifiant)
+
+    def position(self, tache):
+        """Nombre de tâches soumises avant celle-ci et pas encore terminées"""
+        with self._verrou:
+            return sum(
+                1 for autre in self._taches.values()
+                if not autre.terminee and autre.creation < tache.creation
+            )
+
+    def actives(self):
+        """Nombre de tâches en cours ou en attente"""
+        with self._verrou:
+            return sum(1 for tache in self._taches.values() if not tache.terminee)